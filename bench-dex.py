@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the DEX engine.  Run one of:
+
+    ./bench-dex.py transpile [--lines 10000]
+    ./bench-dex.py concurrency [--pulls 6] [--latency 0.05]
+    ./bench-dex.py scope [--lines 200]
+    ./bench-dex.py vector [--size 100000]
+    ./bench-dex.py graph [--edges 1000000]
+    ./bench-dex.py codecs [--rows 200000]
+    ./bench-dex.py stream [--mb 500]
+    ./bench-dex.py objcache [--nodes 500000]
+    ./bench-dex.py compress [--rows 1000000]
+"""
+
+import gc
+import io
+import re
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+from dictlib import Dict
+from polyform import dex
+from polyform.sls.plan import dex_plan
+from polyform.sls.graph import GraphIndex
+from polyform.sls import codecs, stream, reflex_arc
+
+def timed(func, *args, repeat=3):
+    """best of `repeat` runs, in seconds (with gc off, like timeit)"""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func(*args)
+            took = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best is None or took < best:
+            best = took
+    return best
+
+################################################################################
+# the regex transpiler dex_transpile() replaced, kept here to compare against
+LEGACY_ASSIGNMENT_RX = re.compile(r'''^([a-zA-Z0-9_"'\[\].]+)\s*=(?!=)+\s*(.*)''')
+LEGACY_FUNCTION_RX = re.compile(r'^([a-zA-Z0-9_]+)(\((.*)\))?$')
+LEGACY_INTERPOLATE_RX = re.compile(r'\$([a-zA-Z0-9_]+)')
+LEGACY_FOLLOW_RX = re.compile(r'([$a-zA-Z0-9_.]+)->([a-zA-Z0-9_.*]+)')
+COMMENT_DQ_RX = re.compile(r'''#.*$''')
+
+# _next_line_cleaned() and dex_trim() as they were in polyform.dex, verbatim
+def _next_line_cleaned(block):
+    if not block:
+        raise EOFError("unexpected end of data")
+    line = block[0]
+    match = COMMENT_DQ_RX.search(line)
+    if match is not None:
+        line = line[:match.start(0)]
+    #line.strip()
+    return (line.strip(), block[1:])
+
+def dex_trim(block): # where block is a list of strings
+    """
+    In order:
+      1. remove comments
+      2. remove blank lines
+      2. join multi-lines escaped with \\
+      3. remove excess whitespace on beginning/end of lines
+    """
+    out = list()
+    if isinstance(block, str):
+        block = re.split('\r?\n', block)
+    while block:
+        line, block = _next_line_cleaned(block)
+        if not line:
+            continue
+        while line[-1] == '\\':
+            line = line[0:-1]
+            nline, block = _next_line_cleaned(block)
+            line += nline
+        out.append(line)
+    return out
+
+# pylint: disable=too-many-branches
+def legacy_transpile(indata, default_assign=None):
+    """the prior regex substitution chain"""
+    out = list()
+    first = True
+    for line in dex_trim(indata):
+        match = LEGACY_ASSIGNMENT_RX.match(line)
+        if match:
+            key = match.group(1)
+            rest = match.group(2)
+            if '.' in key:
+                key = key.split(".")
+            else:
+                key = "'" + key + "'"
+            line = "{} |> assign(context, {})".format(rest, key)
+        elif first and default_assign and "assign(" not in line:
+            line = line + "|> assign(context, '" + default_assign + "')"
+            first = False
+        line = re.sub(LEGACY_FOLLOW_RX, lambda x: 'follow(' + x.group(1) + ",'" + x.group(2)+ "')", line)
+        line = re.sub(LEGACY_INTERPOLATE_RX, lambda x: "context['" + x.group(1) + "']", line)
+        stack = list()
+        place = 0
+        for part in re.split(r'\s*\|>\s*', line):
+            match = LEGACY_FUNCTION_RX.search(part)
+            if match:
+                stack.append([match.group(1), match.group(3)])
+            elif place == 0:
+                stack.append([None, part])
+            else:
+                stack.append([part, None])
+            place += 1
+        expr = ''
+        for func, arg in stack:
+            if not expr:
+                if not arg and func:
+                    expr = func
+                elif not func:
+                    expr = arg
+                else:
+                    expr = "{}({})".format(func, arg)
+            elif not arg:
+                expr = "{}({})".format(func, expr)
+            else:
+                expr = "{}({}, {})".format(func, expr, arg)
+        out.append(expr)
+    return out
+
+CORPUS = (
+    'model{n} = pull("BACFAF-1FA14D-{n:04X}", "pickle>>*") # a comment',
+    'person{n} = $invoker->behavior.phone.log |> is("human") |> matching_purpose("thing", reason)',
+    'employer{n} = employers |> polyform("pandim:employers.primary") |> as("days")',
+    'result.score{n} |> in_range(0.95, 1)',
+    'frame{n} = interface.input.csv |> convert("csv>>dataframe") |> autoclean',
+    'push(result.model, "FACFAF-{n:04X}", "*>>pickle")',
+    'ratio{n} = (debt + {n}) / income |> float',
+)
+
+def corpus(lines):
+    """a generated DEX block, of a mix of the sort of lines forms use"""
+    return "\n".join(CORPUS[num % len(CORPUS)].format(n=num) for num in range(lines))
+
+def bench_transpile(args):
+    """
+    transpile a generated block with the parser, and the legacy regex chain
+    (over the old dex_trim, which re-slices its line list, so it grows
+    quadratically).  On blocks the size forms are, the parser is the slower,
+    about 2.3x (38 against 16 us/line at 1000 lines); they cross between 10k
+    and 20k lines.  Transpiles are cached on disk (see polyform.dexcache).
+    """
+    print("{:>8} {:>12} {:>12} {:>10}".format("lines", "legacy ms", "parser ms", "us/line"))
+    for lines in (args.lines // 10, args.lines // 2, args.lines):
+        block = corpus(lines)
+        legacy = timed(legacy_transpile, block)
+        parser = timed(dex.dex_transpile, block)
+        print("{:>8} {:>12.1f} {:>12.1f} {:>10.1f}".format(
+            lines, legacy * 1000, parser * 1000, parser * 1e6 / lines))
+
+################################################################################
+class SlowBucket():
+    """stands in for S3, with a fixed round trip latency"""
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get(self, key=''):
+        """get an object"""
+        time.sleep(self.latency)
+        return io.BytesIO(key.encode())
+
+def bench_concurrency(args):
+    """a form pulling several participants, in sequence and concurrently"""
+    reflex_arc.S3BUCKET = SlowBucket(args.latency)
+    exprs = ["assign(pull('duid-{}'), context, 'p{}')".format(num, num)
+             for num in range(args.pulls)]
+    exprs.append("all(({}))".format(", ".join("p{}".format(num) for num in range(args.pulls))))
+    polyform = Dict(meta=Dict(owner='bench'))
+    def run():
+        reflex_arc.dex_intersect(polyform, exprs, mylocals=dict(context=dict()))
+    print("{:>8} {:>12} {:>12}".format("workers", "ms", "x latency"))
+    for workers in (1, args.pulls):
+        reflex_arc.CONCURRENCY = workers
+        reflex_arc.POOL = None
+        took = timed(run)
+        print("{:>8} {:>12.1f} {:>12.1f}".format(workers, took * 1000, took / args.latency))
+
+################################################################################
+def legacy_intersect(exprs, mylocals):
+    """dex_intersect's loop as it was, lifting all of context every line"""
+    mylocals = reflex_arc.dex_eval_locals(mylocals)
+    for step in dex_plan(exprs).steps:
+        mylocals.update(mylocals['context'])
+        if not step.run(mylocals):
+            raise reflex_arc.DEXError(nbr=step.nbr, expr=step.expr, status="not-true")
+    return mylocals['context']
+
+def bench_scope(args):
+    """per line cost of a DEX block, as the context grows"""
+    exprs = ["assign(key{} + 1, context, 'out{}')".format(num, num) for num in range(args.lines)]
+    polyform = Dict(meta=Dict(owner='bench'))
+    print("{:>8} {:>12} {:>12}".format("keys", "legacy us", "slots us"))
+    for size in (args.lines, 1000, 10000, 100000):
+        # re-running over the same context only rewrites the same keys
+        context = dict(("key{}".format(num), num) for num in range(size))
+        legacy = timed(legacy_intersect, exprs, dict(context=context))
+        slots = timed(reflex_arc.dex_intersect, polyform, exprs, dict(context=context))
+        print("{:>8} {:>12.1f} {:>12.1f}".format(
+            size, legacy * 1e6 / args.lines, slots * 1e6 / args.lines))
+
+def bench_vector(args):
+    """range and type checks over a batch of predictions, looped and vectorized"""
+    import numpy # pylint: disable=import-outside-toplevel
+    polyform = Dict(meta=Dict(owner='bench'))
+    scores = numpy.random.random(args.size)
+    looped = dex.dex_transpile("""
+        all(in_range(score, 0, 1) for score in scores)
+        all(is(float(score), "float") for score in scores)
+    """)
+    vectored = dex.dex_transpile("""
+        scores |> in_range(0, 1)
+        scores |> are("float")
+    """)
+    print("{:>8} {:>12} {:>12}".format("size", "looped ms", "vector ms"))
+    loop = timed(reflex_arc.dex_intersect, polyform, looped, dict(context=dict(scores=scores)))
+    vect = timed(reflex_arc.dex_intersect, polyform, vectored, dict(context=dict(scores=scores)))
+    print("{:>8} {:>12.1f} {:>12.1f}".format(args.size, loop * 1000, vect * 1000))
+
+def synthetic_graph(edges):
+    """
+    users -> behavior -> (phone|geoloc|voice) -> log, and the rest of the
+    edges at random between other nodes
+    """
+    users = edges // 20
+    kinds = ('phone', 'geoloc', 'voice')
+    for num in range(users):
+        yield ('u{}'.format(num), 'behavior', 'b{}'.format(num))
+        for kind in kinds:
+            yield ('b{}'.format(num), kind, '{}{}'.format(kind, num))
+            yield ('{}{}'.format(kind, num), 'log', 'log-{}{}'.format(kind, num))
+    rand = random.Random(1)
+    for _ in range(edges - users * (1 + 2 * len(kinds))):
+        yield ('n{}'.format(rand.randrange(users)), 'rel{}'.format(rand.randrange(50)),
+               'n{}'.format(rand.randrange(users)))
+
+def bench_graph(args):
+    """follow() over a synthetic graph, from the serialized index"""
+    start = time.perf_counter()
+    data = GraphIndex.build(synthetic_graph(args.edges)).to_bytes()
+    print("built {} edges in {:.1f}s, {:.1f} MB".format(
+        args.edges, time.perf_counter() - start, len(data) / 1e6))
+    graph = timed(GraphIndex.from_bytes, data)
+    print("load {:.1f} ms".format(graph * 1000))
+    graph = GraphIndex.from_bytes(data)
+    users = ['u{}'.format(num) for num in random.Random(2).sample(range(args.edges // 20), 1000)]
+    print("{:>24} {:>10}".format("follow", "us"))
+    for key in ('behavior', 'behavior.phone.log', 'behavior.*.log'):
+        took = timed(lambda key=key: [graph.follow(user, key) for user in users])
+        print("{:>24} {:>10.2f}".format(key, took * 1e6 / len(users)))
+
+def bench_codecs(args):
+    """pull() decode of a feature matrix, by format, from a local file"""
+    import numpy # pylint: disable=import-outside-toplevel
+    import pandas # pylint: disable=import-outside-toplevel
+    matrix = numpy.random.random((args.rows, 32))
+    frame = pandas.DataFrame(matrix, columns=["f{}".format(num) for num in range(32)])
+    print("{:>20} {:>10} {:>10}".format("typedef", "MB", "ms"))
+    for typedef, value in (('csv>>dataframe', frame), ('parquet>>dataframe', frame),
+                           ('arrow>>table', frame), ('arrow>>dataframe', frame),
+                           ('npy>>array', matrix)):
+        with tempfile.TemporaryFile() as wfd:
+            codecs.encoder('*>>' + typedef.split('>>')[0])(value, wfd)
+            size = wfd.tell()
+            decode = codecs.decoder(typedef)
+            def load(wfd=wfd, decode=decode):
+                wfd.seek(0)
+                return decode(wfd)
+            took = timed(load)
+        print("{:>20} {:>10.1f} {:>10.1f}".format(typedef, size / 1e6, took * 1000))
+
+class FileBody():
+    """stands in for an S3 StreamingBody over a local file: read(amt) only"""
+    def __init__(self, path):
+        self.rfd = open(path, 'rb', buffering=0)
+
+    def read(self, amt=None):
+        """read up to amt bytes"""
+        return self.rfd.read(amt)
+
+    def close(self):
+        """close the file"""
+        self.rfd.close()
+
+def legacy_pickle_pull(path):
+    """dex_pull's pickle path as it was: spool 4 KB reads to a temp file, then load"""
+    import pickle # pylint: disable=import-outside-toplevel
+    body = FileBody(path)
+    with tempfile.TemporaryFile() as wfd:
+        while wfd.write(body.read(amt=4096)):
+            pass
+        wfd.seek(0)
+        body.close()
+        return pickle.load(wfd)
+
+def stream_pickle_pull(path):
+    """unpickle straight from the body, with large buffered reads"""
+    with stream.open_stream(FileBody(path)) as rfd:
+        return codecs.decoder('pickle>>*')(rfd)
+
+def bench_stream(args):
+    """a pickle pull of a large object, spooled and streamed, from a local file"""
+    import pickle # pylint: disable=import-outside-toplevel
+    import numpy # pylint: disable=import-outside-toplevel
+    size = args.mb * 1000000 // 8
+    model = dict(weights=numpy.random.random(size // 2), bias=numpy.random.random(size // 2))
+    with tempfile.NamedTemporaryFile(suffix='.pickle') as wfd:
+        pickle.dump(model, wfd, protocol=4)
+        wfd.flush()
+        del model
+        print("{:>10} {:>10} {:>10}".format("path", "ms", "MB/s"))
+        for name, func in (('spooled', legacy_pickle_pull), ('streamed', stream_pickle_pull)):
+            took = timed(func, wfd.name)
+            print("{:>10} {:>10.0f} {:>10.0f}".format(name, took * 1000, args.mb / took))
+
+def bench_objcache(args):
+    """warm pickle pulls of a model, decoded each time and from the object cache"""
+    import pickle # pylint: disable=import-outside-toplevel
+    from polyform.sls.objcache import ObjectCache # pylint: disable=import-outside-toplevel
+    model = [dict(feature=i, split=i / 3, left=i * 2, right=i * 2 + 1) for i in range(args.nodes)]
+    data = pickle.dumps(model, protocol=4)
+    def fetch(etag):
+        if etag == '"1"':
+            return None, etag
+        return io.BytesIO(data), '"1"'
+    objects = ObjectCache(max_bytes=1 << 30)
+    print("{:>10} {:>10}".format("path", "ms"))
+    for name, func in (('decoded', lambda: pickle.load(fetch(None)[0])),
+                       ('cached', lambda: objects.pull(('model', 'pickle'), fetch, pickle.load))):
+        func()
+        print("{:>10} {:>10.2f}".format(name, timed(func) * 1000))
+
+def bench_compress(args):
+    """csv nodes compressed with each (installed) encoding: ratio, and ms to compress and read back"""
+    from polyform.sls import compress # pylint: disable=import-outside-toplevel
+    data = ("id,name,score\n" + "".join("{},name{},{}\n".format(i, i % 100, i % 7)
+                                      for i in range(args.rows))).encode()
+    print("{:>10} {:>10} {:>10} {:>10}".format("encoding", "ratio", "put ms", "pull ms"))
+    for name in sorted(compress.ENCODINGS):
+        try:
+            zfd = compress.compressed(io.BytesIO(data), name)
+        except ImportError:
+            print("{:>10} {:>10}".format(name, "n/a"))
+            continue
+        with zfd:
+            zdata = zfd.read()
+        ratio = len(data) / len(zdata)
+        put = timed(lambda: compress.compressed(io.BytesIO(data), name).close()) # pylint: disable=cell-var-from-loop
+        def pull():
+            compress.decompressed(io.BytesIO(zdata), name).read() # pylint: disable=cell-var-from-loop
+        print("{:>10} {:>10.1f} {:>10.0f} {:>10.0f}".format(name, ratio, put * 1000, timed(pull) * 1000))
+
+def main():
+    """ .. main .. """
+    parser = argparse.ArgumentParser()
+    subs = parser.add_subparsers(dest="bench")
+    sub = subs.add_parser("transpile", help=bench_transpile.__doc__)
+    sub.add_argument("--lines", type=int, default=10000)
+    sub.set_defaults(func=bench_transpile)
+    sub = subs.add_parser("concurrency", help=bench_concurrency.__doc__)
+    sub.add_argument("--pulls", type=int, default=6)
+    sub.add_argument("--latency", type=float, default=0.05)
+    sub.set_defaults(func=bench_concurrency)
+    sub = subs.add_parser("scope", help=bench_scope.__doc__)
+    sub.add_argument("--lines", type=int, default=200)
+    sub.set_defaults(func=bench_scope)
+    sub = subs.add_parser("vector", help=bench_vector.__doc__)
+    sub.add_argument("--size", type=int, default=100000)
+    sub.set_defaults(func=bench_vector)
+    sub = subs.add_parser("graph", help=bench_graph.__doc__)
+    sub.add_argument("--edges", type=int, default=1000000)
+    sub.set_defaults(func=bench_graph)
+    sub = subs.add_parser("codecs", help=bench_codecs.__doc__)
+    sub.add_argument("--rows", type=int, default=200000)
+    sub.set_defaults(func=bench_codecs)
+    sub = subs.add_parser("stream", help=bench_stream.__doc__)
+    sub.add_argument("--mb", type=int, default=500)
+    sub.set_defaults(func=bench_stream)
+    sub = subs.add_parser("objcache", help=bench_objcache.__doc__)
+    sub.add_argument("--nodes", type=int, default=500000)
+    sub.set_defaults(func=bench_objcache)
+    sub = subs.add_parser("compress", help=bench_compress.__doc__)
+    sub.add_argument("--rows", type=int, default=1000000)
+    sub.set_defaults(func=bench_compress)
+    args = parser.parse_args()
+    if not args.bench:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -17,13 +17,15 @@ from ..config import Config, to_yaml, to_json
 from ..util import osu
 from ..util.out import debug, notify, header, error, abort # pylint: disable=unused-import
 from ..dev.faas import FaaS
+from ..sls import profile
 from . import argp, auth, dudb, sls
 #from ..provider.aws import s3, dynamo
 
 ################################################################################
+# pylint: disable=too-many-public-methods
 class PolyformCli():
     """
-    General class for handling `poly` commands
+    General class for handling `poly` commands, a cmd_ method for each
     """
     base = None
     cfg = None
@@ -52,7 +54,7 @@ class PolyformCli():
     ############################################################################
     def _needs_config(self):
         """abort if the polyform configuration is not loaded"""
-        self.cfg = Config(path=self.args.config)
+        self.cfg = Config(path=self.args.config, cache=not self.args.no_cache)
         self.polyform = self.cfg.polyform
         if self.cfg.polyform is None:
             abort("No Polyform.yml in current folder")
@@ -270,6 +272,42 @@ class PolyformCli():
         faas.needs_deps(form)
         faas.docker_run(self._get_form_run(form), *self.args.args)
 
+    ############################################################################
+    def cmd_profile(self):
+        """
+        `poly profile {form_name} [logfile]`
+
+        Summarize the DEX profile records of a form, from a log file (or
+        stdin).  Profile with DEX_PROFILE=1 (or mem), or `profile: true`
+        on the form.
+        """
+        self._needs_config()
+        form = self._get_form("profile")
+        path = self._next_arg()
+        if path:
+            with open(path) as infile:
+                summary = profile.summarize(profile.read_profiles(infile, form=form))
+        else:
+            summary = profile.summarize(profile.read_profiles(sys.stdin, form=form))
+        if not summary['count']:
+            abort("No profile records for `{}`", form)
+
+        count = summary['count']
+        notify("{} invocations, mean {:.1f}ms", count, summary['seconds'] * 1000 / count)
+        print("{:<7} {:>4} {:>7} {:>10} {:>9} {:>9} {:>9}  {}".format(
+            "phase", "nbr", "calls", "total ms", "mean ms", "max ms", "peak KB", "expr"))
+        for step in summary['steps']:
+            print("{:<7} {:>4} {:>7} {:>10.1f} {:>9.2f} {:>9.2f} {:>9}  {}".format(
+                step['phase'], step['nbr'], step['calls'], step['seconds'] * 1000,
+                step['seconds'] * 1000 / count, step['max'] * 1000,
+                step['peak'] // 1024 if step['peak'] else '-', step['expr']))
+        print()
+        print("{:<12} {:>7} {:>10} {:>9}".format("builtin", "calls", "total ms", "mean ms"))
+        for name, stats in sorted(summary['builtins'].items(), key=lambda kv: -kv[1]['seconds']):
+            total = stats['seconds'] * 1000
+            print("{:<12} {:>7} {:>10.1f} {:>9.2f}".format(
+                name, stats['calls'], total, total / stats['calls']))
+
     ############################################################################
     def cmd_repl(self):
         """
@@ -39,7 +39,7 @@ def cmd_node_pull(config, duid):
     # TODO: should wrap this with a driver check, to handle various
     client = S3(**get_resource_config(config, 'BackingData'))
     rfd = client.get(key=duid)
-    while sys.stdout.buffer.write(rfd.read(amt=4096)):
+    while sys.stdout.buffer.write(rfd.read(4096)):
         pass
 #    dyn = S3(get_resource_config(config, 'BackingData'))
 #    item = dyn.get(id=duid)
@@ -19,7 +19,8 @@ import dictlib
 from dictlib import Obj as Dict
 import yaml
 from .gql import parse as gql_parse
-from .dex import dex_transpile
+from .dex import dex_transpile, DEXSyntaxError
+from .dexcache import DexCache
 from .util.out import debug, notify, header, error, abort # pylint: disable=unused-import
 
 def multiline_yaml(dumper, data):
@@ -40,9 +41,11 @@ GLOBAL_PIP = [
 ################################################################################
 class Config():
     """
-    Polyform.yml configuration object
+    Polyform.yml configuration object.  Transpiled DEX blocks are cached
+    in _build/.dexcache, next to Polyform.yml, unless cache=False.
     """
     polyform = None
+    dexcache = None
 
     def _find_path(self, path=None):
         """
@@ -55,7 +58,7 @@ class Config():
                     return path
         return None
 
-    def __init__(self, path=None, skeleton=False):
+    def __init__(self, path=None, skeleton=False, cache=True):
         spec = dict()
         if skeleton:
             spec = {}
@@ -64,6 +67,8 @@ class Config():
                 path = self._find_path(path)
             if not path:
                 abort("Cannot find Polyform.yml")
+            if cache:
+                self.dexcache = DexCache(os.path.join(os.path.dirname(path), "_build", ".dexcache"))
 
             with open(path) as infile:
                 try:
@@ -234,6 +239,17 @@ class ParseObj():
         """return the current key name"""
         return ".".join([self._parent, key])
 
+    def _dex(self, key, value, default_assign=None):
+        """transpile a DEX block, erroring with its location if it won't parse"""
+        config = getattr(self._get_root(), '_config', None)
+        try:
+            if config and config.dexcache:
+                return config.dexcache.transpile(value, default_assign=default_assign)
+            return dex_transpile(value, default_assign=default_assign)
+        except DEXSyntaxError as err:
+            self._error("{}: DEX syntax error, {}", key, err)
+        return None # not reached, _error() aborts
+
     def _is_type(self, key, value, etype, none=False):
         """error if type isn't a match; if none=True type can also be None"""
         if not isinstance(value, etype):
@@ -300,7 +316,7 @@ class Test(ParseObj):
         return self._is_type(key, value, dict)
 
     def _parse_expect(self, key, value, arg=None):
-        return dex_transpile(value)
+        return self._dex(key, value)
 
 ################################################################################
 class Dimensions(ParseObj):
@@ -325,19 +341,19 @@ class Dimensions(ParseObj):
                 self._error("Shouldn't reach this {} {}".format(type(value), value))
 
     def _parse_time(self, key, value):
-        return dex_transpile(value, default_assign='time')
+        return self._dex(key, value, default_assign='time')
 
     def _parse_geoloc(self, key, value):
-        return dex_transpile(value, default_assign='geoloc')
+        return self._dex(key, value, default_assign='geoloc')
 
     def _parse_participants(self, key, value):
-        return dex_transpile(value)
+        return self._dex(key, value)
 
     def _parse_finish(self, key, value):
-        return dex_transpile(value)
+        return self._dex(key, value)
     # this is for globals
     def _parse_expect(self, key, value, arg=None):
-        return dex_transpile(value)
+        return self._dex(key, value)
 
 
 ################################################################################
@@ -425,10 +441,10 @@ class Form(ParseObj):
         return self._is_type(key, value, str, none=True)
 
     def _parse_expect(self, key, value, arg=None):
-        return dex_transpile(value)
+        return self._dex(key, value)
 
     def _parse_finish(self, key, value):
-        return dex_transpile(value)
+        return self._dex(key, value)
 
     def _parse_interface(self, key, value):
         if not value:
@@ -457,6 +473,11 @@ class Form(ParseObj):
     def _parse_example(self, key, value, arg="unknown"):
         return self._is_type(key, value, str)
 
+    def _parse_profile(self, key, value):
+        if value not in (True, False, 'mem'):
+            self._error("{} must be true, false or mem", self._keyname(key))
+        return value
+
     def _parse_test(self, key, value):
         # TODO: verify DES
         return Test(parent=self, keyword="test", key=key, value=value)
@@ -10,14 +10,17 @@ build and manage our layers, testing, and development.
 import os
 import sys
 import time
+import py_compile
 # import hashlib
 from . import ENTRY # so we can print what method we are coming in on
 from ..util import datau, osu
 from ..util.out import debug, notify, header, error, abort # pylint: disable=unused-import
 
-def to_zip(dstdir=None, fname=None, ver=None, srcdir=None, src=None):
+# pylint: disable=too-many-arguments
+def to_zip(dstdir=None, fname=None, ver=None, srcdir=None, src=None, keep=None):
     """
-    Create a zipfile of a given folder, and link it to "latest"
+    Create a zipfile of a given folder, and link it to "latest".  Byte code
+    is left out, except for the files in `keep`.
     """
     os.chdir("/tmp") # so we are not in /_deps or /var/task, and osu.must_chdir will work
     zipfile = dstdir + "/" + fname.format(ver)
@@ -27,6 +30,8 @@ def to_zip(dstdir=None, fname=None, ver=None, srcdir=None, src=None):
         header("Zipping " + zipfile)
         osu.must_chdir(srcdir)
         osu.cmd(["zip", "-q", "--exclude", "*.pyc", "-r9", zipfile, src])
+        if keep:
+            osu.cmd(["zip", "-q", "-9", zipfile] + keep)
 
     osu.must_chdir(dstdir)
 #    header("Linking " + fname.format(ver) + " -> " + fname.format("latest"))
@@ -50,9 +55,16 @@ def export_zips(context):
              os.environ["POLYFORM_INCEPT"] + "/.", "/_deps/python/."])
     to_zip(dstdir=base, fname="libs.{}.zip", ver=cksum, srcdir="/_deps", src="python")
 
-    # then function
+    # then function, with its generated DEX plan byte-compiled by the lambda's
+    # python (/var/task is read only in lambda, so it can't be cached there)
+    keep = list()
+    if os.path.exists("/var/task/_polyform_plan.py"):
+        # not checked against the source: zip rounds its mtime to 2 seconds
+        pyc = py_compile.compile("/var/task/_polyform_plan.py", doraise=True,
+                                 invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        keep.append(os.path.relpath(pyc, "/var/task"))
     ttime = int(time.time() * 1000)
-    to_zip(dstdir=base, fname="func.{}.zip", ver=ttime, srcdir="/var/task", src=".")
+    to_zip(dstdir=base, fname="func.{}.zip", ver=ttime, srcdir="/var/task", src=".", keep=keep)
 
 def test_poly(context):
     """Shunt over to the testing module"""
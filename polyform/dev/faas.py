@@ -11,7 +11,8 @@ A few things:
   separate from the function itself.  Each ends up at:
   - _build/{functionName}.zip
   - _build/{functionName}-lib.zip
-* `src/` is the folder for the function
+* `src/` is the folder for the function, which gets `_polyform.json` (the trimmed
+  config) and `_polyform_plan.py` (its DEX as python, see sls.codegen)
 * Polyform.yml is the definition of the polyform
 
 
@@ -31,6 +32,7 @@ from ..util import osu, datau
 from ..util.out import debug, notify, header, error, abort # pylint: disable=unused-import
 from . import FOLDER, ENTRY
 from ..config import to_yaml
+from ..sls import codegen
 
 ################################################################################
 # FaaS wrapper in Docker
@@ -169,6 +171,7 @@ class Docker():
         config = export_polyconfig(self._info.poly, form_name)
         with open(os.path.join(self._info.owd, "src", "_polyform.json"), "w") as outf:
             outf.write(json.dumps(config))
+        codegen.write_module(config, os.path.join(self._info.owd, "src"))
 
     def needs_deps(self, form_name=None):
         """Build if needed, and add the deps mountpoint, for this FaaS"""
@@ -6,13 +6,15 @@ Copyright 2019 Brandon Gillespie; All rights reserved.
 
 This module is for dex bits to be run outside of a lambda.
 
-V1 Data Expectation Syntax. Dirty hack right now while I fiddle with things,
-but ultimately I need make this more standard w/BNF rules and a lexical parser.
+V1 Data Expectation Syntax.  A DEX block is tokenized in a single pass
+(dex_lex), parsed by recursive descent into a DEX AST which keeps line/column
+info (dex_parse), and python is generated from that AST (dex_transpile).
 
 Rules:
 
 * Expressions: each line is an expression that must return a "truthy" value.
-* Expression Line Break: Break lines by ending with a single backslash `\\`
+* Expression Line Break: Break lines by ending with a single backslash `\\`,
+  within brackets, or by starting the next line with a pipe `|>`
 * Assignments: Assining to a variable on the left (`var = expr`) puts the result
   of the expression into the context for the polyform.  Synonymous:
 
@@ -26,7 +28,13 @@ Rules:
         node->key
         follow(node, key)
 
-* Comment: `# comment` -- anything following a hashtag, doesn't care if it's quoted
+* Comment: `# comment` -- anything following a hashtag, outside of quotes
+* Pragma: `#!DEX key=value ...` -- a comment starting a line, with options for the block,
+  passed through as a '#!DEX ...' entry in the transpiled list.  Known options:
+
+    async=true  -- run the block on asyncio, awaiting I/O builtins (pull, push, polyform)
+    write_behind=true -- (finish) queue pushes, writing them while the output is
+                   validated (see polyform.sls.writebehind)
 * Pipeline: `|>`              -- pipe for "chaining" function calls.  Synonym:
 
     # pipelined as:
@@ -46,19 +54,47 @@ Rules:
 
 * Accepted functions:
     - assign(name, context, value) - for setting something in context
-    - pull('id')          - retrieve data at 'id' in universe
+    - pull('id')          - retrieve data at 'id' in universe.  With lazy=True
+                            it is fetched in the background, and only loaded
+                            when first used.  With cache=True the decoded value
+                            is kept in process, and reused while the data is
+                            unchanged (see polyform.sls.objcache)
+    - force(data)         - load lazily pulled data now
     - push(data, 'id')    - update data in universe at 'id'
+    - pull_many(ids, typedef) - pull each of ids, concurrently, as a list in the
+                            same order.  Failures are raised together, or
+                            with partial=True are None (and logged)
+    - push_many(items, typedef) - push each of items ({id: data}, or (id, data)
+                            pairs) concurrently
+    - gather(nodes, typedef) - pull_many() of a list of node ids, or nodes with
+                            an 'id' (anything else is kept as is), such as
+                            gather(model->entities) (see polyform.sls.batch)
     - follow(node, key)   - follow a key relationship off of node.  sugar: `->`
+                            key is labels joined by '.', '*' for any label.
+                            Dicts are dug into, node ids follow the graph
+                            (see polyform.sls.graph)
+    - polyform(data, 'name:form[.key]', 'cache=24h,shared=true')
+                          - call another polyform with data, giving its output
+                            (or key of it).  Results are cached for the TTL
+                            in `cache=`, `shared=true` caches across containers
+                            (see polyform.sls.cache)
     - to(data, 'label')   - convert data to the type specified by 'label'
-    - is(data, 'label')   - throw error if it is not data type, otherwise return data
+    - is(data, 'label')   - throw error if it is not data type, otherwise return data.
+                            For arrays/Series, scalar labels (int, float, ...)
+                            are checked against every element
     - are(data, 'label')  - sugar synonym with is(), for readability
     - in_range(data, start, end) - data is a number in the range of start to end
+                            (elementwise for arrays/Series)
+    - comparisons of arrays/Series give boolean masks, a line is true when all
+      of its mask is
     - tempfd()            - create a temporary read/write binary fd
     - load(binary, as_type) - load binary data with the as_type load method
                               (currently: xgb), return a filedescriptor (fd)
     - b64enc/b64dec       - encode/decode base64 to/from binary
     - inspect(data)       - output raw data to console, and return data # useful
                             for debugging
+    - function names which are python keywords (is, as, ...) are called as
+      is_(), as_(), ...
     - <<other function>>  - any other function reference is looked up in context
                             of executing service and its imported namespace
     - context             - data dictionary of input values and attributes (for expect phase)
@@ -69,106 +105,742 @@ Rules:
                                   ("dict>>dataframe", "X") (where x is the row index)
 """
 
-import json
 import re
+import ast
+import json
+import keyword
+
+# bump whenever dex_transpile() output changes, it keys the transpile cache
+DEX_VERSION = 3
 
-def _next_line_cleaned(block):
-    if not block:
-        raise EOFError("unexpected end of data")
-    line = block[0]
-    match = COMMENT_DQ_RX.search(line)
-    if match is not None:
-        line = line[:match.start(0)]
-    #line.strip()
-    return (line.strip(), block[1:])
-
-# as this is a quick hack, it is easier to do two rx's
-#COMMENTQ1_RX = re.compile(r'''(?:"[^"]*"|[^"#])*(#)''')
-#COMMENTQ2_RX = re.compile(r"""(?:'[^']*'|[^'#])*(#)""")
-#COMMENT_DQ_RX = re.compile(r'''(?:"(?:[^"\\]|\\.)*"|[^"#])*(#|$)''')
-#COMMENT_DQ_RX = re.compile(r'''(?:"[^"]*"|[^"#])*(#).*$''')
-#COMMENT_DQ_RX = re.compile(r'''([\#\@].*?)(?=([\r\n ]|$))''')
-#COMMENT_DQ_RX = re.compile(r'''
-#    (?:"[^"]*"|[^"#])*(#).*$
-#''', flags=re.VERBOSE)
-#COMMENT_DQ_RX = re.compile(r'''
-#(?:"[^"]*"|[^"#])*(#)
-#''')
-#'''
-#("[^"]*(?<!\\)"|[^"#]).*?(#)
-#'''
-#re.compile(r'''(?m),(?=[^"]*"(?:[^"\r\n]*"[^"]*")*[^"\r\n]*$)''')
-COMMENT_DQ_RX = re.compile(r'''#.*$''')
-
-def dex_trim(block): # where block is a list of strings
+################################################################################
+# Lexer: a single pass over the block, driven by one master regex
+
+class DEXSyntaxError(Exception):
     """
-    In order:
-      1. remove comments
-      2. remove blank lines
-      2. join multi-lines escaped with \\
-      3. remove excess whitespace on beginning/end of lines
-
-    >>> dex_trim('''
-    ... 0:begin basic line end # comment
-    ...   1:begin "#" moar "#\\""; end # comment "test"
-    ... 2:begin "#'"; end # comment
-    ... ''')
-    ['0:begin basic line end', '1:begin "', '2:begin "']
-    >>> dex_trim('line that \\\\\\nwraps    \\\\\\n many times')
-    ['line that wraps    many times']
+    A DEX block could not be parsed.  `line` and `col` are 1-based, relative
+    to the start of the block.
     """
-    # multiline in regex is a PITA, skip it for now
-    # >>> strip_comments('''
-    # ... 0:begin basic line end # comment
-    # ... 0:.................^---^cut here
-    # ... 1:begin "a#b\\""; end # "te#st" # moar
-    # ... 1:..............^---^cut here
-    # ... 2:begin "#" moar "#\\""; end # comment "test"
-    # ... 2:.....................^---^cut here
-    # ... 3:begin "#'"; end # comment.
-    # ... 3:............^---^cut here
-    # ... begin '\\'#\\''; end # comment.
-    # ... begin '"\\'#\\'"'; end # comment.
-    # ... begin "'# "; end # comment.
-    # ... # full line
-    # ... ''')
-    out = list()
-    if isinstance(block, str):
-        block = re.split('\r?\n', block)
-    while block:
-        line, block = _next_line_cleaned(block)
-        if not line:
-            continue
-        while line[-1] == '\\':
-            line = line[0:-1]
-            nline, block = _next_line_cleaned(block)
-            line += nline
-        out.append(line)
-    return out
+    def __init__(self, msg, line=0, col=0):
+        super().__init__("line {} col {}: {}".format(line, col, msg))
+        self.msg = msg
+        self.line = line
+        self.col = col
+
+# pylint: disable=too-few-public-methods
+class Token():
+    """A lexical token; kind is one of NAME VAR NUMBER STRING OP PRAGMA NEWLINE EOF"""
+    __slots__ = ('kind', 'value', 'line', 'col')
+
+    def __init__(self, kind, value, line, col):
+        self.kind = kind
+        self.value = value
+        self.line = line
+        self.col = col
+
+    def __repr__(self):
+        return "{}({!r})@{}:{}".format(self.kind, self.value, self.line, self.col)
+
+OPERATORS = ('|>', '->', '**', '//', '==', '!=', '<=', '>=', '<<', '>>',
+             '+', '-', '*', '/', '%', '@', '&', '|', '^', '~', '<', '>', '=',
+             '(', ')', '[', ']', '{', '}', ',', ':', '.')
+TOKEN_RX = re.compile(r'''[ \t\r\f]*(?:
+    (?P<NEWLINE>\n)
+  | (?P<PRAGMA>\#!DEX[^\n]*)
+  | (?P<COMMENT>\#[^\n]*)
+  | (?P<CONTINUE>\\[ \t\r\f]*(?:\#[^\n]*)?(?:\n|$))
+  | (?P<STRING>(?:[rRbBuUfF]{1,2})?(?:\'\'\'(?:[^\\]|\\.)*?\'\'\'|"""(?:[^\\]|\\.)*?"""
+               |\'(?:[^\'\\\n]|\\.)*\'|"(?:[^"\\\n]|\\.)*"))
+  | (?P<VAR>\$[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<NUMBER>0[xXoObB][0-9a-fA-F_]+
+               |(?:\d[\d_]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[eE][+-]?\d+)?[jJ]?)
+  | (?P<NAME>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<OP>''' + '|'.join(re.escape(op) for op in OPERATORS) + r''')
+  | (?P<END>$)
+  | (?P<ERROR>.))''', re.VERBOSE | re.DOTALL)
+OPENING = {'(': ')', '[': ']', '{': '}'}
+# tokens taken as they are (keeping track of brackets)
+SIMPLE_TOKENS = ('NAME', 'OP', 'NUMBER')
+BRACKETS = ('(', ')', '[', ']', '{', '}')
+
+def _nest(depth, value, line, col):
+    """track the brackets an operator opens or closes, in depth"""
+    if value in OPENING:
+        depth.append(OPENING[value])
+    elif value in (')', ']', '}'):
+        if not depth or depth.pop() != value:
+            raise DEXSyntaxError("unbalanced {!r}".format(value), line, col)
 
-    # >>> dex_transpile('''
-    # ...      # given/full/aliases/etc
-    # ...      $invoker->name.* why:"displaying in app"
-    # ...      # this why is the default, so is left out of the remaining
-    # ...      $invoker->behavior.phone.log why:$this.analyzePhoneLog
-    # ...      $invoker->behavior.geoloc.log why:$this
-    # ...      $invoker->behavior.geoloc.now why:$this as:socket
-    # ...      $invoker->behavior.voice.log why:$this
-    # ...      $invoker->behavior.scs.log why:$this
-    # ...      $invoker->thing.do why:$this as:call("api")
-    # ...      $invoker->behavior.*.log why:$this
-    # ...      $invoker->person.name why:$this format:synthetic
-    # ...      $invoker->person.health.bloodpressure why:$this format:synthetic
-    # ...      $invoker->my.photos.* why:$this as:real \\\\
-    # ...        doc:"only photos I tag for this app, such as whiteboard snapshots"
-    # ... ''')
-    # ohmy
-ASSIGNMENT_RX = re.compile(r'''^([a-zA-Z0-9_"'\[\].]+)\s*=(?!=)+\s*(.*)''')
-#ASSIGN_DIG_RX = re.compile(r'^([a-zA-Z0-9_.]+)\s*=(?!=)+\s*(.*)')
-FUNCTION_RX = re.compile(r'^([a-zA-Z0-9_]+)(\((.*)\))?$') # [^)]+)\))?$')
-INTERPOLATE_RX = re.compile(r'\$([a-zA-Z0-9_]+)')
-FOLLOW_RX = re.compile(r'([$a-zA-Z0-9_.]+)->([a-zA-Z0-9_.*]+)')
+# one flat loop over every token, as the lexer is most of transpiling's time
 # pylint: disable=too-many-branches
+def dex_lex(indata):
+    """
+    Break a DEX block (string or list of lines) into tokens, in one pass.
+    Newlines are only significant outside of brackets, and a `#!DEX` comment
+    starting a line is kept as a PRAGMA.
+
+    >>> [(tok.kind, tok.value) for tok in dex_lex('a = $b->c |> f("|>", 1) # x')]
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [('NAME', 'a'), ('OP', '='), ('VAR', 'b'), ('OP', '->'), ('NAME', 'c'),
+     ('OP', '|>'), ('NAME', 'f'), ('OP', '('), ('STRING', '"|>"'), ('OP', ','),
+     ('NUMBER', '1'), ('OP', ')'), ('NEWLINE', '\\n'), ('EOF', '')]
+    >>> [tok.kind for tok in dex_lex('f(a,\\n  b) \\\\\\n  |> g\\n\\n#!DEX async=true')]
+    ['NAME', 'OP', 'NAME', 'OP', 'NAME', 'OP', 'OP', 'NAME', 'NEWLINE', 'PRAGMA', 'NEWLINE', 'EOF']
+    >>> dex_lex('f(a ? b)')
+    Traceback (most recent call last):
+    ...
+    polyform.dex.DEXSyntaxError: line 1 col 5: unexpected character '?'
+    """
+    if not isinstance(indata, str):
+        indata = "\n".join(indata)
+    tokens = list()
+    depth = list()
+    line = 1
+    bol = 0 # offset of the beginning of the current line
+    for match in TOKEN_RX.finditer(indata): # back to back, as anything matches
+        kind = match.lastgroup
+        value = match.group(kind)
+        col = match.start(kind) - bol + 1
+        if kind in SIMPLE_TOKENS:
+            if value in BRACKETS:
+                _nest(depth, value, line, col)
+            tokens.append(Token(kind, value, line, col))
+            continue
+        if kind == 'ERROR':
+            raise DEXSyntaxError("unexpected character {!r}".format(value), line, col)
+        if kind == 'NEWLINE' or (kind == 'CONTINUE' and value[-1:] == "\n"):
+            if kind == 'NEWLINE' and not depth and tokens and tokens[-1].kind != 'NEWLINE':
+                tokens.append(Token(kind, value, line, col))
+            line += 1
+            bol = match.end()
+            continue
+        if kind in ('COMMENT', 'CONTINUE', 'END'):
+            continue
+        if kind == 'PRAGMA':
+            if depth or (tokens and tokens[-1].kind != 'NEWLINE'):
+                continue # just a comment, when not starting a line
+            value = value[5:].strip()
+        elif kind == 'VAR':
+            value = value[1:]
+        line += value.count("\n") # only strings span lines
+        tokens.append(Token(kind, value, line, col))
+    pos = len(indata)
+    if depth:
+        raise DEXSyntaxError("missing {!r} at end of block".format(depth[-1]), line, pos - bol + 1)
+    if tokens and tokens[-1].kind != 'NEWLINE':
+        tokens.append(Token('NEWLINE', "\n", line, pos - bol + 1))
+    tokens.append(Token('EOF', '', line, pos - bol + 1))
+    return tokens
+
+################################################################################
+# DEX AST.  Every node knows where it started (line/col) and can generate its
+# python equivalent with .python()
+
+class Node():
+    """
+    Base DEX AST node.  Subclasses name their values in `fields` (which are
+    also their slots), and they are set in order by __init__.
+    """
+    __slots__ = ('line', 'col')
+    fields = ()
+
+    def __init__(self, *values, tok=None):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+        self.line = tok.line if tok else 0
+        self.col = tok.col if tok else 0
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__,
+                               ", ".join(repr(getattr(self, name)) for name in self.fields))
+
+    def python(self):
+        """generate python source for this node"""
+        raise NotImplementedError()
+
+    def callee(self):
+        """python source for this node, when used as something to call"""
+        return self.python()
+
+# the fields of subclasses are set by Node.__init__, which pylint can't see
+# pylint: disable=no-member
+
+def _wrapped(node):
+    return "(" + node.python() + ")"
+
+class Name(Node):
+    """a plain name; DEX function names which are python keywords get a trailing _"""
+    __slots__ = fields = ('id',)
+    def python(self):
+        return self.id
+
+class Var(Node):
+    """`$name` interpolation -- a value from the context"""
+    __slots__ = fields = ('name',)
+    def python(self):
+        return "context[{!r}]".format(self.name)
+
+class Const(Node):
+    """a literal, kept as source text"""
+    __slots__ = fields = ('text',)
+    def python(self):
+        return self.text
+
+class Group(Node):
+    """a parenthesized expression"""
+    __slots__ = fields = ('expr',)
+    def python(self):
+        return _wrapped(self.expr)
+
+class Attr(Node):
+    """value.name"""
+    __slots__ = fields = ('value', 'name')
+    def python(self):
+        return "{}.{}".format(self.value.callee(), self.name)
+
+class Index(Node):
+    """value[items]"""
+    __slots__ = fields = ('value', 'items')
+    def python(self):
+        return "{}[{}]".format(self.value.callee(), ", ".join(item.python() for item in self.items))
+
+class Slice(Node):
+    """lower:upper:step, any part of which may be None"""
+    __slots__ = fields = ('lower', 'upper', 'step')
+    def python(self):
+        parts = [part.python() if part else '' for part in (self.lower, self.upper)]
+        if self.step:
+            parts.append(self.step.python())
+        return ":".join(parts)
+
+class Call(Node):
+    """func(args)"""
+    __slots__ = fields = ('func', 'args')
+    def python(self):
+        return self.with_args([arg.python() for arg in self.args])
+
+    def with_args(self, args):
+        """call source with the given (already generated) arguments"""
+        return "{}({})".format(self.func.callee(), ", ".join(args))
+
+class Keyword(Node):
+    """name=value, as a call argument"""
+    __slots__ = fields = ('name', 'value')
+    def python(self):
+        return "{}={}".format(self.name, self.value.python())
+
+class Star(Node):
+    """*value or **value"""
+    __slots__ = fields = ('op', 'value')
+    def python(self):
+        return self.op + self.value.python()
+
+class Follow(Node):
+    """node->key: follow a relationship from a node in the universe"""
+    __slots__ = fields = ('node', 'key')
+    def python(self):
+        return "follow({},{!r})".format(self.node.python(), self.key)
+
+class BinOp(Node):
+    """left op right, including boolean operators and comparisons"""
+    __slots__ = fields = ('left', 'op', 'right')
+    def python(self):
+        return "{} {} {}".format(self.left.python(), self.op, self.right.python())
+    def callee(self):
+        return _wrapped(self)
+
+class UnaryOp(Node):
+    """op operand"""
+    __slots__ = fields = ('op', 'operand')
+    def python(self):
+        if self.op == 'not':
+            return "not " + self.operand.python()
+        return self.op + self.operand.python()
+    def callee(self):
+        return _wrapped(self)
+
+class IfExp(Node):
+    """body if test else orelse"""
+    __slots__ = fields = ('body', 'test', 'orelse')
+    def python(self):
+        return "{} if {} else {}".format(self.body.python(), self.test.python(),
+                                         self.orelse.python())
+    def callee(self):
+        return _wrapped(self)
+
+class Lambda(Node):
+    """lambda params: body; params are (prefix, name, default) tuples"""
+    __slots__ = fields = ('params', 'body')
+    def python(self):
+        params = ", ".join(prefix + name + ("=" + default.python() if default else "")
+                           for prefix, name, default in self.params)
+        if params:
+            return "lambda {}: {}".format(params, self.body.python())
+        return "lambda: " + self.body.python()
+    def callee(self):
+        return _wrapped(self)
+
+class Seq(Node):
+    """a display: list, tuple, set, or dict (items are Pair nodes)"""
+    __slots__ = fields = ('opening', 'items', 'closing')
+    def python(self):
+        items = [item.python() for item in self.items]
+        if self.opening == '(' and len(items) == 1:
+            items[0] += ','
+        return self.opening + ", ".join(items) + self.closing
+    def callee(self):
+        if not self.opening:
+            return _wrapped(self)
+        return self.python()
+
+class Pair(Node):
+    """key: value, within a dict display"""
+    __slots__ = fields = ('key', 'value')
+    def python(self):
+        return "{}: {}".format(self.key.python(), self.value.python())
+
+class Comp(Node):
+    """a comprehension or generator; clauses are ('for', target, iter) or ('if', cond)"""
+    __slots__ = fields = ('opening', 'elt', 'clauses', 'closing')
+    def python(self):
+        out = [self.elt.python()]
+        for clause in self.clauses:
+            if clause[0] == 'for':
+                out.append("for {} in {}".format(clause[1].python(), clause[2].python()))
+            else:
+                out.append("if " + clause[1].python())
+        return self.opening + " ".join(out) + self.closing
+    def callee(self):
+        if not self.opening:
+            return _wrapped(self)
+        return self.python()
+
+class Pipe(Node):
+    """stage |> stage ..., each result becoming the first argument of the next"""
+    __slots__ = fields = ('stages',)
+    def python(self):
+        expr = self.stages[0].python()
+        for stage in self.stages[1:]:
+            if isinstance(stage, Call):
+                expr = stage.with_args([expr] + [arg.python() for arg in stage.args])
+            else:
+                expr = "{}({})".format(stage.callee(), expr)
+        return expr
+    def callee(self):
+        return _wrapped(self)
+
+class Assign(Node):
+    """target = value; target is a list of keys into the context"""
+    __slots__ = fields = ('target', 'value')
+    def python(self):
+        return assign_py(self.value.python(), self.target)
+
+class Pragma(Node):
+    """`#!DEX key=value ...` at the start of a line"""
+    __slots__ = fields = ('options',)
+    def python(self):
+        return "#!DEX " + " ".join(
+            "{}={}".format(key, value) if value else key for key, value in self.options.items())
+
+# pylint: enable=no-member
+
+def assign_py(expr, target):
+    """python to assign expr into the context at target (list of keys)"""
+    if len(target) > 1:
+        return "assign({}, context, {})".format(expr, list(target))
+    return "assign({}, context, {!r})".format(expr, target[0])
+
+################################################################################
+# Parser: recursive descent over dex_lex() tokens, roughly:
+#
+#   block      := { [statement] NEWLINE }
+#   statement  := PRAGMA | [target '='] pipeline
+#   target     := (NAME | VAR) { '.' NAME | '->' NAME | '[' literal ']' }
+#   pipeline   := test { [NEWLINE] '|>' test }
+#   test       := lambda | binary ['if' binary 'else' test]
+#   binary     := python boolean, comparison and arithmetic operators, by
+#                 precedence (see BINARY_OPS), over factor := [+-~] postfix ['**' factor]
+#   postfix    := atom { '(' args ')' | '[' subscripts ']' | '.' NAME | '->' key }
+#   key        := (NAME | NUMBER | '*') { '.' (NAME | NUMBER | '*') } | STRING
+#   atom       := NAME | VAR | NUMBER | STRING+ | (...) | [...] | {...}
+#
+# pipelines may be used anywhere an expression is expected within brackets.
+
+# how tightly binary operators bind: `not` (a prefix) is between `and` and
+# the comparisons, and ARITH (bitwise and arithmetic) binds tighter
+BINARY_OPS = {'or': 1, 'and': 2,
+              '<': 4, '>': 4, '==': 4, '>=': 4, '<=': 4, '!=': 4, 'in': 4, 'is': 4, 'not': 4,
+              '|': 5, '^': 6, '&': 7, '<<': 8, '>>': 8, '+': 9, '-': 9,
+              '*': 10, '/': 10, '//': 10, '%': 10, '@': 10}
+NOT = 3
+ARITH = 5
+POSTFIX_OPS = ('(', '[', '.', '->')
+CONSTANTS = ('None', 'True', 'False')
+
+def dex_name(name):
+    """
+    a DEX name as python: those which are python keywords get a trailing _
+
+    >>> dex_name('is'), dex_name('person')
+    ('is_', 'person')
+    """
+    if keyword.iskeyword(name):
+        return name + '_'
+    return name
+
+# pylint: disable=too-many-public-methods
+class DexParser():
+    """
+    Recursive descent parser from tokens to DEX AST statement nodes, with a
+    method for each rule of the grammar (hence so many of them).
+
+    >>> DexParser(dex_lex('x = $a->b.c |> f(1)')).parse()
+    [Assign(['x'], Pipe([Follow(Var('a'), 'b.c'), Call(Name('f'), [Const('1')])]))]
+    >>> DexParser(dex_lex('bad = ')).parse()
+    Traceback (most recent call last):
+    ...
+    polyform.dex.DEXSyntaxError: line 1 col 7: unexpected end of line
+    """
+    tokens = None
+    pos = 0
+
+    def __init__(self, tokens):
+        # pad with EOF, so looking ahead never needs a bounds check
+        self.tokens = tokens + tokens[-1:] * 3
+        self.pos = 0
+
+    ############################################################################
+    def peek(self, offset=0):
+        """look at a token without consuming it"""
+        return self.tokens[self.pos + offset]
+
+    def advance(self):
+        """consume and return the current token"""
+        tok = self.tokens[self.pos]
+        if tok.kind != 'EOF':
+            self.pos += 1
+        return tok
+
+    def check(self, kind, value=None, offset=0):
+        """is the token at offset of this kind (and value)?"""
+        tok = self.tokens[self.pos + offset]
+        return tok.kind == kind and (value is None or tok.value == value)
+
+    def accept(self, kind, value=None):
+        """consume the current token if it matches"""
+        tok = self.tokens[self.pos]
+        if tok.kind == kind and (value is None or tok.value == value) and kind != 'EOF':
+            self.pos += 1
+            return tok
+        return None
+
+    def expect(self, kind, value=None):
+        """consume the current token, which must match"""
+        if not self.check(kind, value):
+            self.error("expected {}".format(repr(value) if value else kind))
+        return self.advance()
+
+    def error(self, msg, tok=None):
+        """raise a syntax error at the current (or given) token"""
+        tok = tok or self.peek()
+        if tok.kind == 'NEWLINE':
+            msg = msg if msg[:8] == 'expected' else "unexpected end of line"
+        elif tok.kind == 'EOF':
+            msg = "unexpected end of block"
+        raise DEXSyntaxError(msg, tok.line, tok.col)
+
+    ############################################################################
+    def parse(self):
+        """parse the whole block into a list of statements"""
+        stmts = list()
+        while not self.check('EOF'):
+            if self.accept('NEWLINE'):
+                continue
+            stmts.append(self.statement())
+            if not self.accept('NEWLINE'):
+                self.error("unexpected {!r}".format(self.peek().value))
+        return stmts
+
+    def statement(self):
+        """a pragma, assignment or expression"""
+        tok = self.peek()
+        if tok.kind == 'PRAGMA':
+            self.advance()
+            options = dict()
+            for opt in tok.value.split():
+                key, _, value = opt.partition('=')
+                options[key] = value
+            return Pragma(options, tok=tok)
+        target = self.target()
+        value = self.pipeline()
+        if target:
+            return Assign(target, value, tok=tok)
+        return value
+
+    def target(self):
+        """if this is an assignment, consume the target and `=`, returning its keys"""
+        start = self.pos
+        if self.check('NAME') or self.check('VAR'):
+            keys = [self.advance().value]
+            while True:
+                if (self.check('OP', '.') or self.check('OP', '->')) \
+                   and self.check('NAME', offset=1):
+                    self.advance()
+                    keys.append(self.advance().value)
+                elif self.check('OP', '[') and self.check('OP', ']', offset=2) and \
+                     (self.check('STRING', offset=1) or self.check('NUMBER', offset=1)):
+                    self.advance()
+                    keys.append(ast.literal_eval(self.advance().value))
+                    self.advance()
+                else:
+                    break
+            if self.accept('OP', '='):
+                return keys
+        self.pos = start
+        return None
+
+    def pipeline(self):
+        """test { |> test }, a leading |> on the next line continues it"""
+        tokens = self.tokens
+        tok = tokens[self.pos]
+        stages = [self.test()]
+        while True:
+            nxt = tokens[self.pos]
+            if nxt.kind == 'NEWLINE' and self.check('OP', '|>', offset=1):
+                self.pos += 1
+            elif nxt.value != '|>' or nxt.kind != 'OP':
+                break
+            self.pos += 1
+            stages.append(self.test())
+        if len(stages) == 1:
+            return stages[0]
+        return Pipe(stages, tok=tok)
+
+    ############################################################################
+    def test(self):
+        """lambda, or a possibly conditional expression"""
+        tok = self.tokens[self.pos]
+        if tok.value == 'lambda' and self.accept('NAME', 'lambda'):
+            return self.lambdef(tok)
+        body = self.binary(1)
+        if self.tokens[self.pos].value == 'if' and self.accept('NAME', 'if'):
+            cond = self.binary(1)
+            self.expect('NAME', 'else')
+            return IfExp(body, cond, self.test(), tok=tok)
+        return body
+
+    def lambdef(self, tok):
+        """lambda [params]: test"""
+        params = list()
+        while not self.check('OP', ':'):
+            prefix = ''
+            if self.check('OP', '*') or self.check('OP', '**'):
+                prefix = self.advance().value
+            name = self.expect('NAME').value
+            default = None
+            if self.accept('OP', '='):
+                default = self.test()
+            params.append((prefix, name, default))
+            if not self.accept('OP', ','):
+                break
+        self.expect('OP', ':')
+        return Lambda(params, self.test(), tok=tok)
+
+    def binary(self, level):
+        """operators binding at level or tighter, by precedence climbing"""
+        tokens = self.tokens
+        tok = tokens[self.pos]
+        if tok.value == 'not' and tok.kind == 'NAME' and level <= NOT:
+            self.pos += 1
+            node = UnaryOp('not', self.binary(NOT), tok=tok)
+        else:
+            node = self.factor()
+        while True:
+            nxt = tokens[self.pos]
+            strength = BINARY_OPS.get(nxt.value, 0) if nxt.kind in ('OP', 'NAME') else 0
+            if strength < level: # never for a non-operator, whose strength is 0
+                return node
+            oper = nxt.value
+            if oper == 'not': # only as `not in`
+                if not self.check('NAME', 'in', offset=1):
+                    return node
+                self.pos += 1
+                oper = 'not in'
+            elif oper == 'is' and self.check('NAME', 'not', offset=1):
+                self.pos += 1
+                oper = 'is not'
+            self.pos += 1
+            node = BinOp(node, oper, self.binary(strength + 1), tok=tok)
+
+    def factor(self):
+        """unary + - ~"""
+        tok = self.tokens[self.pos]
+        if tok.kind == 'OP' and tok.value in ('+', '-', '~'):
+            self.pos += 1
+            return UnaryOp(tok.value, self.factor(), tok=tok)
+        node = self.postfix()
+        if self.tokens[self.pos].value == '**' and self.accept('OP', '**'):
+            return BinOp(node, '**', self.factor(), tok=tok)
+        return node
+
+    def postfix(self):
+        """atom followed by calls, subscripts, attributes and follows"""
+        tokens = self.tokens
+        tok = tokens[self.pos]
+        node = self.atom()
+        while True:
+            nxt = tokens[self.pos]
+            if nxt.kind != 'OP' or nxt.value not in POSTFIX_OPS:
+                return node
+            self.pos += 1
+            if nxt.value == '(':
+                node = Call(node, self.arguments(), tok=tok)
+            elif nxt.value == '[':
+                node = Index(node, self.subscripts(), tok=tok)
+            elif nxt.value == '.':
+                node = Attr(node, self.expect('NAME').value, tok=tok)
+            else:
+                node = Follow(node, self.follow_key(), tok=tok)
+
+    def follow_key(self):
+        """the key of node->key, a dotted path which may have * wildcards"""
+        if self.check('STRING'):
+            return ast.literal_eval(self.advance().value)
+        parts = list()
+        while True:
+            if self.check('NAME') or self.check('NUMBER') or self.check('OP', '*'):
+                parts.append(self.advance().value)
+            else:
+                self.error("expected a key to follow")
+            if not (self.check('OP', '.') and (self.check('NAME', offset=1)
+                                               or self.check('NUMBER', offset=1)
+                                               or self.check('OP', '*', offset=1))):
+                return ".".join(parts)
+            self.advance()
+
+    def atom(self):
+        """names, literals, and bracketed displays"""
+        tok = self.advance()
+        if tok.kind == 'NAME':
+            if tok.value in CONSTANTS:
+                return Const(tok.value, tok=tok)
+            # is(), as() and friends are DEX functions, not python keywords
+            return Name(dex_name(tok.value), tok=tok)
+        if tok.kind in ('VAR', 'NUMBER'):
+            return (Var if tok.kind == 'VAR' else Const)(tok.value, tok=tok)
+        if tok.kind == 'STRING':
+            text = [tok.value]
+            while self.check('STRING'):
+                text.append(self.advance().value)
+            return Const(" ".join(text), tok=tok)
+        if tok.kind == 'OP' and tok.value in OPENING:
+            return self.display(tok)
+        return self.error("unexpected {!r}".format(tok.value), tok)
+
+    def display(self, tok):
+        """(...), [...] or {...}"""
+        opening = tok.value
+        closing = OPENING[opening]
+        if self.accept('OP', closing):
+            return Seq(opening, [], closing, tok=tok)
+        first = self.item(opening == '{')
+        if self.check('NAME', 'for'):
+            node = Comp(opening, first, self.comp_clauses(), closing, tok=tok)
+        elif opening == '(' and not self.check('OP', ','):
+            node = Group(first, tok=tok)
+        else:
+            items = [first]
+            while self.accept('OP', ',') and not self.check('OP', closing):
+                items.append(self.item(opening == '{'))
+            node = Seq(opening, items, closing, tok=tok)
+        self.expect('OP', closing)
+        return node
+
+    def item(self, in_dict):
+        """an item within a display: *star, key: value, **mapping or expression"""
+        tok = self.peek()
+        if tok.kind == 'OP' and tok.value in ('*', '**'):
+            self.advance()
+            return Star(tok.value, self.binary(ARITH), tok=tok)
+        node = self.pipeline()
+        if in_dict and self.accept('OP', ':'):
+            return Pair(node, self.pipeline(), tok=tok)
+        return node
+
+    def comp_clauses(self):
+        """for target in iter [if cond] ..."""
+        clauses = list()
+        while self.accept('NAME', 'for'):
+            tok = self.peek()
+            targets = [self.binary(ARITH)]
+            while self.accept('OP', ','):
+                targets.append(self.binary(ARITH))
+            target = targets[0] if len(targets) == 1 else Seq('', targets, '', tok=tok)
+            self.expect('NAME', 'in')
+            clauses.append(('for', target, self.binary(1)))
+            while self.accept('NAME', 'if'):
+                clauses.append(('if', self.binary(1)))
+        return clauses
+
+    def arguments(self):
+        """call arguments, after the opening ("""
+        args = list()
+        while not self.check('OP', ')'):
+            tok = self.peek()
+            if tok.kind == 'OP' and tok.value in ('*', '**'):
+                self.advance()
+                args.append(Star(tok.value, self.pipeline(), tok=tok))
+            elif tok.kind == 'NAME' and self.check('OP', '=', offset=1):
+                self.pos += 2
+                args.append(Keyword(dex_name(tok.value), self.pipeline(), tok=tok))
+            else:
+                arg = self.pipeline()
+                if self.check('NAME', 'for'):
+                    arg = Comp('', arg, self.comp_clauses(), '', tok=tok)
+                args.append(arg)
+            if not self.accept('OP', ','):
+                break
+        self.expect('OP', ')')
+        return args
+
+    def subscripts(self):
+        """subscript items (expressions or slices), after the opening ["""
+        items = list()
+        while not self.check('OP', ']'):
+            tok = self.peek()
+            parts = [None]
+            while True:
+                if not (self.check('OP', ':') or self.check('OP', ',') or self.check('OP', ']')):
+                    parts[-1] = self.pipeline()
+                if not self.accept('OP', ':'):
+                    break
+                parts.append(None)
+            if len(parts) == 1:
+                items.append(parts[0])
+            elif len(parts) > 3:
+                self.error("invalid slice", tok)
+            else:
+                items.append(Slice(*(parts + [None])[0:3], tok=tok))
+            if not self.accept('OP', ','):
+                break
+        self.expect('OP', ']')
+        return items
+
+################################################################################
+def dex_parse(indata):
+    """
+    Parse a DEX block (string or list of lines) into a list of AST statements
+
+    >>> dex_parse('''
+    ...   #!DEX async=false
+    ...   person |> is("human")
+    ... ''')
+    [Pragma({'async': 'false'}), Pipe([Name('person'), Call(Name('is_'), [Const('"human"')])])]
+    >>> [(node.line, node.col) for node in dex_parse('a\\n  b = c')]
+    [(1, 1), (2, 3)]
+    """
+    return DexParser(dex_lex(indata)).parse()
+
 def dex_transpile(indata, default_assign=None):
     # pylint: disable=line-too-long
     """
@@ -195,89 +867,38 @@ def dex_transpile(indata, default_assign=None):
     ...    requestor |> is(entity($owner))
     ...    dataFrame = accept->csv |> is("pandas:data_frame")
     ... ''')
-    ["is(requestor, entity(context['owner']))", 'assign(is(follow(accept,\\'csv\\'), "pandas:data_frame"), context, \\'dataFrame\\')']
+    ["is_(requestor, entity(context['owner']))", 'assign(is_(follow(accept,\\'csv\\'), "pandas:data_frame"), context, \\'dataFrame\\')']
     >>> dex_transpile('''
     ...    model_input = model.csv |> StringIO() |> pandas.read_csv
     ...    result.modelbin |> push(context.model.id)
     ... ''')
     ["assign(pandas.read_csv(StringIO(model.csv)), context, 'model_input')", 'push(result.modelbin, context.model.id)']
+    >>> dex_transpile('''
+    ...    label = f("a |> b # not a comment") |> g(h(1, 2) |> k)
+    ...    $invoker->behavior.phone.log->owner
+    ...    duration = employer
+    ...      |> polyform("pandim:employer.employee_duration", person)
+    ...      |> as("days")
+    ... ''')
+    ['assign(g(f("a |> b # not a comment"), k(h(1, 2))), context, \\'label\\')', "follow(follow(context['invoker'],'behavior.phone.log'),'owner')", 'assign(as_(polyform(employer, "pandim:employer.employee_duration", person), "days"), context, \\'duration\\')']
+    >>> dex_transpile('latest', default_assign='time')
+    ["assign(latest, context, 'time')"]
+    >>> dex_transpile('interface.output.score = result->score |> float')
+    ["assign(float(follow(result,'score')), context, ['interface', 'output', 'score'])"]
+    >>> dex_transpile('''
+    ...    #!DEX async=true
+    ...    latest # not a #!DEX pragma
+    ... ''', default_assign='time')
+    ['#!DEX async=true', "assign(latest, context, 'time')"]
     """
-    #if not context:
-
     out = list()
-#    $invoker == context['invoker']
-    first = True
-    for line in dex_trim(indata):
-        #### unfold syntax sugar first
-#        match = ASSIGN_DIG_RX.match(line)
-#        if match and '.' in match.group(1):
-##            print("MATCH DIG_RX={}".format(match.groups())) # match)
-#            assign = dotkey2index(None, match.group(1).split("."))
-#            line = assign + " = " + match.group(2)
-        match = ASSIGNMENT_RX.match(line)
-        if match:
-            key = match.group(1)
-            rest = match.group(2)
-            if '.' in key:
-                key = key.split(".")
-            else:
-                key = "'" + key + "'"
-            line = "{} |> assign(context, {})".format(rest, key)
-
-#            print("MATCH ASSIGN_RX={}".format(match.groups())) # match)
-#            line = match.group(2) + " |> assign(context, '" + match.group(1) + "')"
-        elif first and default_assign and "assign(" not in line:
-            line = line + "|> assign(context, '" + default_assign + "')"
-            first = False
-
-#        match = INTERPOLATE_RX.match(line)
-        # dict.keys (( maybe just skip this sugar: leaving it allows for adhoc object.method references ))
-        # match $name->digval -- ${name}->{dig.val.deeper}
-        line = re.sub(FOLLOW_RX, lambda x: 'follow(' + x.group(1) + ",'" + x.group(2)+ "')", line)
-        # interpolate
-        #line = re.sub(DICT_DIG_RX, lambda x: 'context[' + x + ']', line)
-        line = re.sub(INTERPOLATE_RX, lambda x: "context['" + x.group(1) + "']", line)
-
-        #print("     `{}`".format(line))
-        #### split functions
-        stack = list()
-        place = 0
-        for part in re.split(r'\s*\|>\s*', line):
-            match = FUNCTION_RX.search(part)
-            if match:
-                stack.append([match.group(1), match.group(3)])
-                #if match.group(2):
-#                print("MATCH <{}> <{}> <{}>".format(*match.groups()))
-#                print("=> {}".format([match.group(1), match.group(3)]))
-#                stack.append(['', part])
-            else:
-                if place == 0: # if first in stack it's an argument, otherwise it's a function
-                    stack.append([None, part])
-                else:
-                    stack.append([part, None])
-            place += 1
-
-#        import json
-#        print(json.dumps(stack, indent=1))
-        #### reformat into python
-        expr = ''
-        for func, arg in stack:
-            if not expr: # first arg can come from context
-                if not arg and func:
-#                    if func[0] in "'\"":
-                    expr = func
-#                    else:
-#                        print("Kick "  + func)
-#                        expr = "context['{}']".format(func)
-                elif not func:
-                    expr = arg # "{}({}, {})".format(func, expr, arg)
-                else:
-                    expr = "{}({})".format(func, arg)
-            elif not arg:
-                expr = "{}({})".format(func, expr)
-            else:
-                expr = "{}({}, {})".format(func, expr, arg)
-
+    for stmt in dex_parse(indata):
+        expr = stmt.python()
+        if expr is None:
+            continue
+        if default_assign and not isinstance(stmt, (Assign, Pragma)) and "assign(" not in expr:
+            expr = assign_py(expr, [default_assign])
+            default_assign = None
         out.append(expr)
     return out
 
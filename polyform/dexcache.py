@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+A disk cache of transpiled DEX blocks, so `poly` commands don't parse every
+block of Polyform.yml each time they run.
+"""
+
+import os
+import json
+import hashlib
+from .dex import dex_transpile, DEX_VERSION
+
+class DexCache():
+    """
+    Content addressed cache of transpiled DEX blocks, on disk under `path`,
+    keyed by a hash of the source, default_assign and DEX_VERSION.  Blocks
+    seen more than once in a process (forms extending others) are kept in
+    memory too.  Writing is best effort, a read-only tree just misses.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     cache = DexCache(tmpdir)
+    ...     first = cache.transpile('x = 1', default_assign='time')
+    ...     again = DexCache(tmpdir).transpile('x = 1', default_assign='time')
+    ...     first == again == dex_transpile('x = 1'), len(os.listdir(tmpdir))
+    (True, 1)
+    """
+    def __init__(self, path):
+        self.path = path
+        self._memo = dict()
+
+    @staticmethod
+    def digest(indata, default_assign=None):
+        """the cache key for a block"""
+        source = json.dumps([DEX_VERSION, default_assign, indata])
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def transpile(self, indata, default_assign=None):
+        """dex_transpile(), from the cache if it can be"""
+        digest = self.digest(indata, default_assign=default_assign)
+        out = self._memo.get(digest)
+        if out is not None:
+            return list(out)
+        path = os.path.join(self.path, digest[:2], digest + ".json")
+        try:
+            with open(path) as infile:
+                out = json.load(infile)
+        except (OSError, ValueError):
+            out = dex_transpile(indata, default_assign=default_assign)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "w") as outfile:
+                    json.dump(out, outfile)
+                os.replace(path + ".tmp", path)
+            except OSError:
+                pass
+        self._memo[digest] = out
+        return list(out)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Batches of data universe I/O, for the pull_many(), push_many() and gather()
+builtins:
+
+    models = pull_many(["BACFAF-1FA14D-89FA", "C0FFEE-1FA14D-89FA"], "pickle>>*")
+    entities = gather(model->entities)
+
+Each item is its own call, run on a bounded pool (DEX_BATCH_CONCURRENCY
+threads, separate from the DEX step pool), so hundreds of nodes take a few
+round trips rather than one each.  Results are in item order.  Every item
+is run, and any which failed are raised together as a BatchError, or with
+partial=True, logged and given as None.
+"""
+
+import os
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from .logger import log
+
+BATCH_CONCURRENCY = int(os.environ.get('DEX_BATCH_CONCURRENCY', 32))
+POOL = None
+POOL_LOCK = threading.Lock()
+
+# failures named in a BatchError message
+SHOW_ERRORS = 5
+
+class BatchError(Exception):
+    """
+    Items of a batch failed: `errors` is {index: exception}, `results` has
+    None for them, and `keys` names each item.
+    """
+    def __init__(self, caller, keys, results, errors):
+        self.keys = keys
+        self.results = results
+        self.errors = errors
+        shown = ", ".join("{}: {}: {}".format(keys[index], err.__class__.__name__, err)
+                          for index, err in sorted(errors.items())[:SHOW_ERRORS])
+        if len(errors) > SHOW_ERRORS:
+            shown += ", ..."
+        super().__init__("{}(): {} of {} failed: {}".format(caller, len(errors), len(results),
+                                                           shown))
+
+def batch_pool():
+    """the thread pool for batches, created when first needed"""
+    global POOL # pylint: disable=global-statement
+    if POOL is None and BATCH_CONCURRENCY > 1:
+        with POOL_LOCK:
+            if POOL is None:
+                POOL = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY,
+                                          thread_name_prefix='dex-batch')
+    return POOL
+
+def run_many(func, items, pool=None):
+    """
+    func(item) for each item, on pool: (results in item order, with None
+    where it failed, {index: exception})
+
+    >>> run_many(lambda x: 10 // x, [1, 0, 5])
+    ([10, None, 2], {1: ZeroDivisionError('integer division or modulo by zero')})
+    """
+    pool = pool or batch_pool()
+    if pool is None:
+        calls = [(func, item) for item in items]
+        def result(call):
+            return call[0](call[1])
+    else:
+        calls = [pool.submit(func, item) for item in items]
+        def result(call):
+            return call.result()
+    results = list()
+    errors = dict()
+    for index, call in enumerate(calls):
+        try:
+            results.append(result(call))
+        except Exception as err: # pylint: disable=broad-except
+            results.append(None)
+            errors[index] = err
+    return results, errors
+
+def many(caller, func, items, keys=None, partial=False):
+    """
+    run_many(), raising a BatchError for any failures, or with partial,
+    logging them
+
+    >>> many('lookup', {1: 'a', 2: 'b'}.__getitem__, [1, 3, 2])
+    Traceback (most recent call last):
+    ...
+    polyform.sls.batch.BatchError: lookup(): 1 of 3 failed: 3: KeyError: 3
+    >>> many('lookup', {1: 'a', 2: 'b'}.__getitem__, [1, 3, 2], partial=True) # doctest: +ELLIPSIS
+    20... type="batch" error="lookup(): 1 of 3 failed: 3: KeyError: 3"...
+    ['a', None, 'b']
+    """
+    items = list(items)
+    results, errors = run_many(func, items)
+    if errors:
+        err = BatchError(caller, items if keys is None else keys, results, errors)
+        if not partial:
+            raise err
+        log(type="batch", error=str(err))
+    return results
+
+def node_id(node):
+    """
+    the id of a node to gather: an id, or a node (dict) with an id; None
+    for anything else (data, as is)
+
+    >>> node_id('BACFAF-1FA14D-89FA'), node_id({'id': 'C0FFEE'}), node_id(3)
+    ('BACFAF-1FA14D-89FA', 'C0FFEE', None)
+    """
+    if isinstance(node, str):
+        return node
+    if isinstance(node, Mapping) and isinstance(node.get('id'), str):
+        return node['id']
+    return None
@@ -5,37 +5,128 @@ Copyright 2019 Brandon Gillespie; All rights reserved.
 
 Lambda Dynamo Min - running dynamo db for backend things -- minimal
 'in serverless' version.
+
+Sessions, clients and resources are kept for the process, by (service,
+region, profile), and borrowed by every Boto3Min, so a store costs nothing
+to create after the first.  Low level clients are thread safe, and shared;
+resources aren't, so each thread gets its own.  Their connection pools hold
+DEX_AWS_POOL (default 50) connections, with TCP keep-alive, so idle
+connections survive between warm invocations.
 """
 
 import os
+import threading
 import boto3
+import botocore.config
+
+POOL_SIZE = int(os.environ.get('DEX_AWS_POOL', 50))
+KEEPALIVE = os.environ.get('DEX_AWS_KEEPALIVE', 'true').lower() == 'true'
+
+SESSIONS = dict() # (region, profile): session
+CLIENTS = dict() # (service, region, profile): client
+LOCAL = threading.local() # .resources: {(service, region, profile): resource}
+LOCK = threading.RLock()
+CONFIG = None
+PREPPED = False
 
 # pylint: disable=too-few-public-methods
 class Boto3Min():
     """Dynamo Wrapper for within a container"""
-    client = None
     config = None
+    resource = None
+    service = None
 
-    def __init__(self, resource=None, **config):
-        if not resource:
-            raise AttributeError("Missing resource= for Boto3Min().__init__()")
+    def __init__(self, resource=None, service=None, region=None, profile=None, **config):
+        if not resource and not service:
+            raise AttributeError("Missing resource= or service= for Boto3Min().__init__()")
 
         prep_aws_environ() # adjusting lambci things
         self.config = config
-        # TODO: bring in global config <is self avail with incept?>
-        self.client = boto3.resource(resource)
+        self.resource = resource
+        self.service = service # a low level client, for services without a resource
+        self.region = region
+        self.profile = profile
+
+    @property
+    def client(self):
+        """
+        the shared client, or this thread's resource (boto3 resources aren't
+        thread safe, so DEX steps running concurrently each get their own)
+        """
+        if self.resource:
+            return aws_resource(self.resource, region=self.region, profile=self.profile)
+        return aws_client(self.service, region=self.region, profile=self.profile)
+
+def aws_config():
+    """the botocore config every client is made with"""
+    global CONFIG # pylint: disable=global-statement
+    if CONFIG is None:
+        CONFIG = botocore.config.Config(max_pool_connections=POOL_SIZE, tcp_keepalive=KEEPALIVE)
+    return CONFIG
+
+def aws_session(region=None, profile=None):
+    """the session for region and profile (None for the defaults)"""
+    key = (region, profile)
+    session = SESSIONS.get(key)
+    if session is None:
+        with LOCK:
+            session = SESSIONS.get(key)
+            if session is None:
+                prep_aws_environ()
+                session = boto3.session.Session(region_name=region, profile_name=profile)
+                SESSIONS[key] = session
+    return session
+
+def aws_client(service, region=None, profile=None):
+    """
+    the low level client for service, shared by every thread
+
+    >>> aws_client('lambda', region='us-east-1') is aws_client('lambda', region='us-east-1')
+    True
+    >>> aws_client('lambda', region='us-east-1').meta.config.max_pool_connections == POOL_SIZE
+    True
+    """
+    key = (service, region, profile)
+    client = CLIENTS.get(key)
+    if client is None:
+        with LOCK: # sessions aren't thread safe
+            client = CLIENTS.get(key)
+            if client is None:
+                client = aws_session(region, profile).client(service, config=aws_config())
+                CLIENTS[key] = client
+    return client
+
+def aws_resource(service, region=None, profile=None):
+    """the resource for service, for this thread"""
+    resources = getattr(LOCAL, 'resources', None)
+    if resources is None:
+        resources = LOCAL.resources = dict()
+    key = (service, region, profile)
+    resource = resources.get(key)
+    if resource is None:
+        with LOCK:
+            resource = aws_session(region, profile).resource(service, config=aws_config())
+        resources[key] = resource
+    return resource
 
 # lambci injects vars, even if I don't want to use them
 def prep_aws_environ():
-    """verify and adjust our environment so it works for a signin"""
-    if os.path.exists('/.aws/credentials'):
-        print("using /.aws/credentials")
-        os.environ['AWS_SHARED_CREDENTIALS_FILE'] = '/.aws/credentials'
-    for key in os.environ:
-        if key[:3] == 'AWS':
-            val = os.environ[key]
-            if val in ('SOME_ACCESS_KEY_ID', 'SOME_SECRET_ACCESS_KEY'):
-                del os.environ[key]
+    """verify and adjust our environment so it works for a signin (once)"""
+    global PREPPED # pylint: disable=global-statement
+    if PREPPED:
+        return
+    with LOCK:
+        if PREPPED:
+            return
+        if os.path.exists('/.aws/credentials'):
+            print("using /.aws/credentials")
+            os.environ['AWS_SHARED_CREDENTIALS_FILE'] = '/.aws/credentials'
+        for key in list(os.environ):
+            if key[:3] == 'AWS':
+                val = os.environ[key]
+                if val in ('SOME_ACCESS_KEY_ID', 'SOME_SECRET_ACCESS_KEY'):
+                    del os.environ[key]
+        PREPPED = True
 #    for key in ('AWS_PROFILE',):
 #        if key not in os.environ:
 #            raise AttributeError(key + " is not set in environment")
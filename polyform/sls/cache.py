@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Result cache for polyform() calls, with a TTL per call:
+
+    person_fico_check = person |> polyform("fico:score.soft", "cache=24h")
+    employer = employers |> polyform("pandim:employers.primary", "cache=1h,shared=true")
+
+Results are kept in process (an LRU of DEX_CACHE_SIZE entries), and with
+shared=true also in the BackingData store under SHARED_PREFIX, so other
+containers get them too.  Keys are a hash of the call: the polyform, its
+data and arguments, so each subject is cached on its own.  Every caller
+gets its own copy of a result, to change as it likes.
+"""
+
+import os
+import re
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from .logger import log
+
+SHARED_PREFIX = '_cache/polyform/'
+
+TTL_UNITS = dict(s=1, m=60, h=3600, d=86400)
+
+def parse_ttl(value):
+    """
+    seconds, from a TTL such as 24h, 30m, 10s, 1d (or plain seconds)
+
+    >>> parse_ttl('24h'), parse_ttl('30m'), parse_ttl('10s'), parse_ttl('1d'), parse_ttl(5)
+    (86400, 1800, 10, 86400, 5)
+    >>> parse_ttl('soon')
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid cache TTL: soon
+    """
+    if isinstance(value, (int, float)):
+        return value
+    value = str(value).strip().lower()
+    try:
+        if value[-1:] in TTL_UNITS:
+            return int(value[:-1]) * TTL_UNITS[value[-1]]
+        return int(value)
+    except ValueError:
+        raise ValueError("Invalid cache TTL: {}".format(value))
+
+OPTIONS_RX = re.compile(r'^\s*\w+=[^,=]*(\s*,\s*\w+=[^,=]*)*\s*$')
+
+def is_options(value):
+    """
+    is value an option string, such as "cache=24h"
+
+    >>> is_options("cache=24h,shared=true"), is_options("person")
+    (True, False)
+    """
+    return isinstance(value, str) and bool(OPTIONS_RX.match(value))
+
+def parse_options(value):
+    """
+    the options of a polyform() call, from "key=value,key=value"
+
+    >>> sorted(parse_options("cache=24h, shared=true").items())
+    [('cache', '24h'), ('shared', True)]
+    """
+    options = dict()
+    for opt in value.split(','):
+        key, _, val = opt.strip().partition('=')
+        if val.lower() in ('true', 'false'):
+            val = val.lower() == 'true'
+        options[key] = val
+    return options
+
+def cache_key(*call):
+    """
+    the cache key of a call, as a hash of its (json) parts
+
+    >>> cache_key('fico:score', {'id': 1}) == cache_key('fico:score', {'id': 1})
+    True
+    """
+    data = json.dumps(call, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+class TTLCache():
+    """
+    An LRU of values which expire.
+
+    >>> now = [0]
+    >>> cache = TTLCache(maxsize=2, clock=lambda: now[0])
+    >>> cache.put('a', 1, ttl=10)
+    >>> cache.put('b', 2, ttl=100)
+    >>> cache.get('a')
+    (True, 1)
+    >>> cache.put('c', 3, ttl=100)   # 'b' is least recently used
+    >>> cache.get('b')
+    (False, None)
+    >>> now[0] = 20
+    >>> cache.get('a'), cache.get('c')
+    ((False, None), (True, 3))
+    """
+    def __init__(self, maxsize=1024, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(found, value) for key"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= self.clock():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, entry[1]
+
+    def put(self, key, value, ttl):
+        """keep value for ttl seconds"""
+        with self._lock:
+            self._data[key] = (self.clock() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """drop everything"""
+        with self._lock:
+            self._data.clear()
+
+CACHE = TTLCache(maxsize=int(os.environ.get('DEX_CACHE_SIZE', 1024)))
+
+def shared_get(bucket, key):
+    """(found, value, seconds left) from the shared tier"""
+    try:
+        entry = json.load(bucket.get(key=SHARED_PREFIX + key))
+    except Exception: # pylint: disable=broad-except
+        return False, None, 0
+    left = entry.get('expires', 0) - time.time()
+    if left <= 0:
+        return False, None, 0
+    return True, entry.get('value'), left
+
+def shared_put(bucket, key, value, ttl):
+    """store value in the shared tier, for ttl seconds"""
+    bucket.put(key=SHARED_PREFIX + key,
+               body=json.dumps(dict(expires=time.time() + ttl, value=value)))
+
+def cached(key, ttl, func, bucket=None):
+    """
+    func() through the cache; in process, then shared (with a bucket)
+
+    >>> calls = list()
+    >>> def func():
+    ...     calls.append(1)
+    ...     return 'score'
+    >>> cached('doctest', 60, func), cached('doctest', 60, func), len(calls)
+    ('score', 'score', 1)
+
+    Results are copies, so changing one doesn't change the cached result:
+
+    >>> cached('doctest-copy', 60, lambda: dict(score=1))['score'] = 2
+    >>> cached('doctest-copy', 60, func)
+    {'score': 1}
+
+    The call has been made, so failing to share its result doesn't fail it:
+
+    >>> class Bucket():
+    ...     def get(self, key):
+    ...         raise FileNotFoundError(key)
+    ...     def put(self, key, body):
+    ...         raise OSError("unavailable")
+    >>> cached('doctest-shared', 60, func, bucket=Bucket()) # doctest: +ELLIPSIS
+    20... type="cache" msg="Shared put failed" error="OSError: unavailable"...
+    'score'
+    """
+    found, value = CACHE.get(key)
+    if found:
+        return copy.deepcopy(value)
+    if bucket is not None:
+        found, value, left = shared_get(bucket, key)
+        if found:
+            CACHE.put(key, copy.deepcopy(value), min(ttl, left))
+            return value
+    value = func()
+    CACHE.put(key, copy.deepcopy(value), ttl)
+    if bucket is not None:
+        try:
+            shared_put(bucket, key, value, ttl)
+        except Exception as err: # pylint: disable=broad-except
+            log(type="cache", msg="Shared put failed",
+                error="{}: {}".format(err.__class__.__name__, err))
+    return value
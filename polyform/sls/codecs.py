@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Typed data codecs, for pull(), push() and convert().
+
+A typedef is `source>>target`: pull("id", "npy>>array") decodes npy data,
+push(frame, "id", "*>>parquet") encodes to parquet.  A codec is registered
+per format, with:
+
+* load(rfd)       - decode from a file like object
+* dump(value, wfd) - encode into a (binary) file like object
+* buffer(buf)     - decode straight from a buffer (bytes, or a memory map of
+                    pulled data), without copying it, where the format allows
+* kind            - what it decodes to; pull(...,"fmt>>other") converts on
+                    from that, with a registered converter
+* stream          - load() reads forward only, so a pull can decode straight
+                    from the response (see polyform.sls.stream)
+
+In memory conversions (convert(frame, "dataframe>>dict")) are registered as
+converters, by typedef.  NumPy, pandas and pyarrow are imported by the
+codecs which need them, when they are used.
+"""
+
+import io
+import sys
+import json
+import mmap
+import pickle
+
+CODECS = dict()
+CONVERTERS = dict()
+
+# pylint: disable=too-few-public-methods
+class Codec():
+    """a registered data format"""
+    __slots__ = ('name', 'load', 'dump', 'buffer', 'kind', 'text', 'stream')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, name, load=None, dump=None, buffer=None, kind='*', text=False,
+                 stream=False):
+        self.name = name
+        self.load = load
+        self.dump = dump
+        self.buffer = buffer
+        self.kind = kind
+        self.text = text
+        self.stream = stream
+
+def register_codec(name, **kwargs):
+    """register (or replace) the codec for a format, see Codec"""
+    CODECS[name] = Codec(name, **kwargs)
+    return CODECS[name]
+
+def register_converter(typedef, func):
+    """register an in memory conversion, such as 'dataframe>>dict'"""
+    CONVERTERS[typedef] = func
+    return func
+
+def parse_typedef(typedef):
+    """
+    (source, target) of a typedef
+
+    >>> parse_typedef('csv>>dataframe'), parse_typedef('json')
+    (('csv', 'dataframe'), ('json', '*'))
+    """
+    source, _, target = typedef.partition('>>')
+    return source, target or '*'
+
+def get_codec(name, caller='pull'):
+    """the codec for a format, or an error naming the caller"""
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError("{}(): Unrecognized typedef: {}".format(caller, name))
+    return codec
+
+def _target(codec, value, target, caller):
+    if target in ('*', codec.kind):
+        return value
+    typedef = "{}>>{}".format(codec.kind, target)
+    if typedef not in CONVERTERS:
+        raise ValueError("{}(): Unrecognized typedef: {}>>{}".format(caller, codec.name, target))
+    return CONVERTERS[typedef](value)
+
+def streams(typedef):
+    """
+    can data of typedef be decoded as it is read
+
+    >>> streams('pickle>>*'), streams('npy>>array')
+    (True, False)
+    """
+    codec = get_codec(parse_typedef(typedef)[0])
+    return codec.stream and not codec.buffer
+
+def decoder(typedef):
+    """
+    A function decoding pulled data of typedef, from a (binary) file.  Real
+    files are memory mapped for codecs which can decode from a buffer.
+
+    >>> decoder('json>>*')(io.BytesIO(b'[1, 2]'))
+    [1, 2]
+    """
+    source, target = parse_typedef(typedef)
+    codec = get_codec(source)
+    def decode(rfd):
+        value = None
+        if codec.buffer:
+            try:
+                buf = mmap.mmap(rfd.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                buf = None # not a real (or is an empty) file
+            if buf is not None:
+                value = codec.buffer(buf)
+            else:
+                value = codec.buffer(rfd.read())
+        else:
+            value = codec.load(rfd)
+        return _target(codec, value, target, 'pull')
+    return decode
+
+def encoder(typedef, caller='push'):
+    """
+    A function encoding data for typedef ('*>>fmt' or 'kind>>fmt') into a
+    binary file
+
+    >>> wfd = io.BytesIO()
+    >>> encoder('*>>json')({'a': 1}, wfd)
+    >>> wfd.getvalue()
+    b'{"a": 1}'
+    """
+    _source, target = parse_typedef(typedef)
+    codec = get_codec(target, caller=caller)
+    if not codec.dump:
+        raise ValueError("{}(): Cannot encode to: {}".format(caller, target))
+    return codec.dump
+
+def convert(data, typedef):
+    """
+    Convert data: with a converter registered for typedef, otherwise by
+    decoding ('fmt>>kind') or encoding ('kind>>fmt') with a codec.  Text
+    formats encode to str.
+
+    >>> convert({'a': [1]}, '*>>json'), convert('{"a": [1]}', 'json>>*')
+    ('{"a": [1]}', {'a': [1]})
+    >>> import numpy
+    >>> convert(convert(numpy.arange(3), 'array>>npy'), 'npy>>array')
+    array([0, 1, 2])
+    >>> convert(1, 'sideways>>up')
+    Traceback (most recent call last):
+    ...
+    ValueError: convert(): Unrecognized typedef: sideways>>up
+    """
+    if typedef in CONVERTERS:
+        return CONVERTERS[typedef](data)
+    source, target = parse_typedef(typedef)
+    if source in CODECS and isinstance(data, (str, bytes, bytearray, memoryview)):
+        codec = CODECS[source]
+        if isinstance(data, str):
+            data = data.encode()
+        if codec.buffer:
+            value = codec.buffer(data)
+        else:
+            value = codec.load(io.BytesIO(data))
+        return _target(codec, value, target, 'convert')
+    if target in CODECS and CODECS[target].dump:
+        wfd = io.BytesIO()
+        CODECS[target].dump(data, wfd)
+        if CODECS[target].text:
+            return wfd.getvalue().decode()
+        return wfd.getvalue()
+    raise ValueError("convert(): Unrecognized typedef: " + typedef)
+
+################################################################################
+# npy: an array straight over the buffer
+def npy_buffer(buf):
+    """
+    an array over npy data in buf, not copied (read only, when buf is)
+
+    >>> import numpy
+    >>> wfd = io.BytesIO()
+    >>> numpy.save(wfd, numpy.eye(2))
+    >>> npy_buffer(wfd.getvalue())
+    array([[1., 0.],
+           [0., 1.]])
+    """
+    import numpy # pylint: disable=import-outside-toplevel
+    header = io.BytesIO(memoryview(buf)[:65536 + 16])
+    version = numpy.lib.format.read_magic(header)
+    if version == (1, 0):
+        shape, fortran, dtype = numpy.lib.format.read_array_header_1_0(header)
+    else:
+        shape, fortran, dtype = numpy.lib.format.read_array_header_2_0(header)
+    if dtype.hasobject:
+        raise ValueError("npy: object arrays can't be loaded from a buffer")
+    count = int(numpy.prod(shape, dtype=numpy.int64))
+    array = numpy.frombuffer(buf, dtype=dtype, count=count, offset=header.tell())
+    return array.reshape(shape, order='F' if fortran else 'C')
+
+def npy_dump(value, wfd):
+    """encode an array as npy"""
+    import numpy # pylint: disable=import-outside-toplevel
+    numpy.save(wfd, numpy.asarray(value), allow_pickle=False)
+
+################################################################################
+# arrow IPC (file or stream format), as a pyarrow Table over the buffer
+def arrow_buffer(buf):
+    """a Table over arrow IPC data in buf, not copied"""
+    import pyarrow.ipc # pylint: disable=import-outside-toplevel
+    buf = pyarrow.py_buffer(buf)
+    if buf.size >= 6 and buf.slice(0, 6).to_pybytes() == b'ARROW1':
+        return pyarrow.ipc.open_file(buf).read_all()
+    return pyarrow.ipc.open_stream(buf).read_all()
+
+def arrow_dump(value, wfd):
+    """encode a Table (or DataFrame) as arrow IPC, file format"""
+    import pyarrow.ipc # pylint: disable=import-outside-toplevel
+    pandas = sys.modules.get('pandas') # a DataFrame means it is imported
+    if pandas is not None and isinstance(value, pandas.DataFrame):
+        value = pyarrow.Table.from_pandas(value)
+    with pyarrow.ipc.new_file(wfd, value.schema) as writer:
+        writer.write_table(value)
+
+def table_to_dataframe(table):
+    """a pyarrow Table as a DataFrame (this copies, for most types)"""
+    return table.to_pandas()
+
+################################################################################
+def parquet_load(rfd):
+    """a DataFrame from parquet data"""
+    import pandas # pylint: disable=import-outside-toplevel
+    return pandas.read_parquet(rfd)
+
+def parquet_dump(value, wfd):
+    """encode a DataFrame as parquet"""
+    import pandas # pylint: disable=import-outside-toplevel
+    pandas.DataFrame(value).to_parquet(wfd)
+
+################################################################################
+def json_dump(value, wfd):
+    """encode as json"""
+    wfd.write(json.dumps(value).encode())
+
+def csv_load(rfd):
+    """a DataFrame from csv data"""
+    import pandas # pylint: disable=import-outside-toplevel
+    return pandas.read_csv(rfd)
+
+def csv_dump(value, wfd):
+    """encode a DataFrame as csv"""
+    import pandas # pylint: disable=import-outside-toplevel
+    pandas.DataFrame(value).to_csv(wfd, index=False)
+
+def dataframe_to_csv(frame, *args, **kwargs):
+    """a DataFrame as csv"""
+    return frame.to_csv(*args, **kwargs)
+
+def dataframe_to_dict(frame, *args, **kwargs):
+    """a DataFrame as a dict"""
+    return frame.to_dict(*args, **kwargs)
+
+def dataframe_to_json(frame, *args, **kwargs):
+    """a DataFrame as json"""
+    return frame.to_json(*args, **kwargs)
+
+def dict_row_to_dataframe(data):
+    """a single row DataFrame, from a dict"""
+    import pandas # pylint: disable=import-outside-toplevel
+    return pandas.DataFrame.from_dict(dict((key, [value]) for key, value in data.items()),
+                                      orient='columns')
+
+register_codec('pickle', load=pickle.load, dump=pickle.dump, stream=True)
+register_codec('json', load=json.load, dump=json_dump, text=True, stream=True)
+register_codec('csv', load=csv_load, dump=csv_dump, kind='dataframe', text=True,
+               stream=True)
+register_codec('parquet', load=parquet_load, dump=parquet_dump, kind='dataframe')
+register_codec('arrow', buffer=arrow_buffer, dump=arrow_dump, kind='table')
+register_codec('npy', buffer=npy_buffer, dump=npy_dump, kind='array')
+
+register_converter('table>>dataframe', table_to_dataframe)
+register_converter('dataframe>>csv', dataframe_to_csv)
+register_converter('dataframe>>dict', dataframe_to_dict)
+register_converter('dataframe>>json', dataframe_to_json)
+register_converter('dict-row>>dataframe', dict_row_to_dataframe)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+DEX to Python: `poly build` writes the DEX of a form as a python module,
+`_polyform_plan.py`, with a function per phase (`expect_<form>()`,
+`finish_<form>()`).  The build byte-compiles it into the function zip, so a
+warm invocation calls plain functions, rather than eval()ing each step.
+
+Each function runs its plan's steps in order, in the DEX namespace (see
+reflex_arc.dex_run_compiled), and is keyed in PLANS by its plan's digest:
+it is only used for exactly the DEX it was generated from.  Plans which
+run steps concurrently (waves, or async) aren't generated, and are run by
+dex_run as before.
+"""
+
+import os
+from ..dex import DEX_VERSION
+from .plan import DexPlan, DexStep, FINISH_LIVE, PRAGMA, plan_digest, parse_pragma, \
+                  eliminate_steps, hoist_steps
+
+MODULE = '_polyform_plan'
+
+HEADER = '''"""
+Generated by `poly build` from the DEX of form {form}; do not edit.
+"""
+# pylint: skip-file
+
+DEX_VERSION = {version}
+'''
+
+# its own names are reserved (_), so they don't hide the context keys steps read
+FUNCTION = '''
+def {name}(_context):
+    _nbr = 0
+    try:
+{body}
+    except _DEXError:
+        raise
+    except Exception as _err:
+        raise _error(_nbr, _err)
+    return _context
+'''
+
+def codegen_plan(exprs, live=None):
+    """
+    The plan of exprs to generate, or None if it can't be.  Steps aren't
+    folded (their source is what is generated), otherwise it is optimized
+    as dex_plan() would.
+
+    >>> [step.nbr for step in codegen_plan(["assign(x, context, 'y')", "y > 1"]).steps]
+    [1, 2]
+    >>> codegen_plan(["#!DEX async=true", "x"]) is None
+    True
+    """
+    exprs = list(exprs or [])
+    pragmas = dict()
+    for expr in exprs:
+        if expr.startswith(PRAGMA):
+            pragmas.update(parse_pragma(expr))
+    steps = [DexStep(nbr, expr) for nbr, expr in enumerate(exprs, start=1)
+             if not expr.startswith(PRAGMA)]
+    if pragmas.get('async') or any(step.error for step in steps):
+        return None
+    plan = DexPlan(None, digest=plan_digest(exprs, live=live),
+                   steps=hoist_steps(eliminate_steps(steps, live=live)))
+    if plan.prefetch:
+        return None
+    plan.pragmas = pragmas
+    return plan
+
+def codegen_function(name, plan):
+    """
+    The source of a function running the steps of a plan
+
+    >>> print(codegen_function('expect_f', codegen_plan(["assign(x + 1, context, 'y')"])))
+    <BLANKLINE>
+    def expect_f(_context):
+        _nbr = 0
+        try:
+            # 1
+            _nbr = 1
+            _lift(_context, ('assign', 'x'))
+            _check((assign(x + 1, context, 'y')), 1)
+        except _DEXError:
+            raise
+        except Exception as _err:
+            raise _error(_nbr, _err)
+        return _context
+    <BLANKLINE>
+
+    It gives what dex_run would, whatever the context's keys are named:
+
+    >>> from polyform.sls import reflex_arc
+    >>> exprs = ["assign(nbr * 10 + err, context, 'out')", "out > context['nbr']"]
+    >>> plan = codegen_plan(exprs)
+    >>> namespace = dict()
+    >>> exec(codegen_function('expect_f', plan), namespace)
+    >>> compiled = (namespace['expect_f'], dict((step.nbr, step.expr) for step in plan.steps))
+    >>> def mylocals():
+    ...     return reflex_arc.dex_eval_locals(dict(context=dict(nbr=5, err=1, context=2)))
+    >>> reflex_arc.dex_run_compiled(compiled, mylocals())['out']
+    51
+    >>> reflex_arc.dex_run(reflex_arc.dex_plan(exprs), mylocals())['out']
+    51
+    """
+    body = list()
+    for step in plan.steps:
+        body.append("# {}".format(step.nbr))
+        body.append("_nbr = {}".format(step.nbr))
+        if step.names is None:
+            body.append("_lift(_context, None)")
+        elif step.names:
+            body.append("_lift(_context, {!r})".format(step.names))
+        body.append("_check(({}), {})".format(step.expr, step.nbr))
+    if not body:
+        body.append("pass")
+    return FUNCTION.format(name=name, body="\n".join(" " * 8 + line for line in body))
+
+def codegen_module(config):
+    """
+    The source of the plan module for a polyform config, as exported for
+    its target form (see dev.faas.export_polyconfig)
+    """
+    target = config['target']
+    form = config['forms'][target]
+    out = [HEADER.format(form=target, version=DEX_VERSION)]
+    plans = list()
+    for phase, live in (('expect', None), ('finish', FINISH_LIVE)):
+        exprs = form.get(phase)
+        if not exprs:
+            continue
+        plan = codegen_plan(exprs, live=live)
+        if plan is None:
+            continue
+        name = "{}_{}".format(phase, target).replace('-', '_')
+        out.append(codegen_function(name, plan))
+        plans.append("    {!r}: ({}, {!r}),".format(
+            plan.digest, name, dict((step.nbr, step.expr) for step in plan.steps)))
+    out.append("\n# plan digest: (function, {nbr: expr})\nPLANS = {\n" + "\n".join(plans) + "\n}\n")
+    return "\n".join(out)
+
+def write_module(config, folder):
+    """write the plan module for a polyform config into folder"""
+    path = os.path.join(folder, MODULE + ".py")
+    source = codegen_module(config)
+    compile(source, path, 'exec') # fail here, not at cold start
+    with open(path, "w") as outf:
+        outf.write(source)
+    return path
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Compression of stored objects, per datastore:
+
+    resources:
+      datastores:
+        s3-p1:
+          role: BackingData
+          driver: aws-s3
+          config:
+            compress: zstd    # or lz4, gzip
+
+(or DEX_COMPRESS, for the in container store).  Objects are put compressed,
+with the encoding as their ContentEncoding, so any store decompresses them
+on get, as they are read, whatever it compresses with itself.  gzip is in
+the standard library; zstd needs zstandard, and lz4 needs lz4, imported when
+used.
+"""
+
+import gzip
+from .stream import open_stream, copy_stream, spool
+
+ENCODINGS = dict()
+
+# pylint: disable=too-few-public-methods
+class Encoding():
+    """a registered compression: reader(rfd) and writer(wfd) file objects"""
+    __slots__ = ('name', 'reader', 'writer')
+
+    def __init__(self, name, reader, writer):
+        self.name = name
+        self.reader = reader
+        self.writer = writer
+
+def register_encoding(name, reader, writer):
+    """register (or replace) a compression"""
+    ENCODINGS[name] = Encoding(name, reader, writer)
+    return ENCODINGS[name]
+
+def get_encoding(name):
+    """
+    a registered compression
+
+    >>> get_encoding('rar')
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported compression: rar
+    """
+    if name not in ENCODINGS:
+        raise ValueError("Unsupported compression: {}".format(name))
+    return ENCODINGS[name]
+
+def decompressed(body, name):
+    """
+    body (a file or response body) as a binary stream, decompressed as it
+    is read
+
+    >>> import io
+    >>> decompressed(compressed(io.BytesIO(b'abc' * 1000), 'gzip'), 'gzip').read(6)
+    b'abcabc'
+    """
+    return open_stream(get_encoding(name).reader(body), source=body)
+
+def compressed(rfd, name):
+    """the rest of rfd, compressed into a temporary file (rewound)"""
+    encoding = get_encoding(name)
+    def write(wfd):
+        with encoding.writer(wfd) as zfd:
+            copy_stream(rfd, zfd)
+    return spool(write)
+
+################################################################################
+def gzip_reader(rfd):
+    """gzip decompressing reader"""
+    return gzip.GzipFile(fileobj=rfd, mode='rb')
+
+def gzip_writer(wfd):
+    """gzip compressing writer (leaves wfd open)"""
+    return gzip.GzipFile(fileobj=wfd, mode='wb', compresslevel=6)
+
+def zstd_reader(rfd):
+    """zstd decompressing reader"""
+    import zstandard # pylint: disable=import-outside-toplevel,import-error
+    return zstandard.ZstdDecompressor().stream_reader(rfd, closefd=False)
+
+def zstd_writer(wfd):
+    """zstd compressing writer (leaves wfd open)"""
+    import zstandard # pylint: disable=import-outside-toplevel,import-error
+    return zstandard.ZstdCompressor(level=3).stream_writer(wfd, closefd=False)
+
+def lz4_reader(rfd):
+    """lz4 (frame) decompressing reader"""
+    import lz4.frame # pylint: disable=import-outside-toplevel,import-error
+    return lz4.frame.LZ4FrameFile(rfd, mode='rb')
+
+def lz4_writer(wfd):
+    """lz4 (frame) compressing writer (leaves wfd open)"""
+    import lz4.frame # pylint: disable=import-outside-toplevel,import-error
+    return lz4.frame.LZ4FrameFile(wfd, mode='wb')
+
+register_encoding('gzip', gzip_reader, gzip_writer)
+register_encoding('zstd', zstd_reader, zstd_writer)
+register_encoding('lz4', lz4_reader, lz4_writer)
@@ -9,9 +9,14 @@ build and manage our layers, testing, and development.
 
 import os
 import json
+import base64
 import dictlib
 from dictlib import Dict #, dug
-from .reflex_arc import dex_intersect, DEXError
+from .reflex_arc import dex_intersect, dex_intersect_batch, DEXError
+from .plan import dex_plan, FINISH_LIVE
+from .profile import dex_profile
+from .writebehind import WriteQueue
+from .batch import BatchError
 from .logger import log
 from ..gql import validate as gql_validate
 from uuid import uuid4
@@ -43,6 +48,7 @@ class PolyformDecorator():
     _cfg = None
     _form = None
     _interface = None
+    _profile = None
     reqid = None
 
     def __init__(self, func, *args, **kwargs): # pylint: disable=unused-argument
@@ -62,8 +68,9 @@ class PolyformDecorator():
         A polyform wraper, for some convenience steps
         """
         try:
-            with open("_polyform.json") as infile:
-                self._cfg = Dict(json.load(infile))
+            if self._cfg is None:
+                self.load_config()
+            self._profile = dex_profile(self._cfg.forms[self._cfg.target])
             # TODO NEXT: AUTHENTICATE
 
             log(type="exec", msg="Starting Gather")
@@ -77,6 +84,21 @@ class PolyformDecorator():
             import traceback
             print(traceback.format_exc())
             raise DataExpectationFailed(err.message)
+        finally:
+            # not if loading the config failed, that error is what matters
+            if self._profile and self._cfg is not None:
+                self._profile.emit(form=self._cfg.target)
+
+    def load_config(self):
+        """
+        Load _polyform.json, once per container, and compile the DEX plans
+        for the target form so warm invocations don't pay for it.
+        """
+        with open("_polyform.json") as infile:
+            self._cfg = Dict(json.load(infile))
+        form = self._cfg.forms[self._cfg.target]
+        dex_plan(form.expect)
+        dex_plan(form.finish, live=FINISH_LIVE)
 
     def gather(self, *args, **kwargs):
         """
@@ -120,17 +142,27 @@ class aws_lambda_polyform(PolyformDecorator):
     def gather_lambda(self, event, aws_context, **_kwargs):
         """Gather data expectations prior to running"""
         mylocals = Dict(
-            context=dict(
-                interface=dict(
-                    event=event,
-                    input={},
-                    output={},
-                    biome=dict(aws=aws_context)
-                )
-            ),
+            context=self.lambda_context(event, aws_context),
             dims=self.dims
         )
 
+        # should check headers and give better errors, but assume its json
+        if self._profile:
+            self._profile.phase = 'expect'
+        return dex_intersect(self._cfg, self._form.expect, mylocals=mylocals,
+                             profile=self._profile)
+
+    def lambda_context(self, event, aws_context):
+        """The DEX context for an event, with its input validated"""
+        context = dict(
+            interface=dict(
+                event=event,
+                input={},
+                output={},
+                biome=dict(aws=aws_context)
+            )
+        )
+
         if not self._interface or not self._interface.get('Input'):
             log(type="warning", msg="No interface.Input definition, not processing input data")
         else:
@@ -141,16 +173,14 @@ class aws_lambda_polyform(PolyformDecorator):
                 raise DataExpectationFailed("no payload")
             if LOGDATA:
                 log(type="data", preExpect=json.dumps(body))
-            mylocals.context.interface.input = gql_validate.validate(
+            context['interface']['input'] = gql_validate.validate(
                 self._interface,
                 'Input',
                 body
             )
             if LOGDATA:
                 log(type="data", postExpect=json.dumps(body))
-
-        # should check headers and give better errors, but assume its json
-        return dex_intersect(self._cfg, self._form.expect, mylocals=mylocals)
+        return context
 
     def finish_lambda(self, context, result):
         """Finish after running"""
@@ -164,10 +194,22 @@ class aws_lambda_polyform(PolyformDecorator):
             mylocals.dims = self.dims
             mylocals.context = context
 
-            context = dex_intersect(self._cfg, self._form.finish, mylocals=mylocals)
-        else:
-            context.interface.output = result
+            if self._profile:
+                self._profile.phase = 'finish'
+            writes = WriteQueue()
+            context = dex_intersect(self._cfg, self._form.finish, mylocals=mylocals,
+                                    live=FINISH_LIVE, profile=self._profile, writes=writes)
+            # queued (write behind) pushes run while the output is validated
+            writes.flush()
+            try:
+                return self.lambda_output(context)
+            finally:
+                flush_writes(writes)
+        context.interface.output = result
+        return self.lambda_output(context)
 
+    def lambda_output(self, context):
+        """The validated output of a finished context"""
         if not self._interface or not self._interface.get('Output'):
             log(type="warning", msg="No interface.Output definition, not processing output data:")
             if context.interface.output:
@@ -180,6 +222,146 @@ class aws_lambda_polyform(PolyformDecorator):
         # print("result: {}".format(result))
         return result
 
+def flush_writes(writes):
+    """wait for the writes a finish block queued, failing if any did"""
+    try:
+        writes.join()
+    except BatchError as err:
+        raise DataExpectationFailed(str(err))
+
+def flush_batch_writes(writes, idents, failed):
+    """
+    wait for the writes a batch's finish block queued, failing the records
+    (by writes.owners, indexes into idents) whose writes failed; a write of
+    the shared steps fails every record
+    """
+    try:
+        writes.join()
+    except BatchError as err:
+        for index, error in sorted(err.errors.items()):
+            owners = writes.owners(err.keys[index])
+            for owner in range(len(idents)) if None in owners else sorted(owners):
+                failed(idents[owner], error)
+
+def record_body(record):
+    """
+    The payload of an SQS or Kinesis record
+
+    >>> record_body({'messageId': '1', 'body': '{"a": 1}'})
+    {'a': 1}
+    >>> record_body({'kinesis': {'data': 'eyJhIjogMX0='}})
+    {'a': 1}
+    """
+    if 'kinesis' in record:
+        return json.loads(base64.b64decode(record['kinesis']['data']))
+    return json.loads(record.get('body') or 'null')
+
+def record_id(record):
+    """The identifier to report an SQS or Kinesis record failure with"""
+    if 'kinesis' in record:
+        return record['kinesis'].get('sequenceNumber')
+    return record.get('messageId')
+
+# pylint: disable=invalid-name
+class aws_lambda_polyform_batch(aws_lambda_polyform):
+    """
+    For decorating AWS Lambda function calls which receive a batch of records
+    (SQS or Kinesis), where each record's body is one input.
+
+    The expect and finish DEX steps which are the same for every record
+    (model pulls, constants) are evaluated once per batch, the rest per
+    record.  Records which fail, or whose queued pushes fail, are reported as
+    batchItemFailures, so only they are retried (with ReportBatchItemFailures
+    enabled on the trigger).
+    """
+    def __call__(self, *args, **kwargs):
+        """run a batch of records, called as handler(event, aws_context)"""
+        event, aws_context = args[0], args[1]
+        if self._cfg is None:
+            self.load_config()
+        self._form = self._cfg.forms[self._cfg.target]
+        self._interface = self._form.interface
+        self._profile = dex_profile(self._form)
+        try:
+            failures = self._run_batch(event, aws_context)
+        finally:
+            if self._profile:
+                self._profile.emit(form=self._cfg.target,
+                                   records=len(event.get('Records') or []))
+        return dict(batchItemFailures=[dict(itemIdentifier=ident) for ident in failures])
+
+    def _run_batch(self, event, aws_context):
+        """run the records of event, returning the identifiers of those which failed"""
+        profile = self._profile
+        failures = list()
+
+        def failed(ident, err):
+            msg = getattr(err, 'message', None) or "{}: {}".format(err.__class__.__name__, err)
+            log(type="error", record=ident, msg=msg)
+            if ident not in failures:
+                failures.append(ident)
+
+        idents, contexts = list(), list()
+        for record in event.get('Records') or []:
+            ident = record_id(record)
+            try:
+                record = dict(record, parsed_body=record_body(record))
+                contexts.append(Dict(self.lambda_context(record, aws_context)))
+                idents.append(ident)
+            except Exception as err: # pylint: disable=broad-except
+                failed(ident, err)
+
+        log(type="exec", msg="Starting Gather", records=len(contexts))
+        if profile:
+            profile.phase = 'expect'
+        gathered = dex_intersect_batch(self._cfg, self._form.expect, contexts,
+                                       mylocals=dict(dims=self.dims), profile=profile)
+        log(type="exec", msg="Starting Function")
+        idents, contexts = self._batch_step(idents, gathered, failed, self._batch_func)
+
+        log(type="exec", msg="Starting Finish")
+        writes = WriteQueue()
+        if self._form.finish:
+            if profile:
+                profile.phase = 'finish'
+            contexts = dex_intersect_batch(self._cfg, self._form.finish, contexts,
+                                           mylocals=dict(dims=self.dims), live=FINISH_LIVE,
+                                           profile=profile, writes=writes)
+        writes.flush()
+        try:
+            self._batch_step(idents, contexts, failed, self.lambda_output)
+        finally:
+            flush_batch_writes(writes, idents, failed)
+        log(type="exec", msg="Function Finished", failed=len(failures))
+        return failures
+
+    @staticmethod
+    def _batch_step(idents, contexts, failed, func):
+        """call func on each context which hasn't failed, keeping those which don't"""
+        keep_idents, keep = list(), list()
+        for ident, context in zip(idents, contexts):
+            if isinstance(context, DEXError):
+                failed(ident, context)
+                continue
+            try:
+                keep.append(func(context))
+                keep_idents.append(ident)
+            except Exception as err: # pylint: disable=broad-except
+                failed(ident, err)
+        return keep_idents, keep
+
+    def _batch_func(self, context):
+        """run the function for one record, and set up for its finish"""
+        result = self._func(context=context, dims=self.dims)
+        if not isinstance(result, Result):
+            raise DataExpectationFailed("function returned a non Result() object")
+        context.result = result
+        if self._form.finish:
+            context.interface.output = Dict()
+        else:
+            context.interface.output = result
+        return context
+
 # def export(dict1):
 #     """
 #     Walk `dict1` which may be mixed dict()/Dict() and export any Dict()'s to dict()
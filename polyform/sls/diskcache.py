@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Local disk read-through cache for pulled objects, so a warm container
+doesn't download the same object again.
+
+Objects are kept under DEX_DISK_CACHE (default /tmp/dex-cache), by a hash
+of bucket/key, with their ETag alongside.  Each open revalidates with a
+conditional GET (If-None-Match), so a changed object is fetched again, and
+an unchanged one costs a round trip but no transfer.  Least recently used
+objects are evicted past DEX_DISK_CACHE_MB (0 turns the cache off), and ids
+found missing are remembered for NEGATIVE_TTL seconds.  Objects too big to
+keep (stored over DEX_DISK_CACHE_MB), or without an ETag, are passed
+through as they arrive, rather than copied to disk first.
+"""
+
+import os
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from .stream import open_stream, copy_stream
+
+CACHE_DIR = os.environ.get('DEX_DISK_CACHE', '/tmp/dex-cache')
+CACHE_MB = int(os.environ.get('DEX_DISK_CACHE_MB', 256))
+NEGATIVE_TTL = 60
+CACHE = None
+CACHE_LOCK = threading.Lock()
+
+ETAG = '.etag'
+
+class DiskCache():
+    """
+    A bounded cache of objects from a store, which has `bucket` (its name)
+    and fetch_sized(key, etag=None) giving (body, etag, size as stored),
+    with a body of None if the object still has etag, or raising
+    FileNotFoundError if missing.
+
+    >>> import io, tempfile
+    >>> class Store():
+    ...     bucket = 'b'
+    ...     objects = dict(a=(b'aaaa', '"1"'), b=(b'bbbb', '"2"'))
+    ...     sent = 0
+    ...     def fetch_sized(self, key, etag=None):
+    ...         if key not in self.objects:
+    ...             raise FileNotFoundError(key)
+    ...         data, tag = self.objects[key]
+    ...         if tag == etag:
+    ...             return None, tag, None
+    ...         self.sent += len(data)
+    ...         return io.BytesIO(data), tag, len(data)
+    >>> store = Store()
+    >>> cache = DiskCache(tempfile.mkdtemp(), max_bytes=6)
+    >>> [cache.open(store, 'a').read() for _ in range(3)], store.sent
+    ([b'aaaa', b'aaaa', b'aaaa'], 4)
+    >>> store.objects['a'] = (b'AAAA', '"3"')
+    >>> cache.open(store, 'a').read(), store.sent
+    (b'AAAA', 8)
+    >>> cache.open(store, 'b').read(), len(cache), cache.size   # 'a' evicted
+    (b'bbbb', 1, 4)
+    >>> cache.open(store, 'c')
+    Traceback (most recent call last):
+    ...
+    FileNotFoundError: c
+    >>> store.objects['c'] = (b'c', '"4"')
+    >>> cache.open(store, 'c')   # still remembered as missing
+    Traceback (most recent call last):
+    ...
+    FileNotFoundError: No such object: c
+    >>> cache.forget(store, 'c')
+    >>> cache.open(store, 'c').read()
+    b'c'
+    >>> cache.fetch(store, 'c', etag='"4"')   # the caller's copy is current
+    (None, '"4"')
+    >>> store.objects['big'] = (b'x' * 10, '"5"')
+    >>> isinstance(cache.open(store, 'big'), io.BytesIO)   # passed through, as it arrives
+    True
+    >>> len(cache), cache.size
+    (2, 5)
+    """
+    def __init__(self, root, max_bytes, negative_ttl=NEGATIVE_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self.size = 0
+        self._index = OrderedDict() # name: [etag, size], least recently used first
+        self._missing = dict()      # name: expires
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _scan(self):
+        """pick up what an earlier process (in this container) left"""
+        found = list()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if '.' in name:
+                if not name.endswith(ETAG) or not os.path.exists(path[:-len(ETAG)]):
+                    os.unlink(path) # partial downloads, orphaned etags
+                continue
+            try:
+                with open(path + ETAG) as infile:
+                    etag = infile.read()
+                stat = os.stat(path)
+            except OSError:
+                os.unlink(path)
+                continue
+            found.append((stat.st_mtime, name, etag, stat.st_size))
+        for _mtime, name, etag, size in sorted(found):
+            self._index[name] = [etag, size]
+            self.size += size
+        self._evict()
+
+    def _name(self, store, key):
+        return hashlib.sha1("{}/{}".format(store.bucket, key).encode()).hexdigest()
+
+    def _drop(self, name):
+        entry = self._index.pop(name, None)
+        if entry:
+            self.size -= entry[1]
+            path = os.path.join(self.root, name)
+            for item in (path, path + ETAG):
+                try:
+                    os.unlink(item)
+                except OSError:
+                    pass
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._index:
+            self._drop(next(iter(self._index)))
+
+    def forget(self, store, key):
+        """drop an object (and that it was missing), such as after a push"""
+        name = self._name(store, key)
+        with self._lock:
+            self._missing.pop(name, None)
+            self._drop(name)
+
+    def open(self, store, key):
+        """an object as a binary file, fetched only if it isn't current here"""
+        return self.fetch(store, key)[0]
+
+    def fetch(self, store, key, etag=None):
+        """
+        as store.fetch(), through the cache: (binary file, etag), or
+        (None, etag) if the object still has the etag given.  Objects it
+        doesn't keep come as the store's body.
+        """
+        name = self._name(store, key)
+        path = os.path.join(self.root, name)
+        with self._lock:
+            if self._missing.get(name, 0) > time.time():
+                raise FileNotFoundError("No such object: {}".format(key))
+            entry = self._index.get(name)
+        try:
+            body, current, size = store.fetch_sized(key, etag=entry[0] if entry else etag)
+        except FileNotFoundError:
+            with self._lock:
+                self._missing[name] = time.time() + self.negative_ttl
+                self._drop(name)
+            raise
+        if body is None: # unchanged
+            with self._lock:
+                if name in self._index:
+                    self._index.move_to_end(name)
+            if etag and current == etag:
+                return None, current
+            try:
+                return open(path, 'rb'), current
+            except FileNotFoundError: # evicted since
+                self.forget(store, key)
+                return self.fetch(store, key, etag=etag)
+        if not current or (size or 0) > self.max_bytes:
+            return body, current
+        return self._store(name, path, body, current), current
+
+    def _store(self, name, path, body, etag):
+        tmp = "{}.{}".format(path, uuid.uuid4().hex)
+        with open(tmp, 'wb') as wfd, open_stream(body) as rfd:
+            size = copy_stream(rfd, wfd)
+        # stays readable, whatever happens to the file; the caller closes it
+        rfd = open(tmp, 'rb') # pylint: disable=consider-using-with
+        if size > self.max_bytes: # bigger decompressed
+            os.unlink(tmp)
+            return rfd
+        with open(path + ETAG, 'w') as outfile:
+            outfile.write(etag)
+        os.replace(tmp, path)
+        with self._lock:
+            old = self._index.pop(name, None)
+            if old:
+                self.size -= old[1]
+            self._index[name] = [etag, size]
+            self.size += size
+            self._missing.pop(name, None)
+            self._evict()
+        return rfd
+
+def disk_cache():
+    """the container's disk cache, or None if it is turned off"""
+    global CACHE # pylint: disable=global-statement
+    if CACHE is None and CACHE_MB > 0:
+        with CACHE_LOCK:
+            if CACHE is None:
+                CACHE = DiskCache(CACHE_DIR, CACHE_MB * 1024 * 1024)
+    return CACHE
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Data universe node graph, behind DEX follow() (`node->key`).
+
+Edges are (node, label, node) triples, held CSR style in flat arrays: node
+ids and edge labels are sorted (and found by binary search), and each node's
+edges are a slice of the edge arrays, sorted by label.  So a hop is two
+binary searches, with no per-node python objects.
+
+    $invoker->behavior.phone.log    # follow(context['invoker'], 'behavior.phone.log')
+    $invoker->behavior.*.log        # '*' follows every label, giving a list
+
+The index is stored as one object in the BackingData store (GRAPH_KEY, see
+GraphIndex.to_bytes), loaded when first followed and kept in process for
+GRAPH_TTL seconds.  Each graph (by its key) is loaded under its own lock, so
+a slow load holds up only the follows of that graph.
+"""
+
+import os
+import sys
+import time
+import array
+import bisect
+import struct
+import threading
+from collections.abc import Mapping
+
+GRAPH_KEY = os.environ.get('DEX_GRAPH_KEY', '_graph/index')
+GRAPH_TTL = int(os.environ.get('DEX_GRAPH_TTL', 300))
+GRAPHS = dict() # graph key: (GraphIndex, time loaded)
+GRAPH_LOCKS = dict() # graph key: lock held while loading it
+GRAPH_LOCK = threading.Lock() # for GRAPH_LOCKS
+
+MAGIC = b'PFG1'
+INDEX = 'i' # array typecode of label/node numbers in the edge arrays
+HEADER = struct.Struct('<4sQQQQ')
+
+def _pack(arr):
+    if sys.byteorder != 'little':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+def _unpack(typecode, data):
+    arr = array.array(typecode)
+    arr.frombytes(data)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+class GraphIndex():
+    """
+    A directed, labelled graph in compressed sparse row form.
+
+    >>> graph = GraphIndex.build([('u1', 'behavior', 'b1'), ('b1', 'phone', 'p1'),
+    ...                           ('b1', 'geoloc', 'g1'), ('p1', 'log', 'L1'),
+    ...                           ('g1', 'log', 'L2'), ('u1', 'name', 'n1')])
+    >>> graph.follow('u1', 'behavior.phone.log')
+    'L1'
+    >>> graph.follow('u1', 'behavior.*.log')
+    ['L2', 'L1']
+    >>> graph.follow('u1', 'behavior.voice')
+    Traceback (most recent call last):
+    ...
+    KeyError: "follow(): no 'voice' edge from b1"
+    >>> GraphIndex.from_bytes(graph.to_bytes()).edges('b1')
+    [('geoloc', 'g1'), ('phone', 'p1')]
+    >>> GraphIndex.build([('u1', 'name', 'n1\\nn2')])
+    Traceback (most recent call last):
+    ...
+    ValueError: Graph node ids can't contain newlines: 'n1\\nn2'
+    """
+    __slots__ = ('ids', 'labels', 'offsets', 'edge_label', 'edge_target')
+
+    def __init__(self, ids, labels, offsets, edges):
+        self.ids = ids                  # sorted node ids
+        self.labels = labels            # sorted edge labels
+        self.offsets = offsets          # node i's edges are offsets[i]:offsets[i+1]
+        # the label index of each edge, and the node index it goes to
+        self.edge_label, self.edge_target = edges
+
+    @classmethod
+    def build(cls, edges):
+        """
+        an index of (source, label, target) triples; ids and labels are
+        stored newline separated, so can't contain newlines
+        """
+        edges = list(edges)
+        ids = sorted(set(src for src, _, _ in edges) | set(dst for _, _, dst in edges))
+        labels = sorted(set(label for _, label, _ in edges))
+        for what, names in (('node ids', ids), ('edge labels', labels)):
+            for name in names:
+                if "\n" in name:
+                    raise ValueError("Graph {} can't contain newlines: {!r}".format(what, name))
+        node_nbr = dict((node, nbr) for nbr, node in enumerate(ids))
+        label_nbr = dict((label, nbr) for nbr, label in enumerate(labels))
+        rows = sorted((node_nbr[src], label_nbr[label], node_nbr[dst])
+                      for src, label, dst in edges)
+        offsets = array.array('q', bytes(8 * (len(ids) + 1)))
+        for src, _, _ in rows:
+            offsets[src + 1] += 1
+        for nbr in range(len(ids)):
+            offsets[nbr + 1] += offsets[nbr]
+        return cls(ids, labels, offsets, (array.array(INDEX, (row[1] for row in rows)),
+                                          array.array(INDEX, (row[2] for row in rows))))
+
+    def to_bytes(self):
+        """serialized, for the BackingData store"""
+        ids = "\n".join(self.ids).encode()
+        labels = "\n".join(self.labels).encode()
+        return b''.join((HEADER.pack(MAGIC, len(ids), len(labels), len(self.ids),
+                                     len(self.edge_label)),
+                         ids, labels, _pack(self.offsets), _pack(self.edge_label),
+                         _pack(self.edge_target)))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """the index serialized by to_bytes()"""
+        magic, ids_len, labels_len, nodes, edges = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a graph index")
+        data = memoryview(data)[HEADER.size:]
+        ids = bytes(data[:ids_len]).decode().split("\n") if nodes else []
+        data = data[ids_len:]
+        labels = bytes(data[:labels_len]).decode().split("\n") if labels_len else []
+        data = data[labels_len:]
+        offsets = _unpack('q', data[:8 * (nodes + 1)])
+        data = data[8 * (nodes + 1):]
+        size = array.array(INDEX).itemsize * edges
+        return cls(ids, labels, offsets, (_unpack(INDEX, data[:size]),
+                                          _unpack(INDEX, data[size:2 * size])))
+
+    def _find(self, table, key):
+        pos = bisect.bisect_left(table, key)
+        if pos < len(table) and table[pos] == key:
+            return pos
+        return -1
+
+    def edges(self, node):
+        """the (label, target) edges of a node"""
+        src = self._find(self.ids, node)
+        if src < 0:
+            return []
+        return [(self.labels[self.edge_label[edge]], self.ids[self.edge_target[edge]])
+                for edge in range(self.offsets[src], self.offsets[src + 1])]
+
+    def _hop(self, src, label):
+        """node indexes reached from node index src by label ('*' for any)"""
+        start, end = self.offsets[src], self.offsets[src + 1]
+        if label == '*':
+            return self.edge_target[start:end].tolist()
+        lab = self._find(self.labels, label)
+        if lab < 0:
+            return []
+        first = bisect.bisect_left(self.edge_label, lab, start, end)
+        last = bisect.bisect_right(self.edge_label, lab, first, end)
+        return self.edge_target[first:last].tolist()
+
+    def follow(self, node, key):
+        """
+        the node(s) at the end of the path `key` (labels joined by '.') from
+        node; a list if the path has a '*' or fans out, otherwise one node id
+        """
+        src = self._find(self.ids, node)
+        if src < 0:
+            raise KeyError("follow(): no such node {}".format(node))
+        if self._find(self.labels, key) >= 0:  # a quoted label with a '.' in it
+            path = [key]
+        else:
+            path = key.split('.')
+        current = [src]
+        for label in path:
+            reached = list()
+            for nbr in current:
+                reached.extend(self._hop(nbr, label))
+            if not reached:
+                raise KeyError("follow(): no '{}' edge from {}".format(
+                    label, ",".join(self.ids[nbr] for nbr in current)))
+            current = reached
+        if len(current) == 1 and '*' not in path:
+            return self.ids[current[0]]
+        return [self.ids[nbr] for nbr in current]
+
+def dig(data, key):
+    """
+    follow() through nested data, rather than the graph
+
+    >>> dig({'a': {'b': 1, 'c': 2}, 'a.b': 3}, 'a.b'), dig({'a': {'b': 1, 'c': 2}}, 'a.*')
+    (3, [1, 2])
+    """
+    if key in data:
+        return data[key]
+    current = [data]
+    for part in key.split('.'):
+        if part == '*':
+            current = [value for item in current for value in item.values()]
+        else:
+            current = [item[part] for item in current]
+    if '*' in key.split('.'):
+        return current
+    return current[0]
+
+def graph_index(fetch, graph=GRAPH_KEY):
+    """
+    the graph index stored at `graph`, loaded with fetch(graph) (giving its
+    bytes) if it isn't in process yet, or is older than GRAPH_TTL
+
+    >>> index = GraphIndex.build([('u1', 'name', 'n1')])
+    >>> graph_index(lambda key: index.to_bytes(), graph='_graph/doc').follow('u1', 'name')
+    'n1'
+    >>> graph_index(None, graph='_graph/doc') is graph_index(None, graph='_graph/doc')
+    True
+    """
+    loaded = GRAPHS.get(graph)
+    if loaded is not None and time.time() - loaded[1] <= GRAPH_TTL:
+        return loaded[0]
+    with GRAPH_LOCK:
+        lock = GRAPH_LOCKS.setdefault(graph, threading.Lock())
+    with lock:
+        loaded = GRAPHS.get(graph)
+        if loaded is None or time.time() - loaded[1] > GRAPH_TTL:
+            loaded = GRAPHS[graph] = (GraphIndex.from_bytes(fetch(graph)), time.time())
+        return loaded[0]
+
+def follow(node, key, fetch, graph=GRAPH_KEY):
+    """
+    DEX follow(): dig into a dict, or walk the graph from a node id (or the
+    `id` of a dict without the key, or each of a list of nodes).
+
+    >>> follow({'csv': 'a,b'}, 'csv', None)
+    'a,b'
+    """
+    if isinstance(node, Mapping):
+        first = key.split('.', 1)[0]
+        if key in node or first in node or first == '*' or 'id' not in node:
+            return dig(node, key)
+        node = node['id']
+    if isinstance(node, (list, tuple)):
+        out = list()
+        for item in node:
+            found = follow(item, key, fetch, graph=graph)
+            out.extend(found if isinstance(found, list) else [found])
+        return out
+    if not isinstance(node, str):
+        raise TypeError("follow(): can't follow from {}".format(type(node).__name__))
+    return graph_index(fetch, graph=graph).follow(node, key)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Lambda Min - invoking other polyforms from within a container -- minimal
+'in serverless' version.
+"""
+
+import json
+from .boto3_min import Boto3Min
+
+class InvokeError(Exception):
+    """an invoked function failed"""
+
+# pylint: disable=too-few-public-methods
+class LambdaMin(Boto3Min):
+    """Lambda Wrapper for within a container"""
+
+    def __init__(self, **config):
+        super().__init__(service='lambda', **config)
+
+    def invoke(self, name, payload):
+        """
+        invoke a function and wait for its (json) result; InvokeError if it
+        failed
+        """
+        res = self.client.invoke(FunctionName=name, Payload=json.dumps(payload).encode())
+        result = json.loads(res['Payload'].read() or 'null')
+        if res.get('FunctionError'):
+            raise InvokeError("{} failed: {}".format(name, result))
+        return result
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Lazy pull() - data fetched in the background, and only loaded (deserialized)
+when it is first used.
+
+    model = pull("BACFAF-1FA14D-89FA", "pickle>>*", lazy=True)
+
+A LazyPull stands in for the value: attribute access, indexing, calls,
+comparison and arithmetic all load it first.  Use `force()` (or `.force()`)
+where the real object is needed, such as isinstance checks.
+"""
+
+import threading
+
+def force(value):
+    """
+    the loaded value of a LazyPull, anything else as is
+
+    >>> force(1)
+    1
+    """
+    if isinstance(value, LazyPull):
+        return value.force()
+    return value
+
+class LazyPull():
+    """
+    A pulled value.  `fetch()` gives a file like object, which is started on
+    `pool` when given, and `load(fd)` turns it into the value on first use.
+    Without load, fetch() gives the value itself.
+
+    >>> import io, json
+    >>> calls = list()
+    >>> def fetch():
+    ...     calls.append('fetch')
+    ...     return io.StringIO('{"a": [1, 2]}')
+    >>> data = LazyPull(fetch, json.load)
+    >>> calls, data.done()
+    ([], False)
+    >>> data['a'], data.keys(), len(data)
+    ([1, 2], dict_keys(['a']), 1)
+    >>> calls, data.done(), force(data)
+    (['fetch'], True, {'a': [1, 2]})
+    >>> LazyPull(lambda: io.StringIO('2'), json.load) * 3
+    6
+    >>> LazyPull(lambda: [1, 2], None) + [3]
+    [1, 2, 3]
+    """
+    __slots__ = ('_fetch', '_load', '_future', '_value', '_done', '_lock')
+
+    def __init__(self, fetch, load, pool=None):
+        self._fetch = fetch
+        self._load = load
+        self._future = pool.submit(fetch) if pool else None
+        self._value = None
+        self._done = False
+        self._lock = threading.Lock()
+
+    def done(self):
+        """has the value been loaded"""
+        return self._done
+
+    def force(self):
+        """wait for the fetch, and load the value (once)"""
+        if self._done:
+            return self._value
+        with self._lock:
+            if not self._done:
+                # not started yet?  run it here, rather than wait on the pool
+                if self._future is None or self._future.cancel():
+                    rfd = self._fetch()
+                else:
+                    rfd = self._future.result()
+                if self._load is None:
+                    self._value = rfd
+                else:
+                    try:
+                        self._value = self._load(rfd)
+                    finally:
+                        rfd.close()
+                self._done = True
+                self._fetch = self._future = None
+        return self._value
+
+    def __getattr__(self, name):
+        if name in LazyPull.__slots__: # not initialized (ie: copy)
+            raise AttributeError(name)
+        return getattr(self.force(), name)
+
+    def __repr__(self):
+        if self._done:
+            return repr(self._value)
+        return "<LazyPull pending>"
+
+def _forward(name):
+    def method(self, *args, **kwargs):
+        return getattr(self.force(), name)(*args, **kwargs)
+    method.__name__ = name
+    return method
+
+# special methods are looked up on the type, not through __getattr__
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__contains__', '__iter__',
+              '__len__', '__call__', '__bool__', '__str__', '__hash__', '__eq__', '__ne__',
+              '__lt__', '__le__', '__gt__', '__ge__', '__add__', '__radd__', '__sub__',
+              '__rsub__', '__mul__', '__rmul__', '__truediv__', '__rtruediv__',
+              '__floordiv__', '__rfloordiv__', '__mod__', '__rmod__', '__pow__', '__rpow__',
+              '__neg__', '__pos__', '__abs__', '__float__', '__int__', '__index__'):
+    setattr(LazyPull, _name, _forward(_name))
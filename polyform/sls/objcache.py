@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+In process cache of decoded pull() results, so a warm container doesn't
+unpickle the same model on every request:
+
+    model = pull("BACFAF-1FA14D-89FA", "pickle>>*", cache=True)
+
+Values are keyed by (id, typedef), and kept with the ETag they were decoded
+from: each pull revalidates with the store (a round trip, but no transfer or
+decode while it is unchanged).  Least recently used values are evicted past
+DEX_OBJECT_CACHE_MB (0 turns the cache off), by an estimate of their size.
+
+The same object is given to every pull, so a cached value must not be
+changed in place.  Caching is opted into per pull with cache=True, or for
+every typed pull with DEX_OBJECT_CACHE=true (then opted out of with
+cache=False).
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+OBJECT_CACHE_MB = int(os.environ.get('DEX_OBJECT_CACHE_MB', 512))
+DEFAULT = os.environ.get('DEX_OBJECT_CACHE', 'false').lower() == 'true'
+CACHE = None
+CACHE_LOCK = threading.Lock()
+
+def sizeof(value, default=0):
+    """
+    estimated bytes in memory of value: arrays, tables and frames know
+    theirs; for anything else, at least default (what it was decoded from)
+
+    >>> import numpy
+    >>> sizeof(numpy.zeros(1000)), sizeof(object(), default=100)
+    (8000, 100)
+    """
+    usage = getattr(value, 'memory_usage', None) # pandas
+    if callable(usage):
+        total = usage(deep=True)
+        if hasattr(total, 'sum'):
+            total = total.sum()
+        return max(int(total), default)
+    nbytes = getattr(value, 'nbytes', None) # numpy, pyarrow
+    if isinstance(nbytes, int):
+        return max(nbytes, default)
+    return max(sys.getsizeof(value), default)
+
+def read_size(rfd):
+    """bytes read from a file (or stream.open_stream) so far, as best known"""
+    raw = getattr(rfd, 'raw', None)
+    if hasattr(raw, 'nbytes'):
+        return raw.nbytes
+    try:
+        return rfd.tell()
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+class ObjectCache():
+    """
+    A bounded LRU of decoded values, each kept with the ETag it came from.
+
+    >>> import io, json
+    >>> objects = {'a': (b'[1, 2]', '"1"')}
+    >>> loads = list()
+    >>> def fetch(etag):
+    ...     data, tag = objects['a']
+    ...     return (None, tag) if tag == etag else (io.BytesIO(data), tag)
+    >>> def load(rfd):
+    ...     loads.append(1)
+    ...     return json.load(rfd)
+    >>> cache = ObjectCache(max_bytes=1000)
+    >>> [cache.pull(('a', 'json'), fetch, load) for _ in range(3)], len(loads)
+    ([[1, 2], [1, 2], [1, 2]], 1)
+    >>> objects['a'] = (b'[3]', '"2"')
+    >>> cache.pull(('a', 'json'), fetch, load), len(loads)
+    ([3], 2)
+    >>> cache.forget('a')
+    >>> len(cache), cache.size
+    (0, 0)
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict() # key: (etag, value, size), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _drop(self, key):
+        entry = self._data.pop(key, None)
+        if entry:
+            self.size -= entry[2]
+
+    def forget(self, duid):
+        """drop every value pulled from duid, such as after a push"""
+        with self._lock:
+            for key in [key for key in self._data if key[0] == duid]:
+                self._drop(key)
+
+    def put(self, key, etag, value, size):
+        """keep value (of size bytes), if it fits"""
+        with self._lock:
+            self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._data[key] = (etag, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._data)))
+
+    def pull(self, key, fetch, load):
+        """
+        The value for key: fetch(etag) gives (binary file, etag), with a file
+        of None if the object still has etag, and load(file) decodes it.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry:
+                self._data.move_to_end(key)
+        rfd, etag = fetch(entry[0] if entry else None)
+        if rfd is None:
+            return entry[1]
+        try:
+            value = load(rfd)
+            size = sizeof(value, default=read_size(rfd))
+        finally:
+            rfd.close()
+        if etag:
+            self.put(key, etag, value, size)
+        return value
+
+def object_cache():
+    """the process's object cache, or None if it is turned off"""
+    global CACHE # pylint: disable=global-statement
+    if CACHE is None and OBJECT_CACHE_MB > 0:
+        with CACHE_LOCK:
+            if CACHE is None:
+                CACHE = ObjectCache(OBJECT_CACHE_MB * 1024 * 1024)
+    return CACHE
@@ -0,0 +1,755 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+DEX Plan - transpiled DEX expressions, compiled once to code objects.
+
+`dex_transpile()` gives us a list of python expression strings.  Rather than
+`eval()` each string on every request (which re-parses and re-compiles it),
+a plan holds the compiled code objects, cached by a hash of the source (and
+by the list it came from, so finding it again hashes nothing), so a warm
+container only pays for evaluation.
+
+Each step is also analyzed for what it reads and writes in the context.  The
+expressions which fetch data (IO_CALLS) and don't conflict with the steps
+between them are grouped into waves, which the runtime starts together, so
+a form pulling several participants waits out one round trip rather than N.
+Results are still taken, and checked, in declared order.
+
+Before scheduling, a plan is optimized (unless DEX_OPTIMIZE=0):
+
+* constants are folded, and constant assignments which are written only once
+  are propagated into the steps after them.  A step folding to a true
+  constant is dropped, one folding to a false constant stays so it fails
+  where it did.
+* assignments which are never read (overwritten first, or not in `live` at
+  the end of the block) are dropped, but only when their value can't fail
+  or be false: a true literal, or a key an earlier step assigned (and so
+  was checked true with).  Every line of DEX must be true, so anything
+  else (comparisons, validation, fetches, calls) is kept and checked.
+* cheap validation steps are moved ahead of the fetches before them, when
+  they don't read what those fetches write, so bad requests fail before
+  any I/O.  Errors still report the step's original number.
+
+For batches of records, a plan splits into the steps which are the same for
+every record (they don't read RECORD_KEYS, or anything from the other steps,
+and have no side effects), run once per batch, and the rest, run per record.
+
+Pragma entries ('#!DEX key=value ...') set options for the whole plan, in
+`pragmas`.  With async=true the runtime awaits the I/O builtins (ASYNC_CALLS)
+of each step on asyncio, through DexStep.arun().
+
+Context keys are brought into the eval namespace per step, and only the
+names that step reads (its `names`), so the cost of a step doesn't grow with
+the size of the context.
+
+see polyform.dex for more info.
+"""
+
+import os
+import ast
+import copy
+import json
+import types
+import hashlib
+from collections import Counter
+
+# plans by source digest; a container only ever sees a handful of these
+PLANS = dict()
+
+# plans by their expressions (as a tuple) and live keys, found without
+# hashing the source again
+PLANS_BY_SOURCE = dict()
+
+# past this many, either is emptied, rather than grow with generated blocks
+PLANS_LIMIT = 256
+
+OPTIMIZE = os.environ.get('DEX_OPTIMIZE', '1') != '0'
+
+# builtins which fetch data, and are worth running concurrently
+IO_CALLS = frozenset(('pull', 'pull_many', 'gather', 'polyform'))
+
+# builtins which are awaited when a block is run with #!DEX async=true
+ASYNC_CALLS = frozenset(('pull', 'push', 'pull_many', 'push_many', 'gather', 'polyform'))
+
+PRAGMA = '#!DEX'
+
+# builtins with side effects outside of the context; nothing moves past these
+SIDE_EFFECTS = frozenset(('push', 'push_many', 'inspect'))
+
+# calls which are safe to run a fetch ahead of.  Anything else is a function
+# from the form's namespace, and may have side effects we can't see.
+PURE_CALLS = frozenset((
+    'assign', 'force', 'follow', 'to', 'is_', 'are', 'in_range', 'convert', 'autoclean',
+    'b64enc', 'b64dec', 'abs', 'all', 'any', 'bool', 'dict', 'float', 'int',
+    'isinstance', 'len', 'list', 'max', 'min', 'round', 'set', 'sorted', 'str',
+    'sum', 'tuple'
+))
+
+# builtins which exist to fail a request
+VALIDATION = frozenset(('is_', 'are', 'in_range'))
+
+# pure python builtins which may be run at compile time on constants
+FOLD_CALLS = dict(abs=abs, bool=bool, float=float, int=int, len=len, max=max,
+                  min=min, round=round, str=str)
+
+# steps calling only these (and with no writes) are cheap checks
+CHECK_CALLS = VALIDATION | frozenset(FOLD_CALLS) | frozenset(('all', 'any', 'isinstance'))
+
+IMMUTABLE = (int, float, complex, str, bytes, bool, type(None))
+
+# context keys which are particular to a record (request)
+RECORD_KEYS = frozenset(('interface', 'result'))
+
+# all that is read from the context after the finish DEX block
+FINISH_LIVE = ('interface',)
+
+def _literal(node):
+    """the value of a literal ast node, or None"""
+    if isinstance(node, getattr(ast, 'Index', ())): # python < 3.9
+        node = node.value
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return None
+
+def _is_context(node):
+    return isinstance(node, ast.Name) and node.id == 'context'
+
+def _call_name(call):
+    """the name called: '.name' for a method, '()' for anything not named"""
+    if isinstance(call.func, ast.Attribute):
+        return '.' + call.func.attr
+    if isinstance(call.func, ast.Name):
+        return call.func.id
+    return '()'
+
+def _assign_key(call):
+    """the context key (the first, of a list) a call of `assign(value, context, key)` writes"""
+    if not isinstance(call.func, ast.Name) or call.func.id != 'assign' \
+       or len(call.args) != 3 or not _is_context(call.args[1]):
+        return None
+    key = _literal(call.args[2])
+    if isinstance(key, list) and key:
+        key = key[0]
+    return key if isinstance(key, str) else None
+
+def analyze(expr):
+    """
+    What a transpiled DEX expression (source or ast) reads and writes in the
+    context, and the names it calls.  Context keys are lifted into the
+    namespace at runtime, so a bare name is a read of that key.  Anything
+    using the context as a whole gives None for reads and writes.  Method
+    calls are listed as '.name', and calls of anything else as '()'.
+
+    >>> reads, writes, calls = analyze("assign(pull(context['who']), context, 'person')")
+    >>> sorted(reads), writes, sorted(calls)
+    (['assign', 'pull', 'who'], {'person'}, ['assign', 'pull'])
+    >>> analyze("assign(score, context, ['result', 'score'])")[1]
+    {'result'}
+    >>> analyze("inspect(context)")[:2]
+    (None, None)
+    >>> analyze("model.fit(data)")[2]
+    {'.fit'}
+    """
+    reads, writes, calls = set(), set(), set()
+    seen = set() # context references which are accounted for
+    whole = False
+    if isinstance(expr, str):
+        expr = ast.parse(expr, mode='eval')
+    for node in ast.walk(expr):
+        if isinstance(node, ast.Call):
+            calls.add(_call_name(node))
+            key = _assign_key(node)
+            if key is not None:
+                writes.add(key)
+                seen.add(id(node.args[1]))
+        elif isinstance(node, ast.Subscript) and _is_context(node.value):
+            key = _literal(node.slice)
+            if isinstance(key, str):
+                reads.add(key)
+                seen.add(id(node.value))
+        elif isinstance(node, ast.Attribute) and _is_context(node.value):
+            reads.add(node.attr)
+            seen.add(id(node.value))
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            if node.id != 'context':
+                reads.add(node.id)
+            elif id(node) not in seen:
+                whole = True
+    if whole:
+        return None, None, calls
+    return reads, writes, calls
+
+# a slot for each part of a step's analysis, which is done once
+# pylint: disable=too-few-public-methods,too-many-instance-attributes
+class DexStep():
+    """
+    A single compiled DEX expression.  `nbr` is its (1-based) position in the
+    original list, which is what errors report.  `tree` is given when the
+    step is rewritten by the optimizer, `expr` is then still the original.
+    """
+    __slots__ = ('nbr', 'expr', 'tree', 'code', 'error', 'reads', 'writes', 'calls',
+                 'names', 'acode')
+
+    def __init__(self, nbr, expr, tree=None):
+        self.nbr = nbr
+        self.expr = expr
+        self.tree = tree
+        self.code = None
+        self.error = None
+        self.reads = self.writes = self.names = self.acode = None
+        self.calls = set()
+        try:
+            if self.tree is None:
+                self.tree = ast.parse(expr, mode='eval')
+            self.code = compile(self.tree, '<dex:{}>'.format(nbr), 'eval')
+            self.reads, self.writes, self.calls = analyze(self.tree)
+            if self.reads is not None:
+                self.names = tuple(sorted(self.reads))
+        except SyntaxError as err:
+            # defer, so the failure is reported at this step when it is reached
+            self.error = err
+
+    @property
+    def whole(self):
+        """does this step use the context as a whole (or fail to compile)"""
+        return self.reads is None
+
+    @property
+    def concurrent(self):
+        """can this step run alongside others"""
+        return bool(self.calls & IO_CALLS) and not self.whole \
+               and not self.calls & SIDE_EFFECTS
+
+    @property
+    def barrier(self):
+        """can nothing be started ahead of this step"""
+        return self.whole or bool(self.calls - PURE_CALLS - IO_CALLS)
+
+    @property
+    def check(self):
+        """is this a cheap validation, which changes nothing"""
+        return not self.whole and not self.writes and self.calls <= CHECK_CALLS
+
+    def assigned(self):
+        """the key and value node, if this step is `assign(value, context, 'key')`"""
+        body = getattr(self.tree, 'body', None)
+        if isinstance(body, ast.Call) and not body.keywords and _assign_key(body) is not None:
+            key = _literal(body.args[2])
+            if isinstance(key, str):
+                return key, body.args[0]
+        return None, None
+
+    def lift(self, namespace, context):
+        """
+        Bring the context keys this step reads up into the namespace (all of
+        them if it uses the context as a whole).
+
+        >>> ns = dict()
+        >>> DexStep(1, "a + b").lift(ns, dict(a=1, c=3))
+        >>> ns
+        {'a': 1}
+        """
+        if self.names is None:
+            namespace.update(context)
+            return
+        for name in self.names:
+            if name in context:
+                namespace[name] = context[name]
+
+    def run(self, namespace):
+        """evaluate this step in the given namespace"""
+        if self.error:
+            raise self.error
+        return eval(self.code, namespace) # pylint: disable=eval-used
+
+    @property
+    def awaits(self):
+        """does this step call an I/O builtin which is awaited when async"""
+        return bool(self.calls & ASYNC_CALLS)
+
+    def arun(self, namespace):
+        """
+        A coroutine evaluating this step in the given namespace, awaiting
+        the I/O builtins, which it calls as `_async_<name>`.
+
+        >>> import asyncio
+        >>> async def _async_pull(key):
+        ...     return key.upper()
+        >>> ns = dict(_async_pull=_async_pull, pull=str.upper, keys=['b', 'c'])
+        >>> step = DexStep(1, "pull('a') + ''.join(map(lambda k: pull(k), keys))")
+        >>> asyncio.run(step.arun(ns))
+        'ABC'
+        """
+        if self.error:
+            raise self.error
+        if self.acode is None:
+            self.acode = async_code(self.tree, self.nbr)
+        coroutine = types.FunctionType(self.acode, namespace)
+        return coroutine() # pylint: disable=not-callable
+
+class AwaitIO(ast.NodeTransformer):
+    """
+    Await the I/O builtins in an expression, as `await _async_<name>(...)`.
+    Not inside lambdas or comprehensions, which can't await; those keep
+    calling the blocking builtin.
+    """
+    # pylint: disable=invalid-name,missing-docstring
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id in ASYNC_CALLS:
+            node.func = ast.copy_location(ast.Name(id='_async_' + node.func.id,
+                                                   ctx=ast.Load()), node.func)
+            return ast.copy_location(ast.Await(value=node), node)
+        return node
+
+    def visit_Lambda(self, node):
+        return node
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_Lambda
+
+def async_code(tree, nbr):
+    """the code of an `async def` returning the expression, with its I/O awaited"""
+    module = ast.parse("async def dex_{}():\n    return None".format(nbr))
+    module.body[0].body[0].value = AwaitIO().visit(copy.deepcopy(tree.body))
+    code = compile(ast.fix_missing_locations(module), '<dex:{}>'.format(nbr), 'exec')
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            return const
+    raise SyntaxError("no function compiled for step {}".format(nbr))
+
+def parse_pragma(expr):
+    """
+    The options of a pragma entry
+
+    >>> sorted(parse_pragma("#!DEX async=true workers=4 strict").items())
+    [('async', True), ('strict', True), ('workers', 4)]
+    """
+    options = dict()
+    for opt in expr[len(PRAGMA):].split():
+        key, _, value = opt.partition('=')
+        if not value or value.lower() == 'true':
+            value = True
+        elif value.lower() == 'false':
+            value = False
+        elif value.isdigit():
+            value = int(value)
+        options[key] = value
+    return options
+
+################################################################################
+# optimizer
+class Folder(ast.NodeTransformer):
+    """
+    Fold constant expressions, substituting known constant context keys.
+
+    >>> fold = lambda expr, **consts: ast.dump(Folder(consts).visit(
+    ...     ast.parse(expr, mode='eval')).body)
+    >>> fold("60 * 60 * 24") == fold("86400")
+    True
+    >>> fold("x if limit > 10 else y", limit=20) == fold("x")
+    True
+    >>> fold("True and int(context['mx']) or z", mx="5") == fold("5")
+    True
+    >>> fold("1 / 0") == fold("1 / 0")
+    True
+    """
+    def __init__(self, consts):
+        self.consts = consts
+
+    @staticmethod
+    def _fold(node):
+        """evaluate node if all of its parts are constant"""
+        for child in ast.iter_child_nodes(node):
+            if isinstance(node, ast.Call) and child is node.func:
+                continue
+            if not isinstance(child, (ast.Constant, ast.expr_context, ast.operator,
+                                      ast.unaryop, ast.cmpop, ast.boolop)):
+                return node
+        try:
+            value = eval(compile(ast.Expression(body=node), '<fold>', 'eval'), # pylint: disable=eval-used
+                         {'__builtins__': FOLD_CALLS})
+        except Exception: # pylint: disable=broad-except
+            return node # leave it to fail at runtime, in its place
+        if not isinstance(value, IMMUTABLE):
+            return node
+        return ast.copy_location(ast.Constant(value=value), node)
+
+    # pylint: disable=invalid-name,missing-docstring
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load) and node.id in self.consts:
+            return ast.copy_location(ast.Constant(value=self.consts[node.id]), node)
+        return node
+
+    def visit_Subscript(self, node):
+        if _is_context(node.value) and _literal(node.slice) in self.consts:
+            return ast.copy_location(ast.Constant(value=self.consts[_literal(node.slice)]), node)
+        return self.generic_visit(node)
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        # don't build something huge at compile time
+        right = getattr(node.right, 'value', None)
+        if isinstance(node.op, (ast.Pow, ast.LShift)) \
+           and not (isinstance(right, int) and -64 <= right <= 64):
+            return node
+        if isinstance(node.op, ast.Mult) and any(
+                isinstance(getattr(side, 'value', None), (str, bytes, tuple))
+                for side in (node.left, node.right)):
+            return node
+        return self._fold(node)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        return self._fold(node)
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        return self._fold(node)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        values = node.values
+        # leading constants decide, or drop out
+        while values and isinstance(values[0], ast.Constant):
+            if bool(values[0].value) != isinstance(node.op, ast.And) or len(values) == 1:
+                return values[0]
+            values = values[1:]
+        node.values = values
+        return values[0] if len(values) == 1 else node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.test, ast.Constant):
+            return node.body if node.test.value else node.orelse
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name): # a name called is never a constant
+            node.func = self.visit(node.func)
+        node.args = [self.visit(arg) for arg in node.args]
+        for kwarg in node.keywords:
+            kwarg.value = self.visit(kwarg.value)
+        if isinstance(node.func, ast.Name) and node.func.id in FOLD_CALLS \
+           and not node.keywords:
+            return self._fold(node)
+        return node
+
+    def visit_Lambda(self, node):
+        return node # it may bind names of its own; leave it be
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_Lambda
+
+def fold_steps(steps):
+    """
+    Constant folding and propagation.  Only keys written once, by a constant,
+    in a plan which never uses the context as a whole, are propagated (into
+    the steps after the write).
+    """
+    propagate = not any(step.whole for step in steps)
+    written = Counter(key for step in steps if step.writes for key in step.writes)
+    consts = dict()
+    out = list()
+    for step in steps:
+        if step.error:
+            out.append(step)
+            continue
+        tree = ast.fix_missing_locations(Folder(consts).visit(copy.deepcopy(step.tree)))
+        if isinstance(tree.body, ast.Constant) and tree.body.value:
+            continue # always true
+        step = DexStep(step.nbr, step.expr, tree=tree)
+        key, value = step.assigned()
+        if propagate and key and written[key] == 1 and isinstance(value, ast.Constant):
+            consts[key] = value.value
+        out.append(step)
+    return out
+
+def _checked_keys(steps):
+    """
+    for each step, the keys assigned by the steps before it, and so checked
+    true (not by a fetch, which may be lazy and unchecked), and unchanged since
+    """
+    out = list()
+    checked = set()
+    for step in steps:
+        out.append(frozenset(checked))
+        if step.barrier: # may change anything
+            checked = set()
+            continue
+        checked -= step.writes
+        key, _value = step.assigned()
+        if key and not step.calls & IO_CALLS:
+            checked.add(key)
+    return out
+
+def _never_false(value, checked):
+    """can evaluating value neither fail nor be false"""
+    if isinstance(value, ast.Name):
+        return value.id in checked
+    literal = _literal(value)
+    return literal is not None and bool(literal)
+
+def eliminate_steps(steps, live=None):
+    """
+    Drop assignments nobody reads, if they can't fail the block.  `live`
+    is what is read from the context after the block, None for all of it.
+    """
+    checked = _checked_keys(steps)
+    everything = live is None
+    live = set(live or ())
+    killed = set() # overwritten below, before any read
+    keep = list()
+    for idx in range(len(steps) - 1, -1, -1):
+        step = steps[idx]
+        key, value = step.assigned()
+        if key and step.writes == {key} and _never_false(value, checked[idx]) \
+           and (key in killed if everything else key not in live):
+            continue
+        if step.whole:
+            everything = True
+            killed = set()
+        else:
+            if key:
+                killed.add(key)
+                live.discard(key)
+            killed -= step.reads
+            live |= step.reads
+        keep.append(step)
+    keep.reverse()
+    return keep
+
+def hoist_steps(steps):
+    """
+    Move cheap checks ahead of the fetches before them, unless they read
+    something those fetches write.
+    """
+    out = list()
+    for step in steps:
+        pos = len(out)
+        if step.check:
+            while pos and out[pos-1].calls & IO_CALLS and not out[pos-1].barrier \
+                  and not out[pos-1].calls & SIDE_EFFECTS \
+                  and not step.reads & out[pos-1].writes:
+                pos -= 1
+        out.insert(pos, step)
+    return out
+
+def optimize_steps(steps, live=None):
+    """
+    Optimize a list of DexSteps, see the module docs.
+
+    >>> steps = lambda *exprs: [DexStep(nbr, expr) for nbr, expr in enumerate(exprs, 1)]
+    >>> same = lambda step, expr: ast.dump(step.tree) == ast.dump(ast.parse(expr, mode='eval'))
+
+    Folding, propagation and dropping what is always true:
+
+    >>> plan = optimize_steps(steps("assign(60 * 60, context, 'ttl')", "ttl > 0",
+    ...                             "assign(x * ttl, context, 'y')"))
+    >>> [step.nbr for step in plan], same(plan[1], "assign(x * 3600, context, 'y')")
+    ([1, 3], True)
+
+    Unread assignments, only if they can't fail (a true literal, or a key
+    already checked), so fetches, side effects, validation and comparisons
+    are all kept:
+
+    >>> plan = optimize_steps(steps("assign(pull('a'), context, 'tmp')", "push(x, 'b')",
+    ...                             "assign(result.age > 18, context, 'adult')",
+    ...                             "assign(are(y, 'int'), context, 'z')",
+    ...                             "assign(z, context, 'copy')",
+    ...                             "assign('v1', context, 'version')",
+    ...                             "assign(x, context, ['interface', 'output'])",
+    ...                             "assign(y, context, 'unchecked')"), live=FINISH_LIVE)
+    >>> [step.nbr for step in plan]
+    [1, 2, 3, 4, 7, 8]
+    >>> [step.nbr for step in optimize_steps(steps("assign(1, context, 'b')",
+    ...                                            "assign(c, context, 'b')"))]
+    [2]
+
+    Checks ahead of fetches:
+
+    >>> [step.nbr for step in optimize_steps(steps(
+    ...     "assign(pull('a'), context, 'person')",
+    ...     "assign(pull('b'), context, 'spouse')",
+    ...     "in_range(context['age'], 18, 120)",
+    ...     "is_(person, 'human')"))]
+    [3, 1, 4, 2]
+    """
+    return hoist_steps(eliminate_steps(fold_steps(steps), live=live))
+
+################################################################################
+class DexPlan():
+    """
+    The compiled form of a list of transpiled DEX expressions.
+
+    `prefetch` maps a step number to the wave of steps to start when it is
+    reached (itself included).
+
+    >>> plan = DexPlan(["assign(1, context, 'one')", "one == 1"], optimize=False)
+    >>> [step.nbr for step in plan.steps]
+    [1, 2]
+    >>> ns = dict(context=dict(), assign=lambda v, d, k: d.__setitem__(k, v) or v)
+    >>> plan.steps[0].run(ns)
+    1
+    >>> ns['context']
+    {'one': 1}
+    >>> DexPlan(["broken("]).steps[0].run({})
+    Traceback (most recent call last):
+    ...
+    SyntaxError: ...
+    >>> plan = DexPlan(["#!DEX async=true", "assign(1, context, 'one')"])
+    >>> plan.pragmas, [step.nbr for step in plan.steps]
+    ({'async': True}, [2])
+
+    Fetches which don't depend on the steps between them start together,
+    up to a step which could have side effects:
+
+    >>> plan = DexPlan(["assign(pull('a'), context, 'person')",
+    ...                 "is_(person, 'human')",
+    ...                 "assign(pull('b'), context, 'employer')",
+    ...                 "assign(pull(person), context, 'spouse')",
+    ...                 "assign(pull('c'), context, 'other')",
+    ...                 "push(employer, 'd')",
+    ...                 "assign(pull('e'), context, 'last')"])
+    >>> {nbr: [step.nbr for step in wave] for nbr, wave in plan.prefetch.items()}
+    {1: [1, 3, 5]}
+
+    Split for a batch:
+
+    >>> shared, record = DexPlan(["assign(pull('model'), context, 'model')",
+    ...                           "assign(interface.input.x, context, 'x')",
+    ...                           "assign(60 * 60, context, 'ttl')",
+    ...                           "assign(model.predict(x), context, 'score')",
+    ...                           "assign(pull('scale'), context, 'scale')"]).batch()
+    >>> [step.nbr for step in shared.steps], [step.nbr for step in record.steps]
+    ([1, 3, 5], [2, 4])
+    """
+    digest = None
+    steps = None
+    prefetch = None
+    pragmas = None
+    _batch = None
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, exprs, digest=None, live=None, optimize=OPTIMIZE, steps=None):
+        exprs = list(exprs or [])
+        self.digest = digest or plan_digest(exprs, live=live)
+        self.pragmas = dict()
+        if steps is not None: # already compiled (part of another plan)
+            self.steps = steps
+        else:
+            self.steps = list()
+            for nbr, expr in enumerate(exprs, start=1):
+                if expr.startswith(PRAGMA):
+                    self.pragmas.update(parse_pragma(expr))
+                else:
+                    self.steps.append(DexStep(nbr, expr))
+            if optimize:
+                self.steps = optimize_steps(self.steps, live=live)
+        self.prefetch = self._schedule()
+
+    def batch(self):
+        """
+        Split into a plan of the steps shared by a batch of records, and a
+        plan of the steps run per record.  A step is shared if it has no
+        side effects and, in declared order, doesn't read what is per
+        record, nor write what an earlier per record step uses.
+        """
+        if self._batch is None:
+            shared, record = list(), list()
+            reads, writes = set(RECORD_KEYS), set(RECORD_KEYS)
+            whole = False # after a per record step using all of context
+            for step in self.steps:
+                if not whole and not step.barrier and not step.calls & SIDE_EFFECTS \
+                   and not step.reads & writes and not step.writes & (reads | writes):
+                    shared.append(step)
+                else:
+                    record.append(step)
+                    whole = whole or step.whole
+                    if not whole:
+                        reads |= step.reads
+                        writes |= step.writes
+            self._batch = (DexPlan(None, digest=self.digest + ".shared", steps=shared),
+                           DexPlan(None, digest=self.digest + ".record", steps=record))
+            for plan in self._batch:
+                plan.pragmas = self.pragmas
+        return self._batch
+
+    def _schedule(self):
+        """
+        Group concurrent steps into waves.  A wave starts at its first step,
+        and takes in each later concurrent step that neither reads nor writes
+        anything written by the steps since, nor writes what they read.
+        """
+        prefetch = dict()
+        taken = set()
+        for idx, step in enumerate(self.steps):
+            if step.nbr in taken or not step.concurrent:
+                continue
+            wave = [step]
+            reads, writes = set(step.reads), set(step.writes)
+            for later in self.steps[idx+1:]:
+                if later.nbr not in taken and later.concurrent \
+                   and not later.reads & writes \
+                   and not later.writes & (reads | writes):
+                    wave.append(later)
+                elif later.barrier or later.calls & SIDE_EFFECTS:
+                    break
+                reads |= later.reads
+                writes |= later.writes
+            if len(wave) > 1:
+                prefetch[step.nbr] = wave
+                taken.update(member.nbr for member in wave)
+        return prefetch
+
+def plan_digest(exprs, live=None):
+    """
+    hash of the DEX source a plan is compiled from (and what is live after it)
+
+    >>> plan_digest(["a", "b"]) == plan_digest(("a", "b"))
+    True
+    >>> plan_digest(["a", "b"]) == plan_digest(["ab"])
+    False
+    """
+    source = list(exprs or [])
+    if live is not None:
+        source = [source, sorted(live)]
+    return hashlib.sha1(json.dumps(source).encode()).hexdigest()
+
+def dex_plan(exprs, live=None):
+    """
+    Get the compiled plan for a list of transpiled DEX expressions, compiling
+    it only the first time it is seen.  `live` is what is read from the
+    context after the block, None for all of it.
+
+    >>> plan = dex_plan(["assign(1, context, 'one')"])
+    >>> plan is dex_plan(["assign(1, context, 'one')"])
+    True
+    >>> plan is dex_plan(["assign(2, context, 'two')"])
+    False
+
+    Plans are found by the text of the expressions, so a list changed after
+    it was planned gets the plan for what it now holds:
+
+    >>> exprs = ["assign(3, context, 'three')"]
+    >>> dex_plan(exprs) is PLANS_BY_SOURCE[(tuple(exprs), None)]
+    True
+    >>> exprs[0] = "assign(4, context, 'four')"
+    >>> dex_plan(exprs).steps[0].expr
+    "assign(4, context, 'four')"
+    """
+    key = (tuple(exprs or ()), None if live is None else tuple(live))
+    plan = PLANS_BY_SOURCE.get(key)
+    if plan is not None:
+        return plan
+    digest = plan_digest(exprs, live=live)
+    plan = PLANS.get(digest)
+    if plan is None:
+        if len(PLANS) >= PLANS_LIMIT:
+            PLANS.clear()
+        plan = PLANS[digest] = DexPlan(exprs, digest=digest, live=live)
+    if len(PLANS_BY_SOURCE) >= PLANS_LIMIT:
+        PLANS_BY_SOURCE.clear()
+    PLANS_BY_SOURCE[key] = plan
+    return plan
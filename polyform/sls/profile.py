@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+DEX Profiler - wall time and call counts per DEX expression and per builtin,
+with the tracemalloc peak per expression when asked for.
+
+Enable with DEX_PROFILE=1 (or =mem, for memory too), or in Polyform.yml on
+the form:
+
+    forms:
+      myform:
+        profile: true     # or: mem
+
+One record is logged per invocation, as `type="profile"`, with the
+`profile=` payload last so it can be picked back out of a log line (see
+`poly profile`).  Steps which run concurrently are timed in their own
+thread, and memory peaks are process wide, so read those as approximate.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import tracemalloc
+from .logger import log
+
+# the builtins timed when profiling
+PROFILED_BUILTINS = ('pull', 'push', 'pull_many', 'push_many', 'gather', 'convert', 'follow',
+                     'polyform', 'autoclean')
+
+def dex_profile(form=None):
+    """
+    The profile for an invocation of form, or None if profiling is off
+
+    >>> prof = dex_profile(dict(profile='mem'))
+    >>> prof.mem, tracemalloc.is_tracing()
+    (True, True)
+    >>> prof.emit(form='doctest') # doctest: +ELLIPSIS
+    20... type="profile" form="doctest" profile=...
+    >>> tracemalloc.is_tracing()
+    False
+    >>> dex_profile(dict()) is None or bool(os.environ.get('DEX_PROFILE'))
+    True
+    """
+    mode = os.environ.get('DEX_PROFILE') or (form or {}).get('profile')
+    if not mode or mode in ('0', 'false'):
+        return None
+    return DexProfile(mem=mode == 'mem')
+
+class DexProfile():
+    """
+    Counters for one invocation.
+
+    >>> prof = DexProfile()
+    >>> prof.phase = 'expect'
+    >>> wrapped = prof.wrap('pull', lambda x: x)
+    >>> class Step():
+    ...     nbr, expr = 1, "pull(1)"
+    ...     def run(self, namespace):
+    ...         return namespace['pull'](1)
+    >>> prof.run(Step(), dict(pull=wrapped))
+    1
+    >>> data = prof.export()
+    >>> data['steps'][0]['calls'], data['steps'][0]['phase'], data['builtins']['pull']['calls']
+    (1, 'expect', 1)
+    """
+    def __init__(self, mem=False):
+        self.mem = mem
+        self.phase = ''
+        self.start = time.perf_counter()
+        self.steps = dict()
+        self.builtins = dict()
+        self._lock = threading.Lock()
+        self._tracing = mem and not tracemalloc.is_tracing() # so emit() stops it
+        if self._tracing:
+            tracemalloc.start()
+
+    def _add(self, table, key, seconds, **extra):
+        with self._lock:
+            stats = table.get(key)
+            if stats is None:
+                stats = table[key] = dict(calls=0, seconds=0.0, **extra)
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            return stats
+
+    def wrap(self, name, func):
+        """time calls of a builtin"""
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._add(self.builtins, name, time.perf_counter() - start)
+        timed.__name__ = getattr(func, '__name__', name)
+        return timed
+
+    def _start(self):
+        if self.mem and hasattr(tracemalloc, 'reset_peak'): # python 3.9+
+            tracemalloc.reset_peak()
+        return time.perf_counter()
+
+    def _step(self, step, start):
+        stats = self._add(self.steps, (self.phase, step.nbr), time.perf_counter() - start,
+                          phase=self.phase, nbr=step.nbr, expr=step.expr)
+        if self.mem:
+            peak = tracemalloc.get_traced_memory()[1]
+            stats['peak'] = max(stats.get('peak', 0), peak)
+
+    def run(self, step, namespace):
+        """run a DEX step, timing it"""
+        start = self._start()
+        try:
+            return step.run(namespace)
+        finally:
+            self._step(step, start)
+
+    async def arun(self, step, namespace):
+        """run a DEX step as a coroutine (see DexStep.arun), timing it"""
+        start = self._start()
+        try:
+            return await step.arun(namespace)
+        finally:
+            self._step(step, start)
+
+    def export(self):
+        """the profile as a dictionary, ready for the log"""
+        return dict(
+            seconds=time.perf_counter() - self.start,
+            steps=list(self.steps.values()),
+            builtins=self.builtins
+        )
+
+    def emit(self, **kwargs):
+        """log the profile, one record, and stop tracing memory if it started it"""
+        try:
+            log(type="profile", **kwargs, profile=self.export())
+        finally:
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+
+################################################################################
+PROFILE_RX = re.compile(r'\btype="profile" (?:.* )?form="([^"]*)" .*\bprofile=(\{.*\})\s*$')
+
+def read_profiles(lines, form=None):
+    """
+    The profile records (of `form`) in lines of log output
+
+    >>> line = '2019-01-01T00:00:00 type="profile" form="f" profile={"seconds": 1.0} '
+    >>> list(read_profiles(['noise', line], form='f'))
+    [{'seconds': 1.0}]
+    >>> list(read_profiles([line], form='g'))
+    []
+    """
+    for line in lines:
+        match = PROFILE_RX.search(line)
+        if match and (form is None or match.group(1) == form):
+            try:
+                yield json.loads(match.group(2))
+            except ValueError:
+                continue
+
+def summarize(profiles):
+    """
+    Totals over many profile records: steps by total time, and builtins.
+
+    >>> summary = summarize([
+    ...     dict(seconds=0.2, builtins=dict(pull=dict(calls=2, seconds=0.1)),
+    ...          steps=[dict(phase='expect', nbr=1, expr='a', calls=1, seconds=0.1)]),
+    ...     dict(seconds=0.4, builtins=dict(pull=dict(calls=1, seconds=0.3)),
+    ...          steps=[dict(phase='expect', nbr=1, expr='a', calls=1, seconds=0.3)])])
+    >>> summary['count'], summary['steps'][0]['max'], summary['builtins']['pull']['calls']
+    (2, 0.3, 3)
+    """
+    steps = dict()
+    builtins = dict()
+    total = 0.0
+    count = 0
+    for prof in profiles:
+        count += 1
+        total += prof.get('seconds', 0)
+        for step in prof.get('steps', []):
+            key = (step['phase'], step['nbr'])
+            stats = steps.setdefault(key, dict(phase=step['phase'], nbr=step['nbr'],
+                                               expr=step['expr'], calls=0, seconds=0.0,
+                                               max=0.0, peak=0))
+            stats['calls'] += step['calls']
+            stats['seconds'] += step['seconds']
+            stats['max'] = max(stats['max'], step['seconds'])
+            stats['peak'] = max(stats['peak'], step.get('peak', 0))
+        for name, value in prof.get('builtins', {}).items():
+            stats = builtins.setdefault(name, dict(calls=0, seconds=0.0))
+            stats['calls'] += value['calls']
+            stats['seconds'] += value['seconds']
+    return dict(
+        count=count,
+        seconds=total,
+        steps=sorted(steps.values(), key=lambda stats: -stats['seconds']),
+        builtins=builtins
+    )
@@ -12,31 +12,58 @@ Primarily for proof-of-concept purposes.
 see polyform.dex for more info.
 
 This is the intersect/exection side of DEX
+
+When the function zip holds a plan module generated by `poly build` (see
+polyform.sls.codegen), plans it has a function for run that instead.
+
+A block with the pragma `#!DEX async=true` is run on an asyncio event loop,
+where pull(), push() and polyform() are awaited, so the I/O of many steps
+overlaps on one thread of DEX.  boto3 itself blocks, so those calls are run
+on the DEX thread pool underneath.
+
+For cold starts, nothing heavy is done at import: the S3 store and other
+AWS clients are created, and pandas, datacleaner and jwt imported, when
+first needed (see ./test-importtime.py).
 """
 
 import os
 #import re
 import sys
 import json
+import types
+import builtins
+import functools
+import contextlib
 #import base64
 #import zlib
-import pickle
-import tempfile
+import threading
 import traceback
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, wait
 #from xgboost import XGBClassifier
-import jwt
-import datacleaner
-import pandas
 import dictlib
 from .logger import log
 from dictlib import Dict
-from .dynamo_min import DynamoMin
-from .s3_min import S3Min
+from ..dex import DEX_VERSION
+from .plan import dex_plan, DexStep, ASYNC_CALLS
+from .lazy import LazyPull, force
+from .vector import dex_true, dex_is, dex_in_range, dex_all, dex_any
+from .profile import PROFILED_BUILTINS
+from . import graph, cache, codecs, stream, diskcache, objcache, batch, writebehind
 
 DEBUG = not not os.environ.get('DEBUG') # pylint: disable=unneeded-not
 LOGDATA = not not os.environ.get('LOGDATA') # pylint: disable=unneeded-not
 
+# how many DEX expressions may fetch at once; 1 runs everything in sequence
+CONCURRENCY = int(os.environ.get('DEX_CONCURRENCY', 8))
+POOL = None
+LOOP = None
+LAMBDA = None
+APIKEYS = None
+
+# functions generated from DEX by `poly build`, by plan digest (see codegen)
+COMPILED = None
+COMPILED_MODULE = '_polyform_plan'
+
 # setting message this way isn't translating into __repr__ properly, need
 # to spend a few mins and figure out how to propagate the message properly
 class DEXError(Exception):
@@ -59,11 +86,183 @@ class DEXError(Exception):
             self.message += ' error='
             self.message += json.dumps(error.__class__.__name__ + ": " + str(error))
 
-# TODO: remove hardwired name
-S3BUCKET = S3Min(schema=dict(Bucket='4E5DDD33F59A4D4086756BA77698213D'))
-def dex_eval_locals(defaults):
+# the BackingData store, see s3_bucket()
+S3BUCKET = None
+S3BUCKET_LOCK = threading.Lock()
+
+def s3_bucket():
+    """the BackingData store (S3BUCKET), created when first needed"""
+    global S3BUCKET # pylint: disable=global-statement
+    if S3BUCKET is None:
+        with S3BUCKET_LOCK:
+            if S3BUCKET is None:
+                from .s3_min import S3Min # pylint: disable=import-outside-toplevel
+                # TODO: remove hardwired name
+                S3BUCKET = S3Min(schema=dict(Bucket='4E5DDD33F59A4D4086756BA77698213D'))
+    return S3BUCKET
+
+def s3_cache():
+    """the disk cache in front of S3BUCKET, None if off (or it can't revalidate)"""
+    if not hasattr(s3_bucket(), 'fetch_sized'):
+        return None
+    return diskcache.disk_cache()
+
+def s3_open(duid):
+    """an object in S3, as a binary file like object (from the disk cache, if on)"""
+    disk = s3_cache()
+    if disk is not None:
+        return disk.open(s3_bucket(), duid)
+    return s3_bucket().get(key=duid)
+
+def s3_forget(duid):
+    """drop an object from the disk cache, after changing it"""
+    disk = s3_cache()
+    if disk is not None:
+        disk.forget(s3_bucket(), duid)
+
+def on_disk(body):
+    """is body a (seekable) file, such as from the disk cache, not a response"""
+    seekable = getattr(body, 'seekable', None)
+    return seekable is not None and seekable()
+
+def s3_fetch(duid):
+    """
+    an object from S3 in a (temporary, or cached) file, rewound for reading
+    """
+    body = s3_open(duid)
+    if on_disk(body):
+        return body
+    def write(wfd):
+        with s3_stream(duid, body) as rfd:
+            stream.copy_stream(rfd, wfd)
+    return stream.spool(write)
+
+@contextlib.contextmanager
+def s3_stream(duid, body=None):
+    """
+    an object in S3 (or body, as opened) as a buffered binary stream, for
+    decoding as it arrives (with its rate logged when done, if it wasn't
+    on disk)
+    """
+    if body is None:
+        body = s3_open(duid)
+    rfd = stream.open_stream(body)
+    try:
+        yield rfd
+    finally:
+        if not on_disk(body):
+            stream.log_rate("pull", duid, rfd.raw)
+        rfd.close()
+
+def s3_revalidate(duid, etag=None):
+    """
+    (binary file, etag) of an object in S3, or (None, etag) if it still has
+    etag (through the disk cache, if on)
+    """
+    disk = s3_cache()
+    if disk is not None:
+        body, etag = disk.fetch(s3_bucket(), duid, etag=etag)
+    else:
+        body, etag = s3_bucket().fetch(duid, etag=etag)
+    if body is not None and not on_disk(body):
+        body = stream.open_stream(body)
+    return body, etag
+
+def s3_objects(typedef, use_cache):
+    """the object cache, if a pull of typedef should use it"""
+    if not hasattr(s3_bucket(), 'fetch') or typedef is None:
+        return None
+    if use_cache is None:
+        use_cache = objcache.DEFAULT
+    if not use_cache:
+        return None
+    return objcache.object_cache()
+
+def s3_put(duid, body=None, file=None, writes=None):
+    """
+    put an object in S3 (closing file), or queue it with writes (a
+    writebehind.WriteQueue)
+    """
+    def put():
+        s3_forget(duid)
+        objects = objcache.object_cache()
+        if objects is not None:
+            objects.forget(duid)
+        try:
+            if file:
+                return s3_bucket().put(key=duid, file=file)
+            return s3_bucket().put(key=duid, body=body)
+        finally:
+            if file:
+                file.close()
+    if writes is None:
+        return put()
+    return writes.put(duid, put, discard=file.close if file else None)
+
+def dex_graph_fetch(key):
+    """a serialized graph index, from the BackingData store"""
+    return s3_open(key).read()
+
+def pull_decoder(typedef):
+    """how pull() loads data of typedef (see polyform.sls.codecs), raw without one"""
+    if typedef is None:
+        return lambda rfd: rfd.read()
+    return codecs.decoder(typedef)
+
+def pull_options(options):
+    """the cache= option given to a DEX pull(), which takes no others"""
+    use_cache = options.pop('cache', None)
+    if options:
+        raise TypeError("pull() got an unexpected keyword argument '{}'"
+                        .format(next(iter(options))))
+    return use_cache
+
+def pull_object(duid, typedef=None, lazy=False, writes=None, use_cache=None):
+    """
+    what pull() does: load an object from S3 (after its queued pushes on
+    writes, if given), through the object cache if use_cache (or by default)
+    """
+    ## TEMPORARY
+    if LOGDATA:
+        log(type="data", pull="{}".format(duid))
+    if writes is not None:
+        writes.settle(duid)
+    load = pull_decoder(typedef)
+    objects = s3_objects(typedef, use_cache)
+    if objects is not None:
+        # decoded once, then reused while its ETag is unchanged
+        def pull():
+            return objects.pull((duid, typedef), lambda etag: s3_revalidate(duid, etag), load)
+        if lazy:
+            return LazyPull(pull, None, pool=dex_pool())
+        return pull()
+    if lazy:
+        # fetched in the background, loaded when first used
+        return LazyPull(lambda: s3_fetch(duid), load, pool=dex_pool())
+    if typedef is None:
+        return load(s3_open(duid))
+    if codecs.streams(typedef):
+        with s3_stream(duid) as rfd:
+            return load(rfd)
+    with s3_fetch(duid) as rfd:
+        return load(rfd)
+
+def push_object(data, duid, typedef=None, writes=None):
+    """what push() does: store data in S3, or queue it on writes if given"""
+    data = force(data)
+    if isinstance(data, Dict):
+        data = data.__export__()
+    if LOGDATA:
+        log(type="data", push="{}".format(duid))
+    if typedef is None:
+        return s3_put(duid, body=data, writes=writes)
+    dump = codecs.encoder(typedef)
+    return s3_put(duid, file=stream.spool(lambda wfd: dump(data, wfd)), writes=writes)
+
+def dex_eval_locals(defaults, profile=None, writes=None):
     """
-    create our eval locals
+    create our eval locals, with the builtins timed if profiling, and pushes
+    queued on writes (a writebehind.WriteQueue) if given
     """
     mylocals = dict() # locals() # pylint: disable=redefined-builtin
     def dex_assign(value, data, key):
@@ -72,41 +271,33 @@ def dex_eval_locals(defaults):
         else:
             data[key] = value
         return value
-    def dex_pull(duid, typedef=None):
-        ## TEMPORARY
-        if LOGDATA:
-            log(type="data", pull="{}".format(duid))
-        if typedef == 'pickle>>*':
-            with tempfile.TemporaryFile() as wfd:
-                rfd = S3BUCKET.get(key=duid)
-                while wfd.write(rfd.read(amt=4096)):
-                    pass
-                wfd.seek(0)
-                return pickle.load(wfd)
-        if typedef == 'json':
-            return json.load(S3BUCKET.get(key=duid))
-        if typedef == 'csv>>dataframe':
-            return pandas.read_csv(S3BUCKET.get(key=duid))
-        if typedef is None:
-            return S3BUCKET.get(key=duid).read()
-        raise Exception("pull(): Unrecognized typedef: " + typedef)
+    def dex_pull(duid, typedef=None, lazy=False, **options):
+        # cache= is the name pull() takes in DEX
+        return pull_object(duid, typedef, lazy=lazy, writes=writes,
+                           use_cache=pull_options(options))
     def dex_push(data, duid, typedef=None):
-        if isinstance(data, Dict):
-            data = data.__export__()
-        if LOGDATA:
-            log(type="data", push="{}".format(duid))
-        if typedef == '*>>pickle':
-            with tempfile.TemporaryFile() as xfd:
-                pickle.dump(data, xfd)
-                xfd.seek(0)
-                return S3BUCKET.put(key=duid, file=xfd)
-        if typedef is None:
-            return S3BUCKET.put(key=duid, body=data)
-        raise Exception("push(): Unrecognized typedef: " + typedef)
+        return push_object(data, duid, typedef, writes=writes)
+    def dex_pull_many(duids, typedef=None, partial=False, **kwargs):
+        return batch.many('pull_many', lambda duid: dex_pull(duid, typedef, **kwargs),
+                          force(duids), partial=partial)
+    def dex_push_many(items, typedef=None, partial=False):
+        items = force(items)
+        if isinstance(items, dict):
+            items = items.items()
+        items = list(items)
+        return batch.many('push_many', lambda item: dex_push(item[1], item[0], typedef),
+                          items, keys=[item[0] for item in items], partial=partial)
+    def dex_gather(nodes, typedef=None, partial=False, **kwargs):
+        nodes = list(force(nodes))
+        def get(node):
+            duid = batch.node_id(node)
+            if duid is None:
+                return node
+            return dex_pull(duid, typedef, **kwargs)
+        return batch.many('gather', get, nodes, keys=[batch.node_id(node) for node in nodes],
+                          partial=partial)
     def dex_follow(node, key):
-        raise Exception("Not yet implemented")
-    def dex_in_range(data, start, end):
-        return start <= data <= end
+        return graph.follow(force(node), key, dex_graph_fetch)
     # def dex_serialize(data):
     #     typedef = type(data)
     #     print("SERIALIZE({})".format(typedef))
@@ -136,23 +327,7 @@ def dex_eval_locals(defaults):
     #         # return model
     #     raise Exception("serialize(): Unrecognized typedef: " + typedef)
     def dex_convert(data, typedef, *args, **kwargs):
-        if typedef == "*>>json":
-            return json.dumps(data)
-        if typedef == "json>>*":
-            return json.loads(data)
-        if typedef == "csv>>dataframe":
-            return pandas.read_csv(StringIO(data))
-        if typedef == "dataframe>>csv":
-            return pandas.DataFrame.to_csv(data)
-        if typedef == "dataframe>>dict":
-            return pandas.DataFrame.to_dict(data)
-        if typedef == "dataframe>>json":
-            return data.to_json()
-        if typedef == "dict-row>>dataframe":
-#            out = {key: {"0": value} for key, value in data.items()}
-#            return pandas.read_json(json.dumps(out))
-            out = {key: [value] for key, value in data.items()}
-            return pandas.DataFrame.from_dict(out, orient='columns') # , orient='index')
+        # formats and conversions are registered in polyform.sls.codecs
         # if typedef == "stored>>csv>>dataframe":
         #     return pandas.read_csv(StringIO(zlib.decompress(base64.b64decode(data)).decode()))
         # if typedef == "*>>base64":
@@ -163,30 +338,131 @@ def dex_eval_locals(defaults):
         #     return base64.b64encode(zlib.compress(data).encode()).decode()
         # if typedef == "txt>>b64gz":
         #     return zlib.decompress(base64.b64decode(data)).decode()
-        raise Exception("convert(): Unrecognized typedef: " + typedef)
+        return codecs.convert(force(data), typedef)
+    def dex_autoclean(*args, **kwargs):
+        import datacleaner # pylint: disable=import-outside-toplevel
+        return datacleaner.autoclean(*args, **kwargs)
     def dex_inspect(data, **kwargs):
-        log(inspect="{}".format(data), **kwargs)
+        log(inspect="{}".format(force(data)), **kwargs)
         return data
 
     if defaults:
         mylocals.update(defaults)
+    # steps not run by eval() (async, generated) don't get these added for them
+    mylocals['__builtins__'] = builtins
     mylocals.update(dict(
         assign=dex_assign,
         pull=dex_pull,
         push=dex_push,
+        pull_many=dex_pull_many,
+        push_many=dex_push_many,
+        gather=dex_gather,
+        force=force,
         follow=dex_follow,
         in_range=dex_in_range,
+        is_=dex_is,
+        are=dex_is,
+        all=dex_all,
+        any=dex_any,
         #serialize=dex_serialize,
         #deserialize=dex_deserialize,
         inspect=dex_inspect,
-        autoclean=datacleaner.autoclean,
+        polyform=dex_polyform,
+        autoclean=dex_autoclean,
         convert=dex_convert
     ))
+    if profile:
+        for name in PROFILED_BUILTINS:
+            if name in mylocals:
+                mylocals[name] = profile.wrap(name, mylocals[name])
+    for name in ASYNC_CALLS:
+        if name in mylocals:
+            mylocals['_async_' + name] = dex_awaitable(mylocals[name])
     return mylocals
 
-def dex_intersect(polyform, dex_exprs, mylocals=None):
+def dex_polyform(data, ref, *args, **options):
+    """
+    DEX polyform(): call another polyform with data, giving its output (or
+    a key of it), through the result cache if `cache=` is given
+    """
+    if args and cache.is_options(args[-1]):
+        options = dict(cache.parse_options(args[-1]), **options)
+        args = args[:-1]
+    name, _, form = ref.partition(':')
+    form, _, key = form.partition('.')
+    if not name or not form:
+        raise ValueError("polyform(): expected 'name:form', not " + ref)
+    data = force(data)
+    if isinstance(data, Dict):
+        data = data.__export__()
+    args = [force(arg) for arg in args] # pulls, in the key and the call
+    def call():
+        result = dex_lambda().invoke("polyform-{}-{}".format(name, form),
+                                     dict(body=data, args=args))
+        return graph.dig(result, key) if key else result
+    if not options.get('cache'):
+        return call()
+    return cache.cached(cache.cache_key(ref, data, args), cache.parse_ttl(options['cache']),
+                        call, bucket=s3_bucket() if options.get('shared') else None)
+
+def dex_awaitable(func):
+    """
+    an async version of a blocking builtin, run on the DEX thread pool
+
+    >>> dex_loop().run_until_complete(dex_awaitable(pow)(2, 3))
+    8
+    """
+    async def call(*args, **kwargs):
+        pool = dex_pool()
+        if pool is None: # no concurrency, just block
+            return func(*args, **kwargs)
+        import asyncio # pylint: disable=import-outside-toplevel
+        return await asyncio.get_event_loop().run_in_executor(
+            pool, functools.partial(func, *args, **kwargs))
+    call.__name__ = getattr(func, '__name__', 'call')
+    return call
+
+def dex_pool():
+    """the thread pool for concurrent DEX steps, created when first needed"""
+    global POOL # pylint: disable=global-statement
+    if POOL is None and CONCURRENCY > 1:
+        POOL = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix='dex')
+    return POOL
+
+def dex_lambda():
+    """the Lambda client polyform() invokes with, created when first needed"""
+    global LAMBDA # pylint: disable=global-statement
+    if LAMBDA is None:
+        from .lambda_min import LambdaMin # pylint: disable=import-outside-toplevel
+        LAMBDA = LambdaMin()
+    return LAMBDA
+
+def dex_apikeys():
+    """the AuthApikeys table verify_access_token() reads, created when first needed"""
+    global APIKEYS # pylint: disable=global-statement
+    if APIKEYS is None:
+        from .dynamo_min import DynamoMin # pylint: disable=import-outside-toplevel
+        APIKEYS = DynamoMin(schema={"TableName": "AuthApikeys"})
+    return APIKEYS
+
+def dex_loop():
+    """the event loop for async DEX blocks, created when first needed"""
+    global LOOP # pylint: disable=global-statement
+    if LOOP is None or LOOP.is_closed():
+        import asyncio # pylint: disable=import-outside-toplevel
+        LOOP = asyncio.new_event_loop()
+    return LOOP
+
+# pylint: disable=too-many-arguments
+def dex_intersect(polyform, dex_exprs, mylocals=None, live=None, profile=None, writes=None):
     """
-    evaluate an intersection's data expectations
+    evaluate an intersection's data expectations.  `live` is what the caller
+    reads from the returned context, None for all of it (see dex_plan).
+    `profile` is a DexProfile, when profiling.  Pushes are queued on
+    `writes` (a writebehind.WriteQueue) if the block is write behind.
+
+    Steps in a wave of the plan (see polyform.sls.plan) are started together
+    when the first is reached, and their results are checked in order.
     """
     if not mylocals:
         raise AttributeError("Missing mylocals={}")
@@ -195,38 +471,228 @@ def dex_intersect(polyform, dex_exprs, mylocals=None):
     #     Output=Dict(),
     #     Result=Dict()
     # ))
-    mylocals['context'].update(
+    mylocals['context'].update(dex_context_defaults(polyform))
+    plan = dex_plan(dex_exprs, live=live)
+    if writes is not None and not writebehind.write_behind(plan):
+        writes = None
+    mylocals = dex_eval_locals(mylocals, profile=profile, writes=writes)
+    compiled = None if profile else dex_compiled().get(plan.digest)
+    if compiled:
+        return dex_run_compiled(compiled, mylocals)
+    return dex_run(plan, mylocals, profile=profile)
+
+def dex_intersect_batch(polyform, dex_exprs, contexts, mylocals=None, live=None, profile=None,
+                        writes=None):
+    """
+    evaluate an intersection's data expectations for a batch of records,
+    each with its own context.  The steps shared by all records (see
+    DexPlan.batch) are evaluated once, and the rest for each record.
+    Pushes are queued on `writes`, as with dex_intersect, owned by the index
+    of the record which made them (None for the shared steps).
+
+    Returns a list in the order of `contexts`, of each record's context, or
+    the DEXError it failed with.
+    """
+    plan = dex_plan(dex_exprs, live=live)
+    if writes is not None and not writebehind.write_behind(plan):
+        writes = None
+    shared, record = plan.batch()
+    base = dict(mylocals or {})
+    base['context'] = dex_context_defaults(polyform)
+    base = dex_eval_locals(base, profile=profile, writes=writes)
+    try:
+        common = dex_run(shared, base, profile=profile)
+    except DEXError as err:
+        return [err] * len(contexts)
+
+    out = list()
+    for context in contexts:
+        # the record's own values win over the shared ones
+        context.update(dict(common, **context))
+        if writes is not None:
+            writes.owner = len(out)
+        try:
+            out.append(dex_run(record, dict(base, context=context), profile=profile))
+        except DEXError as err:
+            out.append(err)
+    if writes is not None:
+        writes.owner = None
+    return out
+
+def dex_context_defaults(polyform):
+    """what every DEX context starts out with"""
+    return dict(
         creator=None,
         invoker=None,
         requestor=None,
         appexdev=None,
         polydev=Dict(id=polyform.meta.owner)
     )
-    mylocals = dex_eval_locals(mylocals)
+
+# pylint: disable=too-many-branches
+def dex_run(plan, mylocals, profile=None):
+    """
+    run the steps of a DEX plan, in the namespace `mylocals` (as made by
+    dex_eval_locals), returning its context.  Plans with `#!DEX async=true`
+    are run by dex_run_async, on the DEX event loop.
+
+    A check in a finish block fails it, even when what it assigns is unread:
+
+    >>> from polyform.sls.plan import FINISH_LIVE
+    >>> plan = dex_plan(["assign(result['age'] > 18, context, 'adult')",
+    ...                  "assign(result, context, ['interface', 'output'])"], live=FINISH_LIVE)
+    >>> dex_run(plan, dex_eval_locals(dict(context=dict(), result=dict(age=12))))
+    Traceback (most recent call last):
+    ...
+    polyform.sls.reflex_arc.DEXError
+    >>> dex_run(plan, dex_eval_locals(dict(context=dict(), result=dict(age=30))))['interface']
+    {'output': {'age': 30}}
+    """
+    if plan.pragmas.get('async'):
+        return dex_loop().run_until_complete(dex_run_async(plan, mylocals, profile=profile))
+    context = mylocals['context']
+    run = profile.run if profile else DexStep.run
+    pool = dex_pool() if plan.prefetch else None
+    pending = dict()
+    def start(later):
+        return pool.submit(run, later, mylocals)
+
+    try:
+        row = 0
+        expr = ''
+        for step in plan.steps:
+            row = step.nbr
+            expr = step.expr
+            if DEBUG:
+                print(">>> {}".format(mylocals['context']))
+                print(">>> {}".format(expr))
+            if step.nbr in pending:
+                result = pending.pop(step.nbr).result()
+            else:
+                # lift what the step reads from context up into primary locals
+                step.lift(mylocals, context)
+                if pool:
+                    pending.update(dex_prefetch(plan, step, mylocals, start))
+                result = run(step, mylocals)
+            dex_check(result, row, expr)
+    except DEXError:
+        raise
+    except Exception as err: # pylint: disable=broad-except
+        if DEBUG:
+            traceback.print_exc()
+        raise DEXError(nbr=row, expr=expr, status="error", error=err)
+    finally:
+        # on failure, don't leave anything still writing into the context
+        if pending:
+            for future in pending.values():
+                future.cancel()
+            wait(pending.values())
+    return mylocals['context']
+
+def dex_prefetch(plan, step, mylocals, start):
+    """
+    start the rest of the wave of plan which begins at step (if one does),
+    lifting what each step reads first: {step number: start(step)}
+    """
+    started = dict()
+    for later in plan.prefetch.get(step.nbr, ())[1:]:
+        later.lift(mylocals, mylocals['context'])
+        started[later.nbr] = start(later)
+    return started
+
+async def dex_run_async(plan, mylocals, profile=None):
+    """
+    dex_run, as a coroutine: steps calling I/O builtins await them, and the
+    steps of a wave run as tasks together, with results checked in order.
+    """
+    import asyncio # pylint: disable=import-outside-toplevel
+    context = mylocals['context']
+    run = profile.run if profile else DexStep.run
+    arun = profile.arun if profile else DexStep.arun
+    pending = dict()
+    def start(later):
+        return asyncio.ensure_future(arun(later, mylocals))
 
     try:
         row = 0
-        for expr in dex_exprs:
+        expr = ''
+        for step in plan.steps:
+            row = step.nbr
+            expr = step.expr
             if DEBUG:
                 print(">>> {}".format(mylocals['context']))
                 print(">>> {}".format(expr))
-            row += 1
-            # lift context up into primary locals
-            mylocals.update(mylocals['context'])
-            result = eval(expr, mylocals) # pylint: disable=eval-used
-
-            # why does pandas.DataFrame think it's special, gah
-            if not isinstance(result, pandas.DataFrame) and not result:
-                raise DEXError(nbr=row, expr=expr, status="not-true",
-                               msg="Expression did not result in a true value")
+            if step.nbr in pending:
+                result = await pending.pop(step.nbr)
+            else:
+                step.lift(mylocals, context)
+                pending.update(dex_prefetch(plan, step, mylocals, start))
+                if step.awaits:
+                    result = await arun(step, mylocals)
+                else:
+                    result = run(step, mylocals)
+            dex_check(result, row, expr)
     except DEXError:
         raise
     except Exception as err: # pylint: disable=broad-except
         if DEBUG:
             traceback.print_exc()
         raise DEXError(nbr=row, expr=expr, status="error", error=err)
+    finally:
+        if pending:
+            for task in pending.values():
+                task.cancel()
+            await asyncio.gather(*pending.values(), return_exceptions=True)
     return mylocals['context']
 
+def dex_compiled():
+    """
+    The generated plan functions, by digest; imported the first time, and
+    empty if there are none (or they are from another version of DEX)
+    """
+    global COMPILED # pylint: disable=global-statement
+    if COMPILED is None:
+        COMPILED = dict()
+        if os.environ.get('DEX_COMPILED', '1') not in ('0', 'false'):
+            try:
+                module = __import__(COMPILED_MODULE)
+                if getattr(module, 'DEX_VERSION', None) == DEX_VERSION:
+                    COMPILED = module.PLANS
+            except ImportError:
+                pass
+    return COMPILED
+
+def dex_run_compiled(compiled, mylocals):
+    """
+    run a generated plan function (with its exprs, by step) in the namespace
+    `mylocals`, returning its context.  Errors are as dex_run's.
+    """
+    func, exprs = compiled
+    def lift(context, names):
+        if names is None:
+            mylocals.update(context)
+            return
+        for name in names:
+            if name in context:
+                mylocals[name] = context[name]
+    def check(result, nbr):
+        dex_check(result, nbr, exprs[nbr])
+    def error(nbr, err):
+        if DEBUG:
+            traceback.print_exc()
+        return DEXError(nbr=nbr, expr=exprs.get(nbr, ''), status="error", error=err)
+    mylocals.update(_lift=lift, _check=check, _error=error, _DEXError=DEXError)
+    # rebound to the namespace, so its steps see the builtins and context
+    run = types.FunctionType(func.__code__, mylocals, func.__name__)
+    return run(mylocals['context']) # pylint: disable=not-callable
+
+def dex_check(result, nbr, expr):
+    """raise a DEXError unless the result of a step is true"""
+    # a lazy pull isn't loaded just to check it
+    if not isinstance(result, LazyPull) and not dex_true(result):
+        raise DEXError(nbr=nbr, expr=expr, status="not-true",
+                       msg="Expression did not result in a true value")
+
 # Auth table:
 #   tokenKey
 #   tokenSecret
@@ -258,13 +724,14 @@ class AuthFailed(Exception):
 
 def verify_access_token(token):
     """verify if an access token meets our criteria"""
+    import jwt # pylint: disable=import-outside-toplevel
     try:
         claims = jwt.decode(token, verify=False)
         # sub: cas1:ID
         uid = matching_begin("cas1:", claims['sub'])
         if not uid:
             raise AuthFailed("Auth Error: UID doesn't exist?")
-        ident = DynamoMin(schema={"TableName": "AuthApikeys"}).get(id=uid)
+        ident = dex_apikeys().get(id=uid)
         if not ident:
             raise AuthFailed("Auth Error: cannot get identity table")
         # TODO: add verification for 'aud'
@@ -5,32 +5,314 @@ Copyright 2019 Brandon Gillespie; All rights reserved.
 
 Lambda S3 Min - running dynamo db for backend things -- minimal
 'in serverless' version.
+
+Large items move over several connections: files are put as a multipart
+upload, and items are got with ranged GETs, both in parts of
+DEX_S3_PART_MB (default 8) with DEX_S3_CONCURRENCY (default 8) running at
+once.  Ranged gets are read in order as they arrive, with no more than
+that many parts got ahead of the reader, rather than spooled to disk.
+Set AWS_ENDPOINT_URL_S3 to use an S3 compatible stand-in (test-s3min.py
+runs against moto's).
+
+Items are put compressed with the store's `compress` (see
+polyform.sls.compress), and decompressed as they are read.
+
+With the store's `dedupe` (or DEX_DEDUPE=true), an item's content is put
+once, as a blob named by its sha256 (BLOB_PREFIX + hash), and the item is a
+manifest naming the blob: pushing content already stored costs a HEAD and
+a small write.  Manifests are followed on get, whatever the store's
+setting, and their ETag changes with the content they name.
 """
 
-#import os
-#import boto3
-from .boto3_min import Boto3Min
+import io
+import os
+import hashlib
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import botocore.exceptions
+from .boto3_min import Boto3Min, aws_client
+from . import compress
+from .stream import CHUNK, copy_stream, spool
 #from ..provider.aws import fix_lambci_env
 
+MIN_PART_SIZE = 5 * 1024 * 1024 # S3's smallest (but last) part
+PART_SIZE = int(os.environ.get('DEX_S3_PART_MB', 8)) * 1024 * 1024
+CONCURRENCY = int(os.environ.get('DEX_S3_CONCURRENCY', 8))
+COMPRESS = os.environ.get('DEX_COMPRESS') or None
+DEDUPE = os.environ.get('DEX_DEDUPE', 'false').lower() == 'true'
+BLOB_PREFIX = '_blob/'
+
+def content_length(res):
+    """
+    the full length of an item, from a (ranged) get response
+
+    >>> content_length(dict(ContentRange='bytes 0-99/1000', ContentLength=100))
+    1000
+    >>> content_length(dict(ContentLength=100))
+    100
+    """
+    if res.get('ContentRange'):
+        return int(res['ContentRange'].rpartition('/')[2])
+    return res['ContentLength']
+
+def content_hash(rfd):
+    """
+    the sha256 (hex) of the rest of rfd, which is left where it was
+
+    >>> content_hash(io.BytesIO(b'abc'))[:16]
+    'ba7816bf8f01cfea'
+    """
+    start = rfd.tell()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: rfd.read(CHUNK), b''):
+        digest.update(chunk)
+    rfd.seek(start)
+    return digest.hexdigest()
+
+def error_code(err):
+    """the code of a botocore ClientError"""
+    return err.response.get('Error', {}).get('Code')
+
+class PartsBody():
+    """
+    A large item's body, read in order as its parts arrive: the first part
+    from its response, then the rest, from get_part(offset), with up to
+    `ahead` of them being got at once
+    """
+    def __init__(self, first, offsets, get_part, ahead):
+        self._body = first['Body']
+        self._offsets = iter(offsets)
+        self._get_part = get_part
+        self._ahead = ahead
+        self._pending = collections.deque()
+        self._pool = ThreadPoolExecutor(max_workers=ahead)
+        self._queue()
+
+    def _queue(self):
+        for offset in self._offsets:
+            self._pending.append(self._pool.submit(self._get_part, offset))
+            if len(self._pending) >= self._ahead:
+                return
+        self._pool.shutdown(wait=False)
+
+    def read(self, amt=-1):
+        """up to amt bytes (all of the rest if amt is negative), b'' at the end"""
+        if amt is None or amt < 0:
+            return b''.join(iter(lambda: self.read(CHUNK), b''))
+        data = self._body.read(amt)
+        while not data and self._pending:
+            self._body.close()
+            self._body = io.BytesIO(self._pending.popleft().result())
+            self._queue()
+            data = self._body.read(amt)
+        return data
+
+    def close(self):
+        """stop getting parts"""
+        self._body.close()
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._pool.shutdown(wait=False)
+
 # pylint: disable=too-few-public-methods
 class S3Min(Boto3Min):
     """S3 Wrapper for within a container"""
     bucket = ''
 
-    def __init__(self, **config):
+    def __init__(self, part_size=PART_SIZE, concurrency=CONCURRENCY, **config):
         super().__init__(resource='s3', **config)
         self.bucket = config['schema']['Bucket'].lower()
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.concurrency = max(concurrency, 1)
+        options = config.get('config') or dict()
+        self.compress = options.get('compress', COMPRESS)
+        self.dedupe = bool(options.get('dedupe', DEDUPE))
+        if self.compress:
+            compress.get_encoding(self.compress)
+
+    @property
+    def s3client(self):
+        """the shared low level client (these are thread safe, unlike resources)"""
+        return aws_client('s3', region=self.region, profile=self.profile)
 
     def get(self, key=''):
         """
         get item from a table using given key
         """
-        return self.client.Object(self.bucket, key).get()['Body']
+        return self.fetch(key=key)[0]
+
+    def _get(self, key, **args):
+        """get_object, with S3's errors as FileNotFoundError, or None if not modified"""
+        try:
+            return self.s3client.get_object(Bucket=self.bucket, Key=key, **args)
+        except botocore.exceptions.ClientError as err:
+            code = error_code(err)
+            if code in ('304', 'NotModified'):
+                return None
+            if code in ('404', 'NoSuchKey'):
+                raise FileNotFoundError("No such object: {}".format(key))
+            raise
+
+    def _first(self, key, etag=None):
+        """the first part of an item (None if it still has etag)"""
+        args = dict(IfNoneMatch=etag) if etag else dict()
+        try:
+            return self._get(key, Range='bytes=0-{}'.format(self.part_size - 1), **args)
+        except botocore.exceptions.ClientError as err:
+            if error_code(err) != 'InvalidRange':
+                raise
+        return self._get(key, **args) # empty
+
+    def _part(self, key, first, offset):
+        """the body of the part of an item at offset (after its first part)"""
+        rng = 'bytes={}-{}'.format(offset, min(offset + self.part_size, content_length(first)) - 1)
+        # IfMatch: fail, rather than mix parts of a changed item
+        return self._get(key, Range=rng, IfMatch=first['ETag'])['Body']
+
+    def _rest(self, key, first, wfd):
+        """get the parts after first concurrently, and write it all into wfd"""
+        total = content_length(first)
+        lock = threading.Lock()
+        def write(offset, body):
+            data = body.read()
+            with lock:
+                wfd.seek(offset)
+                wfd.write(data)
+        def part(offset):
+            write(offset, self._part(key, first, offset))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(part, offset)
+                       for offset in range(self.part_size, total, self.part_size)]
+            write(0, first['Body'])
+            for future in futures:
+                future.result()
+        return total
+
+    def fetch(self, key='', etag=None):
+        """
+        get an item unless it still has etag: (body, etag), with a body of
+        None if it is unchanged.  FileNotFoundError if there is no such item.
+        Items over one part are got with concurrent ranged gets, read in
+        order (see PartsBody).  Compressed items are decompressed as the
+        body is read.
+        """
+        return self.fetch_sized(key, etag=etag)[:2]
+
+    def fetch_sized(self, key='', etag=None):
+        """
+        as fetch(), with the item's size as stored (compressed, if it is):
+        (body, etag, size), or (None, etag, None) if it is unchanged
+        """
+        first = self._first(key, etag=etag)
+        if first is None:
+            return None, etag, None
+        etag = first.get('ETag')
+        first, key = self._follow(first, key)
+        body = first['Body']
+        total = content_length(first)
+        if total > self.part_size:
+            body = PartsBody(first, range(self.part_size, total, self.part_size),
+                             lambda offset: self._part(key, first, offset).read(),
+                             self.concurrency)
+        if first.get('ContentEncoding') in compress.ENCODINGS:
+            body = compress.decompressed(body, first['ContentEncoding'])
+        return body, etag, total
+
+    def _follow(self, first, key):
+        """(first part, key) of the blob an item names, if it is a manifest"""
+        blob = (first.get('Metadata') or dict()).get('blob')
+        if not blob:
+            return first, key
+        first['Body'].close()
+        key = BLOB_PREFIX + blob
+        return self._first(key), key
+
+    def download(self, key, wfd):
+        """
+        get an item as stored (not decompressed) into wfd (a seekable binary
+        file or buffer), with ranged gets running concurrently; gives its size
+        """
+        first, key = self._follow(self._first(key), key)
+        return self._rest(key, first, wfd)
+
+    def exists(self, key):
+        """is there an item at key"""
+        try:
+            self.s3client.head_object(Bucket=self.bucket, Key=key)
+        except botocore.exceptions.ClientError as err:
+            if error_code(err) in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
 
     def put(self, key='', body='', file=None):
         """
-        put up an item
+        put up an item; compressed and deduplicated as the store is set up
+        for, and a multipart upload if it is over one part
+        """
+        if not file:
+            if not self.compress and not self.dedupe:
+                return self.client.Object(self.bucket, key).put(Body=body)
+            file = io.BytesIO(body.encode() if isinstance(body, str) else body)
+        if self.dedupe:
+            return self._put_blob(key, file)
+        return self._store(key, file)
+
+    def _store(self, key, file, **extra):
+        if self.compress:
+            with compress.compressed(file, self.compress) as zfd:
+                return self._put(key, zfd, ContentEncoding=self.compress, **extra)
+        return self._put(key, file, **extra)
+
+    def _put_blob(self, key, file):
+        """put up the content of file once (by its hash), and key as a manifest naming it"""
+        if not file.seekable():
+            with spool(lambda wfd: copy_stream(file, wfd)) as rfd:
+                return self._put_blob(key, rfd)
+        digest = content_hash(file)
+        if not self.exists(BLOB_PREFIX + digest):
+            self._store(BLOB_PREFIX + digest, file)
+        return self.client.Object(self.bucket, key).put(Body=digest, Metadata=dict(blob=digest))
+
+    def _put(self, key, file, **extra):
+        data = file.read(self.part_size)
+        if len(data) < self.part_size:
+            return self.client.Object(self.bucket, key).put(Body=data, **extra)
+        return self.put_multipart(key, file, data, **extra)
+
+    def put_multipart(self, key, file, data=b'', **extra):
+        """
+        put up a (binary) file as a multipart upload, with parts uploading
+        concurrently (data is what has been read from it already)
         """
-        if file:
-            return self.client.Object(self.bucket, key).put(Body=file)
-        return self.client.Object(self.bucket, key).put(Body=body)
+        s3client = self.s3client
+        upload_id = s3client.create_multipart_upload(Bucket=self.bucket, Key=key,
+                                                     **extra)['UploadId']
+        def upload(nbr, data):
+            res = s3client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                       PartNumber=nbr, Body=data)
+            return dict(PartNumber=nbr, ETag=res['ETag'])
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = list()
+                pending = set()
+                data = data or file.read(self.part_size)
+                while data:
+                    # read ahead no more than the parts being uploaded
+                    if len(pending) >= self.concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result() # a failed part stops the upload here
+                    future = pool.submit(upload, len(futures) + 1, data)
+                    futures.append(future)
+                    pending.add(future)
+                    data = file.read(self.part_size)
+                parts = [future.result() for future in futures]
+            return s3client.complete_multipart_upload(Bucket=self.bucket, Key=key,
+                                                      UploadId=upload_id,
+                                                      MultipartUpload=dict(Parts=parts))
+        except BaseException:
+            s3client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
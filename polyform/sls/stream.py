@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Streaming reads of pulled data: a response body (anything with read(amt),
+such as an S3 StreamingBody) as a buffered binary file, with large reads,
+so pickle and friends can decode straight from the response rather than
+a spooled copy.  Transfers of LOG_MIN_BYTES or more log their bytes/sec.
+"""
+
+import io
+import os
+import time
+import tempfile
+from .logger import log
+
+# bytes per read from a response body
+CHUNK = int(os.environ.get('DEX_READ_BUFFER', 1 << 20))
+LOG_MIN_BYTES = 1 << 20
+
+class BodyReader(io.RawIOBase):
+    """
+    A raw (unbuffered) binary stream over a response body, counting bytes.
+    Closing it closes body, and source (what body decodes, if it does).
+
+    >>> rfd = open_stream(io.BytesIO(b'x' * 10))
+    >>> rfd.read(4), rfd.read(), rfd.raw.nbytes
+    (b'xxxx', b'xxxxxx', 10)
+    """
+    def __init__(self, body, source=None):
+        super().__init__()
+        self._body = body
+        self._source = source
+        self._readinto = getattr(body, 'readinto', None)
+        self.nbytes = 0
+        self.start = time.perf_counter()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf): # pylint: disable=arguments-differ
+        if self._readinto:
+            size = self._readinto(buf) or 0
+        else:
+            data = self._body.read(len(buf))
+            size = len(data)
+            buf[:size] = data
+        self.nbytes += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            for body in (self._body, self._source):
+                if hasattr(body, 'close'):
+                    body.close()
+        super().close()
+
+    def rate(self):
+        """bytes per second so far"""
+        return self.nbytes / max(time.perf_counter() - self.start, 1e-9)
+
+def open_stream(body, buffer_size=CHUNK, source=None):
+    """a response body as a buffered binary file"""
+    return io.BufferedReader(BodyReader(body, source=source), buffer_size=buffer_size)
+
+def copy_stream(rfd, wfd, chunk=CHUNK):
+    """
+    copy a (buffered) stream into wfd with large reads, giving the bytes
+    copied
+
+    >>> wfd = io.BytesIO()
+    >>> copy_stream(open_stream(io.BytesIO(b'abc')), wfd), wfd.getvalue()
+    (3, b'abc')
+    """
+    view = memoryview(bytearray(chunk))
+    total = 0
+    while True:
+        size = rfd.readinto(view)
+        if not size:
+            return total
+        wfd.write(view[:size])
+        total += size
+
+def spool(write):
+    """
+    a temporary file, written by write(wfd) and rewound for reading (or
+    closed, if write fails)
+
+    >>> with spool(lambda wfd: wfd.write(b'abc')) as rfd:
+    ...     rfd.read()
+    b'abc'
+    """
+    wfd = tempfile.TemporaryFile()
+    try:
+        write(wfd)
+    except Exception: # pylint: disable=broad-except
+        wfd.close()
+        raise
+    wfd.seek(0)
+    return wfd
+
+def log_rate(operation, key, reader):
+    """log the bytes/sec of a finished transfer, if it was a big one"""
+    if reader.nbytes >= LOG_MIN_BYTES:
+        log(type="io", op=operation, key=key, bytes=reader.nbytes,
+            seconds=round(time.perf_counter() - reader.start, 3),
+            mbps=round(reader.rate() / 1e6, 1))
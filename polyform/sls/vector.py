@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+DEX builtins which work on scalars, and elementwise on NumPy arrays and
+pandas Series/DataFrames, so checks over a batch of values run in NumPy.
+
+Comparisons and in_range() on arrays give boolean masks, which count as
+true when all of their elements are (see dex_true).
+
+NumPy and pandas aren't imported here: nothing can be an array until
+something else has imported them, so their types are only looked for once
+it has (see loaded_types).
+"""
+
+import sys
+import numbers
+from .lazy import force
+
+# type labels for is()/are(): python types (numpy and pandas ones by name),
+# and the numpy dtype kinds which match them (None: check each element of
+# an object array)
+TYPE_LABELS = {
+    'bool': ((bool, 'numpy.bool_'), 'b'),
+    'int': ((numbers.Integral,), 'iu'),
+    'float': ((float, 'numpy.floating'), 'f'),
+    'number': ((numbers.Number,), 'biuf'),
+    'str': ((str,), 'U'),
+    'bytes': ((bytes,), 'S'),
+    'dict': ((dict,), None),
+    'list': ((list,), None),
+    'array': (('numpy.ndarray',), None),
+    'series': (('pandas.Series',), None),
+    'dataframe': (('pandas.DataFrame',), None),
+    'pandas:data_frame': (('pandas.DataFrame',), None),
+}
+
+# values which are plainly true or false
+PLAIN_TYPES = frozenset((bool, int, float, str, bytes, dict, list, tuple, type(None)))
+
+# the labels checked against an array's elements, not the array itself
+ELEMENT_LABELS = ('bool', 'int', 'float', 'number', 'str', 'bytes', 'dict', 'list')
+
+def loaded_types(*names):
+    """
+    The types named ('module.name', or a type as is), less those of modules
+    which haven't been imported: nothing can be one of those yet.
+
+    >>> loaded_types(int, 'numbers.Number', 'no_such_module.Type')
+    (<class 'int'>, <class 'numbers.Number'>)
+    """
+    types = list()
+    for name in names:
+        if isinstance(name, str):
+            module, _, attr = name.rpartition('.')
+            if module in sys.modules:
+                types.append(getattr(sys.modules[module], attr))
+        else:
+            types.append(name)
+    return tuple(types)
+
+def is_array(value):
+    """is this an array like (numpy/pandas) value"""
+    return isinstance(value, loaded_types('numpy.ndarray', 'pandas.Series', 'pandas.DataFrame'))
+
+def dex_true(value):
+    """
+    DEX truthiness.  Boolean arrays are true if all elements are, other
+    arrays are true (they are data, not a check), as are DataFrames.
+
+    >>> import numpy, pandas
+    >>> dex_true(numpy.array([True, True])), dex_true(numpy.array([True, False]))
+    (True, False)
+    >>> dex_true(pandas.Series([0.2, 0.5])), dex_true(pandas.Series([0.2, 0.5]) > 0.3)
+    (True, False)
+    >>> dex_true(numpy.bool_(False)), dex_true(numpy.array(0)), dex_true(0), dex_true([1])
+    (False, False, False, True)
+    """
+    if type(value) in PLAIN_TYPES: # pylint: disable=unidiomatic-typecheck
+        return bool(value)
+    if isinstance(value, loaded_types('numpy.ndarray', 'pandas.Series')):
+        # a 0-d array's all() is its own truth
+        if value.ndim == 0 or value.dtype.kind == 'b':
+            return bool(value.all())
+        return True
+    if isinstance(value, loaded_types('pandas.DataFrame')):
+        if len(value.columns) and all(kind == 'b' for kind in value.dtypes.map(lambda dt: dt.kind)):
+            return bool(value.values.all())
+        return True
+    return bool(value)
+
+def dex_all(data):
+    """
+    all(), in NumPy for arrays
+
+    >>> import numpy
+    >>> dex_all(numpy.array([1, 2])), dex_all([1, 0])
+    (True, False)
+    """
+    data = force(data)
+    if is_array(data):
+        import numpy # pylint: disable=import-outside-toplevel
+        return bool(numpy.all(data))
+    return all(data)
+
+def dex_any(data):
+    """
+    any(), in NumPy for arrays
+
+    >>> import numpy
+    >>> dex_any(numpy.array([0, 2])), dex_any([0, 0])
+    (True, False)
+    """
+    data = force(data)
+    if is_array(data):
+        import numpy # pylint: disable=import-outside-toplevel
+        return bool(numpy.any(data))
+    return any(data)
+
+def dex_in_range(data, start, end):
+    """
+    is data (each element of it) between start and end, inclusive
+
+    >>> import numpy
+    >>> dex_in_range(0.5, 0, 1)
+    True
+    >>> dex_in_range(numpy.array([0.1, 1.5]), 0, 1)
+    array([ True, False])
+    """
+    data = force(data)
+    if is_array(data):
+        return (data >= start) & (data <= end)
+    return start <= data <= end
+
+def type_mask(data, label):
+    """
+    elementwise: does each element of an array match the type label
+
+    >>> import numpy, pandas
+    >>> type_mask(numpy.array([1.0, 2.0]), 'float')
+    array([ True,  True])
+    >>> type_mask(pandas.Series(['a', 1]), 'str').tolist()
+    [True, False]
+    """
+    import numpy # pylint: disable=import-outside-toplevel
+    types, kinds = TYPE_LABELS[label]
+    types = loaded_types(*types)
+    values = numpy.asarray(data)
+    if kinds and values.dtype.kind in kinds:
+        return numpy.ones(values.shape, dtype=bool)
+    if values.dtype.kind != 'O':
+        return numpy.zeros(values.shape, dtype=bool)
+    check = numpy.frompyfunc(lambda elem: isinstance(elem, types), 1, 1)
+    return check(values).astype(bool)
+
+def dex_is(data, label):
+    """
+    Raise a TypeError unless data is of the type label (or class), otherwise
+    return data.  Arrays are checked by element for scalar labels, by dtype
+    when it can be (without a python loop).
+
+    >>> import numpy, pandas
+    >>> dex_is(1, 'int'), dex_is(numpy.array([1, 2]), 'int')
+    (1, array([1, 2]))
+    >>> dex_is(numpy.array([1, 2]), 'array').shape
+    (2,)
+    >>> dex_is(pandas.Series([1.0, None]), 'float').size
+    2
+    >>> dex_is(numpy.array(['a', 'b']), 'float')
+    Traceback (most recent call last):
+    ...
+    TypeError: is(): expected float, 2 of 2 elements are not
+    >>> dex_is('x', 'number')
+    Traceback (most recent call last):
+    ...
+    TypeError: is(): expected number, not str
+    """
+    value = force(data)
+    if isinstance(label, type):
+        if isinstance(value, label):
+            return data
+        raise TypeError("is(): expected {}, not {}".format(label.__name__, type(value).__name__))
+    if label not in TYPE_LABELS:
+        raise TypeError("is(): Unrecognized type label: {}".format(label))
+    if is_array(value) and label in ELEMENT_LABELS:
+        mask = type_mask(value, label)
+        if not mask.all():
+            raise TypeError("is(): expected {}, {} of {} elements are not".format(
+                label, mask.size - int(mask.sum()), mask.size))
+        return data
+    if isinstance(value, loaded_types(*TYPE_LABELS[label][0])):
+        return data
+    raise TypeError("is(): expected {}, not {}".format(label, type(value).__name__))
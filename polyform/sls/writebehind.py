@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# vim:set expandtab ts=4 sw=4 ai ft=python:
+"""
+Copyright 2019 Brandon Gillespie; All rights reserved.
+
+Write-behind push(), for finish blocks:
+
+    #!DEX write_behind=true
+    push(model, result->model, "*>>pickle")
+
+(or DEX_WRITE_BEHIND=true, for every finish block).  Each push is encoded
+when it is made, so later changes to the data don't leak into it, but the
+write is queued, and only the last push of an id is written.  The queue is
+flushed concurrently (on the batch pool) as soon as the block is done, so
+the writes overlap validating the output, and are waited for before the
+handler returns: a failed write still fails the invocation.  A pull of an
+id with a queued write makes that write first.
+"""
+
+import os
+import time
+import threading
+from .batch import batch_pool, BatchError
+from .logger import log
+
+DEFAULT = os.environ.get('DEX_WRITE_BEHIND', 'false').lower() == 'true'
+
+def write_behind(plan):
+    """does plan (a finish block) queue its pushes"""
+    return plan.pragmas.get('write_behind', DEFAULT) is True
+
+class WriteQueue():
+    """
+    Queued writes, by key; the last queued for a key replaces any before it.
+
+    >>> done = list()
+    >>> writes = WriteQueue()
+    >>> for value in (1, 2, 3):
+    ...     _ = writes.put('a', lambda value=value: done.append(('a', value)) or True)
+    >>> _ = writes.put('b', lambda: done.append(('b', 1)) or True)
+    >>> len(writes), writes.coalesced, writes.owners('a')
+    (2, 2, {None})
+    >>> writes.settle('b')
+    >>> writes.flush()
+    >>> writes.join() # doctest: +ELLIPSIS
+    20... msg="Flushed Writes" writes=1 coalesced=2 failed=0 seconds=...
+    [True]
+    >>> sorted(done)
+    [('a', 3), ('b', 1)]
+    """
+    def __init__(self):
+        self.coalesced = 0
+        self.owner = None # who put() queues writes for, see owners()
+        self._owners = dict() # key: owners of the writes queued for it
+        self._queued = dict() # key: (write, discard)
+        self._running = list() # (key, future or write)
+        self._lock = threading.Lock()
+        self._start = None
+
+    def __len__(self):
+        return len(self._queued)
+
+    def put(self, key, write, discard=None):
+        """queue write() for key; discard() is called if it is replaced"""
+        with self._lock:
+            old = self._queued.pop(key, None)
+            self._queued[key] = (write, discard)
+            self._owners.setdefault(key, set()).add(self.owner)
+            if old:
+                self.coalesced += 1
+        if old and old[1]:
+            old[1]()
+        return dict(queued=key)
+
+    def owners(self, key):
+        """the owners of the writes queued for key, which its write stands for"""
+        return self._owners.get(key, set())
+
+    def settle(self, key):
+        """make the queued write for key now, if there is one"""
+        with self._lock:
+            entry = self._queued.pop(key, None)
+        if entry:
+            entry[0]()
+
+    def flush(self):
+        """start every queued write"""
+        with self._lock:
+            queued, self._queued = self._queued, dict()
+        self._start = time.perf_counter()
+        pool = batch_pool()
+        for key, (write, _discard) in queued.items():
+            self._running.append((key, pool.submit(write) if pool else write))
+
+    def join(self):
+        """wait for the flushed writes, giving their results; a BatchError if any failed"""
+        running, self._running = self._running, list()
+        results = list()
+        errors = dict()
+        for index, (_key, call) in enumerate(running):
+            try:
+                results.append(call.result() if hasattr(call, 'result') else call())
+            except Exception as err: # pylint: disable=broad-except
+                results.append(None)
+                errors[index] = err
+        if running:
+            log(type="exec", msg="Flushed Writes", writes=len(running), coalesced=self.coalesced,
+                failed=len(errors), seconds=round(time.perf_counter() - self._start, 3))
+        if errors:
+            raise BatchError('push', [key for key, _call in running], results, errors)
+        return results
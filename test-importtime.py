@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Cold start budget for `polyform.sls`: import it as a Lambda cold start
+does, under `python -X importtime`, and fail if that is over budget, or if
+it imports a dependency which should only be imported when first used.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+MODULE = "polyform.sls.decorators"
+
+# milliseconds, best of --runs (generous: the heavy imports are what matter)
+BUDGET = 400
+
+# imported when first used, never by importing polyform.sls
+LAZY = ('pandas', 'numpy', 'datacleaner', 'sklearn', 'jwt', 'boto3', 'botocore',
+        'pyarrow', 'asyncio')
+
+def importtime(module):
+    """{module: (self us, cumulative us)} for a fresh import of module"""
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                          stderr=subprocess.PIPE, env=env, check=False,
+                          universal_newlines=True)
+    if proc.returncode:
+        sys.exit(proc.stderr)
+    times = dict()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        selft, cumulative, name = line[len("import time:"):].split("|")
+        if selft.strip().isdigit():
+            times[name.strip()] = (int(selft), int(cumulative))
+    return times
+
+def main():
+    """ .. main .. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=int, default=BUDGET, help="milliseconds")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--module", default=MODULE)
+    args = parser.parse_args()
+
+    runs = [importtime(args.module) for _ in range(args.runs)]
+    best = min(runs, key=lambda times: times[args.module][1])
+    took = best[args.module][1] / 1000
+    print("{} imports in {:.0f}ms (budget {}ms), slowest modules:".format(
+        args.module, took, args.budget))
+    for name, (selft, _cumulative) in sorted(best.items(), key=lambda item: -item[1][0])[:10]:
+        print("  {:>8.1f}ms {}".format(selft / 1000, name))
+
+    failed = False
+    eager = [name for name in best if name.split('.')[0] in LAZY]
+    if eager:
+        print("FAIL: imported eagerly: " + ", ".join(sorted(set(n.split('.')[0] for n in eager))))
+        failed = True
+    if took > args.budget:
+        print("FAIL: over budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Round trips through `polyform.sls.s3_min` against moto's S3 stand-in:
+puts (single and multipart, compressed, deduplicated), gets (streamed in
+parts), revalidation by ETag, cleanup of failed uploads (which stop at the
+failed part), and the CLI's node-push and node-pull on a compressed store.
+Needs moto.
+"""
+
+import io
+import os
+import sys
+import argparse
+import tempfile
+
+def check(what, got, want):
+    """print what, and exit if got isn't want"""
+    print("  {:<40} {}".format(what, "ok" if got == want else "FAIL"))
+    if got != want:
+        sys.exit("FAIL: {}: {!r} != {!r}".format(what, got, want))
+
+class FailingFile(io.BytesIO):
+    """a file whose third read fails"""
+    reads = 0
+    def read(self, size=-1):
+        self.reads += 1
+        if self.reads == 3:
+            raise IOError("disk")
+        return super().read(size)
+
+def store(**config):
+    """an S3Min over a fresh bucket, in 5 MB parts"""
+    from polyform.sls.s3_min import S3Min # pylint: disable=import-outside-toplevel
+    s3store = S3Min(schema=dict(Bucket='TEST-BUCKET'), part_size=5 << 20, concurrency=3,
+                    config=config)
+    s3store.s3client.create_bucket(Bucket=s3store.bucket)
+    return s3store
+
+def round_trips(s3store, data):
+    """put and get items of several sizes, checking what comes back"""
+    for size in (0, 5, (5 << 20) - 1, 5 << 20, (12 << 20) + 7):
+        s3store.put(key='item', file=io.BytesIO(data[:size]))
+        body, etag = s3store.fetch('item')
+        check("{} bytes".format(size), body.read() == data[:size], True)
+        body.close()
+        check("{} bytes unchanged".format(size), s3store.fetch('item', etag=etag), (None, etag))
+    check("get()", s3store.get('item').read(1000) == data[:1000], True)
+    if not s3store.compress: # download() gets items as stored
+        wfd = io.BytesIO()
+        check("download()", (s3store.download('item', wfd), wfd.getvalue() == data),
+              (len(data), True))
+
+def node_round_trip(data):
+    """`poly dudb node-push` then `node-pull` of data, on a compressed store"""
+    from polyform.cli import dudb # pylint: disable=import-outside-toplevel
+    def resources():
+        return {'s3-p1': dict(role='BackingData', driver='aws-s3',
+                              schema=dict(Bucket='TEST-BUCKET'), config=dict(compress='gzip'))}
+    with tempfile.NamedTemporaryFile() as infile:
+        infile.write(data)
+        infile.flush()
+        dudb.cmd_node_push(resources(), 'node', infile.name)
+    stdout, sys.stdout = sys.stdout, io.TextIOWrapper(io.BytesIO())
+    try:
+        dudb.cmd_node_pull(resources(), 'node')
+        sys.stdout.flush()
+        pulled = sys.stdout.buffer.getvalue()
+    finally:
+        sys.stdout = stdout
+    return pulled
+
+def main():
+    """ .. main .. """
+    parser = argparse.ArgumentParser()
+    parser.parse_args()
+    try:
+        from moto import mock_aws # pylint: disable=import-outside-toplevel
+    except ImportError:
+        sys.exit("moto is not installed (pip install 'moto[s3]')")
+    os.environ.update(AWS_ACCESS_KEY_ID='test', AWS_SECRET_ACCESS_KEY='test',
+                      AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    os.environ.pop('AWS_ENDPOINT_URL_S3', None)
+    data = os.urandom((12 << 20) + 7)
+
+    for config in (dict(), dict(compress='gzip'), dict(dedupe=True)):
+        print("S3Min(config={})".format(config))
+        with mock_aws():
+            s3store = store(**config)
+            round_trips(s3store, data)
+            if s3store.compress:
+                check("node-push, node-pull", node_round_trip(data) == data, True)
+            try:
+                s3store.fetch('missing')
+            except FileNotFoundError:
+                check("missing item", True, True)
+
+    print("failed uploads")
+    with mock_aws():
+        s3store = store()
+        try:
+            s3store.put(key='failed', file=FailingFile(data))
+        except IOError:
+            pass
+        uploads = s3store.s3client.list_multipart_uploads(Bucket=s3store.bucket)
+        check("aborted", uploads.get('Uploads'), None)
+        check("not put", s3store.exists('failed'), False)
+        check("no parts after a failed part", failed_part(s3store, data), 2)
+
+def failed_part(s3store, data):
+    """put data, one part at a time, with its second part failing: the parts tried"""
+    s3client = s3store.s3client
+    tried = list()
+    def upload_part(**args):
+        tried.append(args['PartNumber'])
+        if args['PartNumber'] == 2:
+            raise IOError("part")
+        return upload(**args)
+    upload, s3client.upload_part = s3client.upload_part, upload_part
+    s3store.concurrency = 1
+    try:
+        s3store.put(key='failed', file=io.BytesIO(data))
+    except IOError:
+        pass
+    finally:
+        del s3client.upload_part
+    return len(tried)
+
+if __name__ == '__main__':
+    main()